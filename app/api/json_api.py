@@ -0,0 +1,468 @@
+"""Versioned JSON API for automation (``/api/v1``).
+
+Does the same work as the HTML wizard without rendering pages: upload
+recipients as a JSON array or a streamed NDJSON body, set the template, and
+send, or do all three with one ``POST /api/v1/batches``. Large CSV files
+can be sent in resumable chunks under ``/api/v1/uploads``. Requests
+authenticate with a bearer token issued from a browser session
+(``POST /api/v1/token``), and act on that session's batch and connected
+Gmail accounts.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from pydantic import BaseModel, Field
+from starlette import status
+from starlette.requests import ClientDisconnect
+from starlette.responses import JSONResponse, Response
+
+from app.config import get_settings
+from app.dependencies import get_api_session_id, get_session_id
+from app.models.domain import BatchState, TemplateContent
+from app.services.admission import check_send_capacity, get_work_limiter
+from app.services.api_tokens import issue_api_token
+from app.services.batch_sending import enqueue_messages, send_inline, sync_queue_results
+from app.services.csv_loader import ParsedCSV, RecipientBuilder, parse_recipient_records
+from app.services.deliverability import precheck_recipients, suspend_flagged
+from app.services.gmail import get_gmail_client
+from app.services.sender_pool import SenderPool
+from app.services.store import get_store
+from app.services.template_renderer import TemplateRenderingError, render_batch
+from app.services.uploads import ChunkedUpload, UploadError, get_upload_store
+
+router = APIRouter(prefix="/api/v1", tags=["api"])
+
+NDJSON = "application/x-ndjson"
+# NDJSON lines parsed and validated per worker thread hop.
+_NDJSON_CHUNK_LINES = 1000
+# Bytes of an upload chunk written and parsed per worker thread hop.
+_UPLOAD_WRITE_BYTES = 1024 * 1024
+
+
+class TokenOut(BaseModel):
+    token: str
+    expires_in: int = Field(..., description="Seconds until the token expires")
+
+
+class TemplateIn(BaseModel):
+    subject: str = Field(..., min_length=1)
+    body: str = Field(..., min_length=1)
+
+
+class BatchIn(TemplateIn):
+    recipients: list[dict[str, object]]
+    send: bool = False
+
+
+class RecipientsOut(BaseModel):
+    count: int
+    columns: list[str]
+    domain_warnings: dict[str, str] = Field(
+        default_factory=dict, description="Domains whose messages will be suspended, with the reason"
+    )
+
+
+class UploadIn(BaseModel):
+    length: Optional[int] = Field(None, ge=0, description="Total size of the file in bytes, if known")
+
+
+class UploadOut(BaseModel):
+    id: str
+    offset: int = Field(..., description="Bytes received so far; the next chunk starts here")
+    length: Optional[int] = None
+    rows: int = Field(..., description="Data rows validated so far")
+    invalid: int = Field(..., description="Rows that failed validation so far")
+
+
+class SendOut(BaseModel):
+    mode: str
+    counts: dict[str, int]
+
+
+class BatchOut(BaseModel):
+    recipients: int
+    columns: list[str]
+    subject: Optional[str] = None
+    messages: int
+    counts: dict[str, int]
+    domain_warnings: dict[str, str] = Field(default_factory=dict)
+    send: Optional[SendOut] = None
+
+
+class MessageOut(BaseModel):
+    index: int
+    email: str
+    subject: str
+    body: Optional[str] = None
+    approved: bool
+    status: str
+    error_message: Optional[str] = None
+    sent_at: Optional[datetime] = None
+
+
+class MessagesOut(BaseModel):
+    total: int
+    items: list[MessageOut]
+
+
+def _unprocessable(errors: list[str]) -> HTTPException:
+    # A literal: older Starlette releases lack HTTP_422_UNPROCESSABLE_CONTENT.
+    return HTTPException(status_code=422, detail=errors)
+
+
+def _conflict(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
+
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[list[tuple[int, bytes]]]:
+    """Yield the non-blank lines of a streamed NDJSON body in numbered chunks."""
+
+    pending = b""
+    number = 0
+    lines: list[tuple[int, bytes]] = []
+    async for chunk in request.stream():
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        for line in complete:
+            number += 1
+            if line.strip():
+                lines.append((number, line))
+        if len(lines) >= _NDJSON_CHUNK_LINES:
+            yield lines
+            lines = []
+    if pending.strip():
+        lines.append((number + 1, pending))
+    if lines:
+        yield lines
+
+
+def _json_line(line: bytes, number: int) -> object:
+    try:
+        return json.loads(line)
+    except UnicodeDecodeError as exc:
+        raise _unprocessable([f"Line {number}: not valid UTF-8"]) from exc
+    except json.JSONDecodeError as exc:
+        raise _unprocessable([f"Line {number}: invalid JSON ({exc.msg})"]) from exc
+
+
+def _add_lines(builder: RecipientBuilder, lines: list[tuple[int, bytes]]) -> None:
+    for number, line in lines:
+        builder.add_record(_json_line(line, number), number)
+
+
+async def _read_recipients(request: Request) -> ParsedCSV:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == NDJSON:
+        builder = RecipientBuilder()
+        # Parse and validate off the event loop, a bounded chunk at a time,
+        # so a large upload neither blocks other requests nor is buffered.
+        # A work slot is held while parsing, not while waiting on the client.
+        async for lines in _ndjson_lines(request):
+            async with get_work_limiter().admit():
+                await asyncio.to_thread(_add_lines, builder, lines)
+        return builder.result()
+    try:
+        payload = await request.json()
+    except ValueError as exc:
+        raise _unprocessable(["Body must be a JSON array of recipients or NDJSON"]) from exc
+    if isinstance(payload, dict):
+        payload = payload.get("recipients")
+    if not isinstance(payload, list):
+        raise _unprocessable(["Body must be a JSON array of recipients or NDJSON"])
+    async with get_work_limiter().admit():
+        return await asyncio.to_thread(parse_recipient_records, payload)
+
+
+def _store_recipients(state: BatchState, result: ParsedCSV) -> None:
+    if result.errors:
+        raise _unprocessable(result.errors)
+    if not result.recipients:
+        raise _unprocessable(["No recipients given."])
+    state.recipients = result.recipients
+    state.template = None
+    state.messages = []
+    state.send_batch_id = None
+
+
+def _apply_template(state: BatchState, template: TemplateIn) -> None:
+    content = TemplateContent(subject_template=template.subject.strip(), body_template=template.body.strip())
+    try:
+        messages = render_batch(content, state.recipients, isolated=True)
+    except TemplateRenderingError as exc:
+        raise _unprocessable([str(exc)]) from exc
+    suspend_flagged(messages, state.domain_warnings)
+    state.template = content
+    state.messages = messages
+    state.send_batch_id = None
+
+
+def _upload_error(exc: UploadError) -> HTTPException:
+    headers = {"Upload-Offset": str(exc.offset)} if exc.offset is not None else None
+    return HTTPException(status_code=exc.status_code, detail=str(exc), headers=headers)
+
+
+def _upload_out(upload: ChunkedUpload) -> UploadOut:
+    return UploadOut(
+        id=upload.id,
+        offset=upload.offset,
+        length=upload.length,
+        rows=upload.parser.rows,
+        invalid=len(upload.parser.errors),
+    )
+
+
+def _counts(state: BatchState) -> dict[str, int]:
+    return dict(Counter(message.status for message in state.messages))
+
+
+async def _send(session_id: str, state: BatchState) -> SendOut:
+    if not state.messages or not state.template:
+        raise _conflict("Upload recipients and set a template before sending.")
+    senders = await SenderPool.connect(get_gmail_client(), session_id)
+    if not senders:
+        raise _conflict("No Gmail account is connected; connect one in the web app first.")
+    approved = sum(1 for message in state.messages if message.approved)
+    await asyncio.to_thread(check_send_capacity, approved)
+    mode = get_settings().send_mode
+    if mode == "worker":
+        await asyncio.to_thread(enqueue_messages, session_id, state)
+    else:
+        await send_inline(session_id, senders, state)
+    return SendOut(mode=mode, counts=_counts(state))
+
+
+def _summary(state: BatchState, send: Optional[SendOut] = None) -> BatchOut:
+    return BatchOut(
+        recipients=len(state.recipients),
+        columns=list(state.recipients.columns),
+        subject=state.template.subject_template if state.template else None,
+        messages=len(state.messages),
+        counts=_counts(state),
+        domain_warnings=state.domain_warnings,
+        send=send,
+    )
+
+
+@router.post("/token", response_model=TokenOut)
+async def create_token(session_id: str = Depends(get_session_id)) -> TokenOut:
+    """Issue a token for the calling browser session (uses the session cookie)."""
+
+    max_age = get_settings().api_token_max_age_days * 24 * 3600
+    return TokenOut(token=issue_api_token(session_id), expires_in=max_age)
+
+
+@router.put("/recipients", response_model=RecipientsOut)
+async def put_recipients(request: Request, session_id: str = Depends(get_api_session_id)) -> RecipientsOut:
+    """Replace the batch's recipients from a JSON array or an NDJSON stream."""
+
+    result = await _read_recipients(request)
+    state = get_store().get(session_id)
+    _store_recipients(state, result)
+    state.domain_warnings = await precheck_recipients(state.recipients)
+    return RecipientsOut(
+        count=len(state.recipients),
+        columns=list(state.recipients.columns),
+        domain_warnings=state.domain_warnings,
+    )
+
+
+@router.post("/uploads", response_model=UploadOut, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload: Optional[UploadIn] = None, session_id: str = Depends(get_api_session_id)
+) -> JSONResponse:
+    """Start a resumable chunked upload of a recipient CSV."""
+
+    try:
+        created = await asyncio.to_thread(get_upload_store().create, session_id, upload.length if upload else None)
+    except UploadError as exc:
+        raise _upload_error(exc) from exc
+    return JSONResponse(
+        _upload_out(created).model_dump(),
+        status_code=status.HTTP_201_CREATED,
+        headers={"Location": f"{router.prefix}/uploads/{created.id}", "Upload-Offset": "0"},
+    )
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadOut)
+async def get_upload(upload_id: str, response: Response, session_id: str = Depends(get_api_session_id)) -> UploadOut:
+    """Report how much of the upload has arrived, i.e. where to resume."""
+
+    try:
+        upload = get_upload_store().get(session_id, upload_id)
+    except UploadError as exc:
+        raise _upload_error(exc) from exc
+    response.headers["Upload-Offset"] = str(upload.offset)
+    return _upload_out(upload)
+
+
+@router.patch("/uploads/{upload_id}", response_model=UploadOut)
+async def patch_upload(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(..., ge=0),
+    session_id: str = Depends(get_api_session_id),
+) -> UploadOut:
+    """Append the request body at ``Upload-Offset`` and validate the rows it completes.
+
+    Bytes are kept as they arrive, so after a dropped connection the client
+    resumes from the offset ``GET`` reports rather than from this chunk's start.
+    """
+
+    store = get_upload_store()
+
+    async def append(offset: int, data: bytes) -> int:
+        # A work slot is held while parsing, not while waiting on the client.
+        async with get_work_limiter().admit():
+            return await asyncio.to_thread(store.append, upload, offset, data)
+
+    try:
+        upload = store.get(session_id, upload_id)
+        if upload_offset != upload.offset:
+            # Refused before the body is read.
+            raise UploadError(f"Chunk starts at {upload_offset}, expected {upload.offset}", 409, upload.offset)
+        offset = upload_offset
+        pending = bytearray()
+        try:
+            async for chunk in request.stream():
+                pending += chunk
+                if len(pending) >= _UPLOAD_WRITE_BYTES:
+                    offset = await append(offset, bytes(pending))
+                    pending.clear()
+        except ClientDisconnect:
+            pass
+        if pending:
+            await append(offset, bytes(pending))
+    except UploadError as exc:
+        raise _upload_error(exc) from exc
+    response.headers["Upload-Offset"] = str(upload.offset)
+    return _upload_out(upload)
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=RecipientsOut)
+async def complete_upload(upload_id: str, session_id: str = Depends(get_api_session_id)) -> RecipientsOut:
+    """Finish the upload and use it as the batch's recipients."""
+
+    store = get_upload_store()
+    try:
+        upload = store.get(session_id, upload_id)
+        async with get_work_limiter().admit():
+            result = await asyncio.to_thread(store.complete, upload)
+    except UploadError as exc:
+        raise _upload_error(exc) from exc
+    state = get_store().get(session_id)
+    _store_recipients(state, result)
+    state.domain_warnings = await precheck_recipients(state.recipients)
+    return RecipientsOut(
+        count=len(state.recipients),
+        columns=list(state.recipients.columns),
+        domain_warnings=state.domain_warnings,
+    )
+
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_upload(upload_id: str, session_id: str = Depends(get_api_session_id)) -> Response:
+    """Abandon an upload and delete what was received."""
+
+    store = get_upload_store()
+    try:
+        upload = store.get(session_id, upload_id)
+    except UploadError as exc:
+        raise _upload_error(exc) from exc
+    await asyncio.to_thread(store.discard, upload)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.put("/template", response_model=BatchOut)
+async def put_template(template: TemplateIn, session_id: str = Depends(get_api_session_id)) -> BatchOut:
+    """Set the subject and body and render every message."""
+
+    state = get_store().get(session_id)
+    if not state.recipients:
+        raise _conflict("Upload recipients before setting a template.")
+    async with get_work_limiter().admit():
+        await asyncio.to_thread(_apply_template, state, template)
+    return _summary(state)
+
+
+@router.post("/send", response_model=SendOut)
+async def post_send(session_id: str = Depends(get_api_session_id)) -> JSONResponse:
+    """Send the approved messages, or queue them when send workers are in use."""
+
+    state = get_store().get(session_id)
+    result = await _send(session_id, state)
+    code = status.HTTP_202_ACCEPTED if result.mode == "worker" else status.HTTP_200_OK
+    return JSONResponse(result.model_dump(), status_code=code)
+
+
+@router.post("/batches", response_model=BatchOut)
+async def post_batch(batch: BatchIn, session_id: str = Depends(get_api_session_id)) -> JSONResponse:
+    """Create a batch from recipients and a template, optionally sending it."""
+
+    state = get_store().get(session_id)
+    async with get_work_limiter().admit():
+        result = await asyncio.to_thread(parse_recipient_records, batch.recipients)
+        _store_recipients(state, result)
+    # DNS lookups wait on the network, so they do not hold a work slot.
+    state.domain_warnings = await precheck_recipients(state.recipients)
+    async with get_work_limiter().admit():
+        await asyncio.to_thread(_apply_template, state, batch)
+    sent = await _send(session_id, state) if batch.send else None
+    code = status.HTTP_202_ACCEPTED if sent and sent.mode == "worker" else status.HTTP_201_CREATED
+    return JSONResponse(_summary(state, sent).model_dump(mode="json"), status_code=code)
+
+
+@router.get("/batch", response_model=BatchOut)
+async def get_batch(session_id: str = Depends(get_api_session_id)) -> BatchOut:
+    """Summarise the batch with message counts by status."""
+
+    state = get_store().get(session_id)
+    if state.send_batch_id:
+        await asyncio.to_thread(sync_queue_results, session_id, state)
+    return _summary(state)
+
+
+@router.get("/messages", response_model=MessagesOut)
+async def get_messages(
+    session_id: str = Depends(get_api_session_id),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    message_status: Optional[str] = Query(None, alias="status"),
+    include_body: bool = False,
+) -> MessagesOut:
+    """Page through the rendered messages and their send results."""
+
+    state = get_store().get(session_id)
+    if state.send_batch_id:
+        await asyncio.to_thread(sync_queue_results, session_id, state)
+    indexes = [
+        index
+        for index, message in enumerate(state.messages)
+        if message_status is None or message.status == message_status
+    ]
+    items = []
+    for index in indexes[offset : offset + limit]:
+        message = state.messages[index]
+        items.append(
+            MessageOut(
+                index=index,
+                email=message.recipient.email,
+                subject=message.subject,
+                body=message.body if include_body else None,
+                approved=message.approved,
+                status=message.status,
+                error_message=message.error_message,
+                sent_at=message.sent_at,
+            )
+        )
+    return MessagesOut(total=len(indexes), items=items)
+
+
+__all__ = ["router"]
@@ -0,0 +1,87 @@
+"""HTML page rendering helpers shared by the web routes."""
+
+from __future__ import annotations
+
+from typing import Any, Iterator, Optional
+
+from fastapi import Request
+from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.templating import Jinja2Templates
+from starlette import status
+from starlette.responses import Response
+
+from app.config import get_settings
+
+templates = Jinja2Templates(directory="app/templates")
+
+# Jinja yields one string per template node, which is far too small to be a
+# useful network write. Fragments are coalesced until roughly this many
+# characters have accumulated before a chunk is flushed.
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def _coalesce(fragments: Iterator[str], chunk_size: int) -> Iterator[bytes]:
+    buffer: list[str] = []
+    buffered = 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        buffered += len(fragment)
+        if buffered >= chunk_size:
+            yield "".join(buffer).encode("utf-8")
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def _prepend(first: bytes, rest: Iterator[bytes]) -> Iterator[bytes]:
+    yield first
+    yield from rest
+
+
+def stream_template(
+    request: Request,
+    name: str,
+    context: dict[str, Any],
+    status_code: int = status.HTTP_200_OK,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> StreamingResponse:
+    """Render ``name`` incrementally with Jinja's ``generate()``.
+
+    The first chunk is rendered before the response is returned so that
+    errors near the top of a template (missing template, bad context) still
+    surface as a regular 500 instead of a truncated body. Later chunks are
+    produced on demand while the response is being sent.
+    """
+
+    context.setdefault("request", request)
+    for context_processor in templates.context_processors:
+        context.update(context_processor(request))
+    template = templates.get_template(name)
+    chunks = _coalesce(template.generate(context), chunk_size)
+    first: Optional[bytes] = next(chunks, None)
+    body = _prepend(first, chunks) if first is not None else iter(())
+    return StreamingResponse(
+        body,
+        status_code=status_code,
+        media_type="text/html; charset=utf-8",
+    )
+
+
+def render_template(
+    request: Request,
+    name: str,
+    context: dict[str, Any],
+    status_code: int = status.HTTP_200_OK,
+) -> Response:
+    """Render an HTML page, streaming it when enabled in settings."""
+
+    if get_settings().stream_html_responses:
+        return stream_template(request, name, context, status_code=status_code)
+    response: HTMLResponse = templates.TemplateResponse(
+        request, name, context, status_code=status_code
+    )
+    return response
+
+
+__all__ = ["templates", "render_template", "stream_template", "STREAM_CHUNK_SIZE"]
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime
 from typing import Optional
 import re
@@ -15,21 +16,30 @@ from fastapi import (
     File,
     Form,
     HTTPException,
+    Query,
     Request,
     UploadFile,
 )
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, StreamingResponse
 from starlette import status
+from starlette.responses import Response
 
+from app.api.rendering import render_template
 from app.config import get_settings
 from app.dependencies import get_session_id
-from app.models.domain import RenderedEmail, TemplateContent
+from app.models.domain import BatchState, TemplateContent
+from app.services.admission import Overloaded, check_send_capacity, get_work_limiter
+from app.services.batch_sending import enqueue_messages, schedule_messages, send_inline, sync_queue_results
 from app.services.csv_loader import CSVParsingError, ParsedCSV, parse_recipients
+from app.services.deliverability import precheck_recipients, suspend_flagged
 from app.services.docx_loader import DocxProcessingError, extract_plain_text
-from app.services.gmail import GmailClient, get_gmail_client
+from app.services.exporter import select_messages, stream_eml_zip, stream_mbox
+from app.services.gmail import GmailAuthError, GmailClient, get_gmail_client
 from app.services.pending_credentials import get_pending_store
 from app.services.pending_state_store import get_state_store
+from app.services.scheduler import SendPlan, get_schedule_store
+from app.services.send_queue import get_send_queue
+from app.services.sender_pool import SenderPool, account_key, account_keys, get_sender_ledger
 from app.services.token_store import get_token_store
 from app.services.store import get_store
 from app.services.template_renderer import (
@@ -40,15 +50,13 @@ from app.services.template_renderer import (
 
 router = APIRouter()
 logger = logging.getLogger("app.oauth")
-templates = Jinja2Templates(directory="app/templates")
-
 
 def _get_gmail_client() -> GmailClient:
     return get_gmail_client()
 
 
 @router.get("/", response_class=HTMLResponse)
-async def landing(request: Request, session_id: str = Depends(get_session_id)) -> HTMLResponse:
+async def landing(request: Request, session_id: str = Depends(get_session_id)) -> Response:
     store = get_store()
     state = store.get(session_id)
     settings = get_settings()
@@ -62,7 +70,7 @@ async def landing(request: Request, session_id: str = Depends(get_session_id)) -
         "redirect_uri": redirect_uri,
         "alt_redirect_uri": alt_redirect_uri,
     }
-    return templates.TemplateResponse("landing.html", context)
+    return render_template(request, "landing.html", context)
 
 
 @router.post("/credentials")
@@ -111,18 +119,19 @@ async def recipients_form(
     request: Request,
     session_id: str = Depends(get_session_id),
     message: Optional[str] = None,
-) -> HTMLResponse:
+) -> Response:
     state = get_store().get(session_id)
     context = {
         "request": request,
         "recipients": state.recipients,
         "template": state.template,
         "errors": [],
+        "domain_warnings": state.domain_warnings,
         "message": message,
         "draft_body": state.template.body_template if state.template else "",
         "draft_subject": state.template.subject_template if state.template else "",
     }
-    return templates.TemplateResponse("recipients.html", context)
+    return render_template(request, "recipients.html", context)
 
 
 @router.post("/recipients", response_class=HTMLResponse)
@@ -130,12 +139,13 @@ async def recipients_upload(
     request: Request,
     session_id: str = Depends(get_session_id),
     csv_file: UploadFile = File(...),
-) -> HTMLResponse:
+) -> Response:
     store = get_store()
     state = store.get(session_id)
     try:
-        result: ParsedCSV = parse_recipients(csv_file)
-    except CSVParsingError as exc:
+        async with get_work_limiter().admit():
+            result: ParsedCSV = await asyncio.to_thread(parse_recipients, csv_file)
+    except (CSVParsingError, Overloaded) as exc:
         context = {
             "request": request,
             "recipients": state.recipients,
@@ -145,7 +155,11 @@ async def recipients_upload(
             "draft_body": state.template.body_template if state.template else "",
             "draft_subject": state.template.subject_template if state.template else "",
         }
-        return templates.TemplateResponse("recipients.html", context, status_code=status.HTTP_400_BAD_REQUEST)
+        status_code = exc.status_code if isinstance(exc, Overloaded) else status.HTTP_400_BAD_REQUEST
+        response = render_template(request, "recipients.html", context, status_code=status_code)
+        if isinstance(exc, Overloaded) and exc.retry_after:
+            response.headers["Retry-After"] = str(exc.retry_after)
+        return response
 
     if result.errors:
         context = {
@@ -157,23 +171,25 @@ async def recipients_upload(
             "draft_body": state.template.body_template if state.template else "",
             "draft_subject": state.template.subject_template if state.template else "",
         }
-        return templates.TemplateResponse("recipients.html", context, status_code=status.HTTP_400_BAD_REQUEST)
+        return render_template(request, "recipients.html", context, status_code=status.HTTP_400_BAD_REQUEST)
 
     if not result.recipients:
         context = {
             "request": request,
-            "recipients": [],
+            "recipients": result.recipients,
             "errors": ["No valid rows found in the CSV."],
             "message": None,
             "template": state.template,
             "draft_body": state.template.body_template if state.template else "",
             "draft_subject": state.template.subject_template if state.template else "",
         }
-        return templates.TemplateResponse("recipients.html", context, status_code=status.HTTP_400_BAD_REQUEST)
+        return render_template(request, "recipients.html", context, status_code=status.HTTP_400_BAD_REQUEST)
 
     state.recipients = result.recipients
+    state.domain_warnings = await precheck_recipients(result.recipients)
     state.template = None
     state.messages = []
+    state.send_batch_id = None
     return RedirectResponse(url="/recipients", status_code=status.HTTP_303_SEE_OTHER)
 
 
@@ -182,7 +198,7 @@ async def template_form(
     request: Request,
     session_id: str = Depends(get_session_id),
     message: Optional[str] = None,
-) -> HTMLResponse:
+) -> Response:
     return RedirectResponse(url="/recipients", status_code=status.HTTP_303_SEE_OTHER)
 
 
@@ -193,7 +209,7 @@ async def template_submit(
     subject_text: str = Form(""),
     body_text: str = Form(""),
     template_file: Optional[UploadFile] = File(None),
-) -> HTMLResponse:
+) -> Response:
     state = get_store().get(session_id)
     if not state.recipients:
         return RedirectResponse(url="/recipients", status_code=status.HTTP_303_SEE_OTHER)
@@ -208,7 +224,8 @@ async def template_submit(
         source_filename = template_file.filename
         if template_file.filename.lower().endswith(".docx"):
             try:
-                body = extract_plain_text(data)
+                async with get_work_limiter().admit():
+                    body = await asyncio.to_thread(extract_plain_text, data)
             except DocxProcessingError as exc:
                 context = {
                     "request": request,
@@ -220,7 +237,8 @@ async def template_submit(
                     "draft_body": body_text,
                     "draft_subject": subject,
                 }
-                return templates.TemplateResponse(
+                return render_template(
+                    request,
                     "recipients.html",
                     context,
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -239,7 +257,8 @@ async def template_submit(
                     "draft_body": body_text,
                     "draft_subject": subject,
                 }
-                return templates.TemplateResponse(
+                return render_template(
+                    request,
                     "recipients.html",
                     context,
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -256,7 +275,8 @@ async def template_submit(
             "draft_body": body_text,
             "draft_subject": subject,
         }
-        return templates.TemplateResponse(
+        return render_template(
+            request,
             "recipients.html",
             context,
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -273,7 +293,8 @@ async def template_submit(
             "draft_body": body_text,
             "draft_subject": subject,
         }
-        return templates.TemplateResponse(
+        return render_template(
+            request,
             "recipients.html",
             context,
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -285,7 +306,9 @@ async def template_submit(
         source_filename=source_filename,
     )
     try:
-        messages = render_batch(template, state.recipients)
+        async with get_work_limiter().admit():
+            messages = await asyncio.to_thread(render_batch, template, state.recipients, isolated=True)
+        suspend_flagged(messages, state.domain_warnings)
     except TemplateRenderingError as exc:
         context = {
             "request": request,
@@ -297,7 +320,8 @@ async def template_submit(
             "draft_body": body,
             "draft_subject": subject,
         }
-        return templates.TemplateResponse(
+        return render_template(
+            request,
             "recipients.html",
             context,
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -305,6 +329,7 @@ async def template_submit(
 
     state.template = template
     state.messages = messages
+    state.send_batch_id = None
 
     return RedirectResponse(url="/preview", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -314,10 +339,12 @@ async def preview(
     request: Request,
     session_id: str = Depends(get_session_id),
     message: Optional[str] = None,
-) -> HTMLResponse:
+) -> Response:
     state = get_store().get(session_id)
     if not state.recipients or not state.template:
         return RedirectResponse(url="/recipients", status_code=status.HTTP_303_SEE_OTHER)
+    if state.send_batch_id:
+        await asyncio.to_thread(sync_queue_results, session_id, state)
 
     context = {
         "request": request,
@@ -327,8 +354,10 @@ async def preview(
         "auth_status": request.query_params.get("auth"),
         "subject": state.template.subject_template if state.template else "",
         "gmail_authorized": state.gmail_authorized,
+        "sender_accounts": state.sender_accounts,
+        "max_sender_accounts": get_settings().max_sender_accounts,
     }
-    return templates.TemplateResponse("preview.html", context)
+    return render_template(request, "preview.html", context)
 
 
 @router.post("/preview/{index}/toggle")
@@ -347,6 +376,13 @@ async def toggle_approval(
     return RedirectResponse(url="/preview", status_code=status.HTTP_303_SEE_OTHER)
 
 
+def _rerender_subjects(state: BatchState, template: TemplateContent) -> None:
+    for index, message in enumerate(state.messages):
+        context = state.recipients.row(index) if index < len(state.recipients) else None
+        rendered = render_email(template, message.recipient, context)
+        message.subject = rendered.subject
+
+
 @router.post("/preview/update")
 async def update_preview(
     request: Request,
@@ -363,9 +399,8 @@ async def update_preview(
         if body_value is not None:
             message.body = str(body_value)
 
-    for message in state.messages:
-        rendered = render_email(state.template, message.recipient)
-        message.subject = rendered.subject
+    async with get_work_limiter().admit():
+        await asyncio.to_thread(_rerender_subjects, state, state.template)
 
     return RedirectResponse(
         url=f"/preview?message={quote_plus('Changes saved.')}",
@@ -374,8 +409,17 @@ async def update_preview(
 
 
 @router.get("/auth/google/start")
-async def auth_start(request: Request, session_id: str = Depends(get_session_id)) -> RedirectResponse:
+async def auth_start(
+    request: Request,
+    session_id: str = Depends(get_session_id),
+    add_account: bool = False,
+) -> RedirectResponse:
     state = get_store().get(session_id)
+    if add_account and state.sender_accounts >= get_settings().max_sender_accounts:
+        return RedirectResponse(
+            url=f"/preview?error={quote_plus('The maximum number of sender accounts is already connected.')}",
+            status_code=status.HTTP_303_SEE_OTHER,
+        )
     pending_store = get_pending_store()
     pending = pending_store.peek(session_id)
     if pending:
@@ -387,6 +431,9 @@ async def auth_start(request: Request, session_id: str = Depends(get_session_id)
         )
     state_token = secrets.token_urlsafe(32)
     request.session["oauth_state"] = state_token
+    # Which account slot the callback fills: the primary one, or the next
+    # free slot when adding another sender account.
+    request.session["oauth_account"] = state.sender_accounts + 1 if add_account and state.sender_accounts else 1
     # Persist creds keyed by state to avoid cookie reliance during callback
     get_state_store().set(state_token, client_id, client_secret)
     # Use the exact host the user is on to avoid cookie/host mismatches
@@ -448,6 +495,7 @@ async def auth_callback(
             )
 
     request.session.pop("oauth_state", None)
+    account_number = int(request.session.pop("oauth_account", 1))
 
     gmail = _get_gmail_client()
     callback_url = str(request.url_for("auth_callback"))
@@ -461,42 +509,24 @@ async def auth_callback(
         )
     except Exception:
         pass
-    gmail.exchange_code(
-        session_id,
-        code,
-        client_id_override=client_id,
-        client_secret_override=client_secret,
-        redirect_override=callback_url,
-    )
+    try:
+        await gmail.exchange_code(
+            account_key(session_id, account_number),
+            code,
+            client_id_override=client_id,
+            client_secret_override=client_secret,
+            redirect_override=callback_url,
+        )
+    except GmailAuthError as exc:
+        return RedirectResponse(url=f"/preview?auth=error&message={quote_plus(str(exc))}")
     state_data.gmail_authorized = True
+    state_data.sender_accounts = max(state_data.sender_accounts, account_number)
     return RedirectResponse(url="/preview?auth=success")
 
 
-def _send_single_message(
-    gmail: GmailClient,
-    credentials,
-    message: RenderedEmail,
-) -> RenderedEmail:
-    if not message.approved:
-        message.status = "skipped"
-        return message
-    try:
-        gmail.send_message(credentials, message.recipient.email, message.subject, message.body)
-    except Exception as exc:  # pragma: no cover - network dependent
-        message.status = "failed"
-        message.error_message = str(exc)
-    else:
-        message.status = "sent"
-        message.error_message = None
-        message.sent_at = datetime.utcnow()
-    return message
-
+async def _ready_to_send(session_id: str, state: BatchState) -> RedirectResponse | SenderPool:
+    """Check the batch can be sent; return a redirect explaining why not, or the senders."""
 
-@router.post("/send")
-async def send_selected(
-    session_id: str = Depends(get_session_id),
-) -> RedirectResponse:
-    state = get_store().get(session_id)
     if not state.messages or not state.template:
         return RedirectResponse(url="/preview", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -506,17 +536,140 @@ async def send_selected(
             status_code=status.HTTP_303_SEE_OTHER,
         )
 
-    gmail = _get_gmail_client()
-    credentials = gmail.get_credentials(session_id)
-    if not credentials:
+    senders = await SenderPool.connect(_get_gmail_client(), session_id)
+    if not senders:
         return RedirectResponse(url="/auth/google/start", status_code=status.HTTP_302_FOUND)
+    return senders
+
+
+@router.post("/send")
+async def send_selected(
+    session_id: str = Depends(get_session_id),
+) -> RedirectResponse:
+    state = get_store().get(session_id)
+    senders = await _ready_to_send(session_id, state)
+    if isinstance(senders, RedirectResponse):
+        return senders
 
-    for message in state.messages:
-        _send_single_message(gmail, credentials, message)
+    approved = sum(1 for message in state.messages if message.approved)
+    await asyncio.to_thread(check_send_capacity, approved)
+
+    settings = get_settings()
+    if settings.send_mode == "worker":
+        queued = await asyncio.to_thread(enqueue_messages, session_id, state)
+        return RedirectResponse(
+            url=f"/preview?message={quote_plus(f'{queued} message(s) queued for sending.')}",
+            status_code=status.HTTP_303_SEE_OTHER,
+        )
+
+    await send_inline(session_id, senders, state)
 
     return RedirectResponse(url="/preview?message=Send%20complete", status_code=status.HTTP_303_SEE_OTHER)
 
 
+@router.post("/schedule")
+async def schedule_send(
+    session_id: str = Depends(get_session_id),
+    start_at: str = Form(...),
+    timezone: str = Form("UTC"),
+    recipient_local_time: bool = Form(False),
+    window_minutes: int = Form(0),
+    max_per_hour: int = Form(0),
+) -> RedirectResponse:
+    state = get_store().get(session_id)
+    ready = await _ready_to_send(session_id, state)
+    if isinstance(ready, RedirectResponse):
+        return ready
+
+    try:
+        plan = SendPlan(
+            start_at=datetime.fromisoformat(start_at).replace(tzinfo=None),
+            timezone=timezone.strip() or "UTC",
+            recipient_local_time=recipient_local_time,
+            window_minutes=window_minutes,
+            max_per_hour=max_per_hour,
+        )
+    except ValueError as exc:
+        return RedirectResponse(
+            url=f"/preview?error={quote_plus(f'Could not schedule: {exc}')}",
+            status_code=status.HTTP_303_SEE_OTHER,
+        )
+    scheduled = await asyncio.to_thread(schedule_messages, session_id, state, plan)
+    return RedirectResponse(
+        url=f"/schedule?message={quote_plus(f'{scheduled} message(s) scheduled.')}",
+        status_code=status.HTTP_303_SEE_OTHER,
+    )
+
+
+@router.get("/schedule", response_class=HTMLResponse)
+async def schedule_view(
+    request: Request,
+    session_id: str = Depends(get_session_id),
+) -> Response:
+    plans = await asyncio.to_thread(get_schedule_store().summaries, session_id)
+    context = {
+        "request": request,
+        "plans": plans,
+        "message": request.query_params.get("message"),
+        "error": request.query_params.get("error"),
+    }
+    return render_template(request, "schedule.html", context)
+
+
+@router.post("/schedule/{plan_id}/cancel")
+async def schedule_cancel(
+    plan_id: str,
+    session_id: str = Depends(get_session_id),
+) -> RedirectResponse:
+    batch_id, indexes = await asyncio.to_thread(get_schedule_store().cancel, session_id, plan_id)
+    if batch_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Schedule not found")
+    state = get_store().get(session_id)
+    if state.send_batch_id == batch_id:
+        for index in indexes:
+            if index < len(state.messages):
+                state.messages[index].status = "pending"
+    return RedirectResponse(
+        url=f"/schedule?message={quote_plus(f'Cancelled {len(indexes)} unsent message(s).')}",
+        status_code=status.HTTP_303_SEE_OTHER,
+    )
+
+
+_EXPORT_FORMATS = {
+    "eml": (stream_eml_zip, "application/zip", "batch.zip"),
+    "mbox": (stream_mbox, "application/mbox", "batch.mbox"),
+}
+
+
+@router.get("/export/{export_format}")
+async def export_batch(
+    export_format: str,
+    session_id: str = Depends(get_session_id),
+    message_status: Optional[list[str]] = Query(None, alias="status"),
+    approved: Optional[bool] = None,
+) -> Response:
+    """Download the batch as a ZIP of .eml files (``eml``) or one mbox file."""
+
+    if export_format not in _EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown export format")
+    state = get_store().get(session_id)
+    if not state.messages:
+        return RedirectResponse(url="/recipients", status_code=status.HTTP_303_SEE_OTHER)
+    if state.send_batch_id:
+        await asyncio.to_thread(sync_queue_results, session_id, state)
+
+    stream, media_type, filename = _EXPORT_FORMATS[export_format]
+    # Copy the list so a reset or re-render during the download does not
+    # change which messages it covers.
+    statuses = {value for value in message_status or () if value}
+    selected = select_messages(list(state.messages), statuses, approved)
+    return StreamingResponse(
+        stream(selected),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get("/recipient-template")
 async def download_template() -> FileResponse:
     return FileResponse(
@@ -526,9 +679,23 @@ async def download_template() -> FileResponse:
     )
 
 
+def _forget_session(session_id: str) -> None:
+    """Delete everything stored for a session (SQLite and token file I/O)."""
+
+    # Earlier batches may still have rows even after a re-upload cleared
+    # ``send_batch_id``, so purge whenever the queue database exists.
+    if get_settings().send_queue_path.exists():
+        get_send_queue().purge_session(session_id)
+        get_schedule_store().purge_session(session_id)
+    token_store = get_token_store()
+    for key in account_keys(session_id):
+        token_store.clear(key)
+        get_sender_ledger().forget(key)
+    get_pending_store().pop(session_id)
+
+
 @router.post("/reset")
 async def reset_session(session_id: str = Depends(get_session_id)) -> RedirectResponse:
     get_store().clear(session_id)
-    get_token_store().clear(session_id)
-    get_pending_store().pop(session_id)
+    await asyncio.to_thread(_forget_session, session_id)
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
@@ -2,8 +2,9 @@
 
 from functools import lru_cache
 from pathlib import Path
+from typing import Literal
 
-from pydantic import Field
+from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -30,6 +31,262 @@ class Settings(BaseSettings):
         "http://localhost:8000/auth/google/callback",
         description="OAuth redirect URI",
     )
+    google_auth_uri: str = Field(
+        "https://accounts.google.com/o/oauth2/auth",
+        description="OAuth authorization endpoint",
+    )
+    google_token_uri: str = Field(
+        "https://oauth2.googleapis.com/token",
+        description="OAuth token endpoint used for code exchange and refresh",
+    )
+    gmail_api_base_url: str = Field(
+        "https://gmail.googleapis.com/",
+        description="Base URL of the Gmail API (point at a stand-in for load tests)",
+    )
+    gmail_http2: bool = Field(
+        True,
+        description="Use HTTP/2 for Google APIs when the h2 package is installed",
+    )
+    gmail_timeout_seconds: float = Field(
+        30.0,
+        description="Timeout for each request to Google APIs",
+    )
+    gmail_max_connections: int = Field(
+        20,
+        description="Size of the keep-alive connection pool to Google APIs",
+    )
+    gmail_max_retries: int = Field(
+        3,
+        description="Retries for a send throttled with 429 or refused a connection",
+    )
+    gmail_max_retry_after_seconds: float = Field(
+        60.0,
+        gt=0,
+        description="Longest Retry-After delay from Gmail that is honoured; longer ones are cut to this",
+    )
+    send_concurrency: int = Field(
+        8,
+        ge=1,
+        description="Messages one session may have in flight at once",
+    )
+    send_total_concurrency: int = Field(
+        32,
+        ge=1,
+        description="Inline sends in flight at once across all sessions, shared fairly",
+    )
+    send_small_batch_max: int = Field(
+        50,
+        ge=0,
+        description="Batches of at most this many messages are sent ahead of larger ones",
+    )
+    send_fair_quantum_bytes: int = Field(
+        64 * 1024,
+        ge=1,
+        description="Bytes of messages each session may send per fair-share round",
+    )
+    domain_concurrency: int = Field(
+        4,
+        ge=1,
+        description="Sends to one recipient domain allowed in flight at once",
+    )
+    domain_rate_per_second: float = Field(
+        0.0,
+        ge=0,
+        description="Sends per second to one recipient domain (0 = unlimited)",
+    )
+    domain_burst: float = Field(
+        10.0,
+        ge=1,
+        description="Sends to one recipient domain allowed in a burst above the rate",
+    )
+    domain_rate_overrides: dict[str, float] = Field(
+        default_factory=dict,
+        description='Per-domain rates, e.g. {"example.edu": 1}; also applies to subdomains',
+    )
+    domain_precheck_enabled: bool = Field(
+        False,
+        description="Look up MX records of recipient domains after an upload and suspend undeliverable ones",
+    )
+    domain_precheck_nameservers: list[str] = Field(
+        default_factory=list,
+        description="DNS servers for the precheck; empty uses the system resolver",
+    )
+    domain_precheck_port: int = Field(53, ge=1, le=65535, description="Port of the precheck DNS servers")
+    domain_precheck_timeout_seconds: float = Field(
+        3.0,
+        gt=0,
+        description="Time allowed to resolve one domain before its result counts as unknown",
+    )
+    domain_precheck_concurrency: int = Field(
+        64,
+        ge=1,
+        description="Domain lookups in flight at once during a precheck",
+    )
+    domain_precheck_ttl_seconds: int = Field(
+        24 * 3600,
+        ge=0,
+        description="How long a domain that accepts mail stays cached",
+    )
+    domain_precheck_failure_ttl_seconds: int = Field(
+        3600,
+        ge=0,
+        description="How long a domain that does not accept mail stays cached",
+    )
+    domain_precheck_known_domains: list[str] = Field(
+        default_factory=list,
+        description="Domains added to the built-in list that near-miss typos are matched against",
+    )
+    render_timeout_seconds: float = Field(
+        20.0,
+        ge=0,
+        description="Wall-clock limit for rendering a batch whose template runs Jinja code, in a subprocess (0 = in-process)",
+    )
+    render_memory_limit_mb: int = Field(
+        1024,
+        ge=0,
+        description="Address-space limit of the render subprocess in MiB (0 = unlimited)",
+    )
+    render_max_operations: int = Field(
+        100_000,
+        ge=1,
+        description="Loop items from range(), calls and operators one render of a template may use",
+    )
+    render_max_output_chars: int = Field(
+        1_000_000,
+        ge=1,
+        description="Longest subject, body or intermediate string one render may produce",
+    )
+    max_sender_accounts: int = Field(
+        5,
+        ge=1,
+        description="Gmail accounts one session may connect to share sending",
+    )
+    sender_daily_quota: int = Field(
+        2000,
+        ge=1,
+        description="Messages per day each sender account may send",
+    )
+    sender_rate_per_second: float = Field(
+        0.0,
+        ge=0,
+        description="Sends per second allowed per sender account (0 = unlimited)",
+    )
+    sender_burst: float = Field(
+        5.0,
+        ge=1,
+        description="Sends a sender account may burst above its per-second rate",
+    )
+    mime_encode_processes: int = Field(
+        0,
+        ge=0,
+        description="Processes that pre-encode raw messages for large batches (0 encodes inline)",
+    )
+    mime_encode_min_batch: int = Field(
+        500,
+        ge=1,
+        description="Approved messages in a batch before pre-encoding moves to the process pool",
+    )
+    mime_encode_chunk_size: int = Field(
+        256,
+        ge=1,
+        description="Messages encoded per process pool task",
+    )
+    send_mode: Literal["inline", "worker"] = Field(
+        "inline",
+        description="Send from the web process, or queue messages for `python -m app.worker`",
+    )
+    send_queue_path: Path = Field(
+        Path("data/send_queue.sqlite3"),
+        description="SQLite database shared by the web process and send workers",
+    )
+    send_lease_seconds: float = Field(
+        60.0,
+        gt=0,
+        description="How long a worker owns a claimed job without a heartbeat",
+    )
+    send_max_attempts: int = Field(
+        3,
+        ge=1,
+        description="Claims of one job before it is failed as abandoned",
+    )
+    worker_batch_size: int = Field(
+        16,
+        ge=1,
+        description="Jobs a send worker claims at a time",
+    )
+    worker_poll_interval_seconds: float = Field(
+        1.0,
+        gt=0,
+        description="Delay between queue polls when a send worker is idle",
+    )
+    embedded_send_worker: bool = Field(
+        True,
+        description="In inline mode, release scheduled sends from the web process",
+    )
+    max_request_bytes: int = Field(
+        20 * 1024 * 1024,
+        ge=1024,
+        description="Largest request body accepted; bigger uploads get 413",
+    )
+    max_batch_rows: int = Field(
+        100_000,
+        ge=1,
+        description="Most recipients a single batch may hold",
+    )
+    upload_dir: Path = Field(
+        Path("data/uploads"),
+        description="Directory for chunked uploads in progress",
+    )
+    max_upload_bytes: int = Field(
+        512 * 1024 * 1024,
+        ge=1024,
+        description="Largest recipient file a chunked upload may assemble",
+    )
+    max_uploads_per_session: int = Field(
+        3,
+        ge=1,
+        description="Chunked uploads one session may have in progress at once",
+    )
+    xlsx_max_shared_chars: int = Field(
+        64 * 1024 * 1024,
+        ge=1024,
+        description="Characters the shared strings table of an uploaded XLSX workbook may hold",
+    )
+    upload_expiry_minutes: int = Field(
+        60,
+        ge=1,
+        description="Chunked uploads idle for longer than this are discarded",
+    )
+    max_concurrent_work: int = Field(
+        4,
+        ge=1,
+        description="CSV parses, DOCX extractions and renders allowed at once",
+    )
+    admission_wait_seconds: float = Field(
+        2.0,
+        ge=0,
+        description="How long a request waits for a work slot before getting 503",
+    )
+    max_queued_sends: int = Field(
+        200_000,
+        ge=1,
+        description="Messages allowed to wait for sending before new sends get 429",
+    )
+    overload_retry_after_seconds: int = Field(
+        5,
+        ge=1,
+        description="Retry-After value sent with 429 and 503 overload responses",
+    )
+    docx_cache_entries: int = Field(
+        32,
+        ge=0,
+        description="Extracted DOCX templates kept in memory, keyed by content hash",
+    )
+    api_token_max_age_days: int = Field(
+        30,
+        ge=1,
+        description="Days a JSON API token stays valid after it is issued",
+    )
     token_storage_path: Path = Field(
         Path("data/token_store.json"),
         description="File path used to persist encrypted refresh tokens",
@@ -38,6 +295,75 @@ class Settings(BaseSettings):
         120,
         description="Minutes before ephemeral session data is purged",
     )
+    stream_html_responses: bool = Field(
+        True,
+        description="Stream rendered HTML pages in chunks instead of buffering",
+    )
+    metrics_enabled: bool = Field(
+        True,
+        description="Collect metrics and expose them at /metrics",
+    )
+    log_format: Literal["json", "text"] = Field(
+        "json",
+        description="Write app logs as JSON lines or as plain text",
+    )
+    log_level: str = Field(
+        "INFO",
+        description="Lowest level written for the app's own loggers",
+    )
+    log_propagate: bool = Field(
+        False,
+        description="Also pass app log records to the root logger's handlers (e.g. pytest's caplog)",
+    )
+    log_buffer_records: int = Field(
+        10_000,
+        ge=1,
+        description="Log records buffered for the writer thread before new ones are dropped",
+    )
+    tracing_enabled: bool = Field(
+        False,
+        description="Record tracing spans and write them to trace_export_path",
+    )
+    trace_export_path: Path = Field(
+        Path("data/traces.jsonl"),
+        description="File that finished spans are appended to, as OTLP/JSON lines",
+    )
+    trace_export_max_bytes: int = Field(
+        50 * 1024 * 1024,
+        ge=0,
+        description="Size at which the trace file is rotated (0 disables rotation)",
+    )
+    profiling_secret: str | None = Field(
+        None,
+        description="Admin secret that enables per-request profiling and downloads",
+    )
+    profiling_sample_rate: float = Field(
+        0.0,
+        ge=0.0,
+        le=1.0,
+        description="Fraction of requests profiled automatically",
+    )
+    profiling_interval_ms: float = Field(
+        5.0,
+        gt=0,
+        description="Stack sampling interval for request profiles",
+    )
+    profile_storage_path: Path = Field(
+        Path("data/profiles"),
+        description="Directory where captured request profiles are written",
+    )
+    profile_retention: int = Field(
+        50,
+        description="Number of most recent request profiles kept on disk",
+    )
+
+    @model_validator(mode="after")
+    def _sampled_profiles_need_secret(self) -> "Settings":
+        # Sampled profiles can only be downloaded with the secret, so sampling
+        # without one would fill the profile directory with unreachable files.
+        if self.profiling_sample_rate > 0 and not self.profiling_secret:
+            raise ValueError("BATCH_APP_PROFILING_SAMPLE_RATE requires BATCH_APP_PROFILING_SECRET to be set")
+        return self
 
 
 @lru_cache
@@ -3,8 +3,11 @@
 from __future__ import annotations
 
 import secrets
+from typing import Optional
 
-from fastapi import Request
+from fastapi import Header, HTTPException, Request, status
+
+from app.services.api_tokens import api_token_session
 
 
 SESSION_KEY = "session_id"
@@ -20,4 +23,18 @@ def get_session_id(request: Request) -> str:
     return session_id
 
 
-__all__ = ["get_session_id"]
+def get_api_session_id(authorization: Optional[str] = Header(None)) -> str:
+    """Return the session a JSON API request acts for, from its bearer token."""
+
+    scheme, _, token = (authorization or "").partition(" ")
+    session_id = api_token_session(token.strip()) if scheme.lower() == "bearer" else None
+    if not session_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing or invalid API token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return session_id
+
+
+__all__ = ["get_api_session_id", "get_session_id"]
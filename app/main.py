@@ -2,21 +2,71 @@
 
 from __future__ import annotations
 
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
-import logging
 
+from app.api.json_api import router as api_router
 from app.api.routes import router as web_router
 from app.config import get_settings
+from app.middleware import (
+    PROFILE_HEADER,
+    PROFILE_QUERY_PARAM,
+    BodySizeLimitMiddleware,
+    MetricsMiddleware,
+    ProfilingMiddleware,
+    TracingMiddleware,
+    profiling_token_valid,
+)
+from app.services.admission import Overloaded, load_report
+from app.services.gmail import get_gmail_client
+from app.services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.services.metrics import get_registry
+from app.services.mime_builder import shutdown_encoding_pool
+from app.services.profiler import get_profile_store
+from app.services.structured_logging import configure_logging, get_log_handler
+from app.services.template_renderer import shutdown_render_pool
+from app.services.tracing import get_tracer
+from app.worker import run_embedded
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    settings = get_settings()
+    stop = asyncio.Event()
+    embedded = None
+    if settings.send_mode == "inline" and settings.embedded_send_worker:
+        # Scheduled batches are released and sent from this process.
+        embedded = asyncio.create_task(run_embedded(stop))
+    yield
+    stop.set()
+    if embedded is not None:
+        await embedded
+    # Pooled Google API connections belong to this event loop.
+    if get_gmail_client.cache_info().currsize:
+        await get_gmail_client().aclose()
+    shutdown_encoding_pool()
+    shutdown_render_pool()
+    if get_tracer.cache_info().currsize:
+        await asyncio.to_thread(get_tracer().shutdown)
+    if get_log_handler.cache_info().currsize:
+        await asyncio.to_thread(get_log_handler().flush)
 
 
 def create_app() -> FastAPI:
     settings = get_settings()
-    app = FastAPI(title=settings.app_name)
+    # App logs (OAuth diagnostics, send events) are written by a background
+    # thread so log I/O never runs on the event loop.
+    configure_logging()
+    app = FastAPI(title=settings.app_name, lifespan=lifespan)
 
     app.add_middleware(
         SessionMiddleware,
@@ -33,30 +83,87 @@ def create_app() -> FastAPI:
     # Respect X-Forwarded-* headers on platforms like Render to ensure
     # correct scheme/host when constructing absolute callback URLs.
     app.add_middleware(ProxyHeadersMiddleware)
-    # Ensure our OAuth diagnostics are visible at INFO level
-    oauth_logger = logging.getLogger("app.oauth")
-    oauth_logger.setLevel(logging.INFO)
-    if not oauth_logger.handlers:
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter("%(levelname)s:%(name)s:%(message)s")
-        handler.setFormatter(formatter)
-        oauth_logger.addHandler(handler)
     app.add_middleware(
         TrustedHostMiddleware,
         allowed_hosts=["*"],
     )
+    app.add_middleware(BodySizeLimitMiddleware, max_bytes=settings.max_request_bytes)
+
+    profiling_enabled = bool(settings.profiling_secret) or settings.profiling_sample_rate > 0
+    if profiling_enabled:
+        app.add_middleware(
+            ProfilingMiddleware,
+            secret=settings.profiling_secret,
+            sample_rate=settings.profiling_sample_rate,
+            interval=settings.profiling_interval_ms / 1000,
+        )
+    if settings.tracing_enabled:
+        app.add_middleware(TracingMiddleware, routers=(web_router, api_router, app.router))
+    if settings.metrics_enabled:
+        # Added last so it wraps the whole stack and sees every request.
+        app.add_middleware(MetricsMiddleware, routers=(web_router, api_router, app.router))
 
     app.mount("/static", StaticFiles(directory="app/static"), name="static")
     app.include_router(web_router)
+    app.include_router(api_router)
+
+    @app.exception_handler(Overloaded)
+    async def overloaded(request: Request, exc: Overloaded) -> JSONResponse:
+        headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+        return JSONResponse({"detail": str(exc)}, status_code=exc.status_code, headers=headers)
 
     @app.get("/health")
     async def healthcheck() -> dict[str, str]:
         return {"status": "ok"}
 
+    @app.get("/ready")
+    async def readiness() -> JSONResponse:
+        # Unlike /health, answers 503 while the process is turning work away,
+        # so a load balancer can steer new traffic elsewhere.
+        report = await asyncio.to_thread(load_report)
+        status_code = 503 if report["status"] == "overloaded" else 200
+        headers = {"Retry-After": str(settings.overload_retry_after_seconds)} if status_code == 503 else None
+        return JSONResponse(report, status_code=status_code, headers=headers)
+
+    if settings.metrics_enabled:
+
+        @app.get("/metrics", include_in_schema=False)
+        async def metrics() -> PlainTextResponse:
+            return PlainTextResponse(
+                get_registry().render(), media_type=METRICS_CONTENT_TYPE
+            )
+
+    if settings.profiling_secret:
+
+        @app.get("/profiles/{profile_id}", include_in_schema=False)
+        async def download_profile(
+            request: Request, profile_id: str, format: str = "speedscope"
+        ) -> FileResponse:
+            token = request.headers.get(PROFILE_HEADER) or request.query_params.get(
+                PROFILE_QUERY_PARAM
+            )
+            if not profiling_token_valid(settings.profiling_secret, token):
+                raise HTTPException(status_code=404, detail="Profile not found")
+            path = get_profile_store().path_for(profile_id, format)
+            if path is None:
+                raise HTTPException(status_code=404, detail="Profile not found")
+            media_type = "application/json" if format == "speedscope" else "text/plain"
+            return FileResponse(path, media_type=media_type, filename=path.name)
+
     return app
 
 
-app = create_app()
+def __getattr__(name: str) -> Any:
+    # ``uvicorn app.main:app`` resolves the attribute with getattr, so the
+    # application (and the settings it needs) is only built when actually
+    # served rather than whenever the module is imported.
+    if name == "app":
+        application = create_app()
+        globals()["app"] = application
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-__all__ = ["app", "create_app"]
+# ``app`` is left out: it is built lazily by ``__getattr__`` above, and a
+# star import should not construct the application.
+__all__ = ["create_app"]
@@ -0,0 +1,297 @@
+"""ASGI middleware used by the application factory."""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import secrets
+import threading
+import time
+from typing import Optional, Sequence
+from urllib.parse import parse_qs
+
+from starlette.datastructures import MutableHeaders
+from starlette.exceptions import HTTPException
+from starlette.routing import BaseRoute, Match, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.metrics import get_registry
+from app.services.profiler import SamplingProfiler, get_profile_store
+from app.services.tracing import KIND_SERVER, get_tracer, parse_traceparent
+
+_registry = get_registry()
+_IN_PROGRESS = _registry.gauge(
+    "bulkmailer_http_requests_in_progress",
+    "HTTP requests currently being handled, by route.",
+    labelnames=("method", "route"),
+)
+_REQUEST_SECONDS = _registry.histogram(
+    "bulkmailer_http_request_duration_seconds",
+    "Time to handle an HTTP request, by route and status code.",
+    labelnames=("method", "route", "status"),
+)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_template(routes: Sequence[BaseRoute], scope: Scope) -> str:
+    """Return the path template (e.g. ``/preview/{index}/toggle``) for ``scope``."""
+
+    for route in routes:
+        path = getattr(route, "path", None)
+        # Wrappers without a path of their own (included routers on newer
+        # FastAPI releases) would match everything; their routes are looked
+        # up through the router they wrap instead.
+        if not isinstance(path, str):
+            continue
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return path or UNMATCHED_ROUTE
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Track in-flight requests and request latency per route template.
+
+    Route templates rather than raw paths are used as labels so that
+    per-message URLs do not create unbounded label cardinality.
+    """
+
+    def __init__(self, app: ASGIApp, routers: Sequence[Router]) -> None:
+        self.app = app
+        self.routers = routers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _find_route(self.routers, scope)
+        in_progress = _IN_PROGRESS.labels(method, route)
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            _REQUEST_SECONDS.labels(method, route, str(status_code)).observe(
+                time.perf_counter() - started
+            )
+
+
+def _find_route(routers: Sequence[Router], scope: Scope) -> str:
+    for router in routers:
+        route = route_template(router.routes, scope)
+        if route != UNMATCHED_ROUTE:
+            return route
+    return UNMATCHED_ROUTE
+
+
+class TracingMiddleware:
+    """Open a server span for each request, named after its route template.
+
+    An incoming W3C ``traceparent`` header makes the span a child of the
+    caller's trace, and the response carries a ``traceparent`` header naming
+    this request's span so a slow response can be found in the trace file.
+    """
+
+    def __init__(self, app: ASGIApp, routers: Sequence[Router]) -> None:
+        self.app = app
+        self.routers = routers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        tracer = get_tracer()
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _find_route(self.routers, scope)
+        parent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                parent = parse_traceparent(value.decode("latin-1"))
+                break
+        attributes = {"http.request.method": method, "http.route": route, "url.path": scope["path"]}
+        with tracer.span(f"{method} {route}", attributes, kind=KIND_SERVER, parent=parent) as span:
+
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_error()
+                    MutableHeaders(scope=message).append("traceparent", span.traceparent)
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+class _BodyTooLarge(HTTPException):
+    # An HTTPException, so that the framework answers 413 itself when the
+    # limit is crossed while an endpoint is reading the body.
+    def __init__(self) -> None:
+        super().__init__(status_code=413, detail="Request body too large")
+
+
+class BodySizeLimitMiddleware:
+    """Refuse request bodies larger than ``max_bytes`` with 413.
+
+    A declared ``Content-Length`` above the limit is refused before anything
+    is read. Chunked bodies are counted as they stream in and refused once
+    they cross the limit, so an oversized upload is never fully buffered.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def _refuse(self, send: Send) -> None:
+        body = b'{"detail":"Request body too large"}'
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for key, value in scope.get("headers", []):
+            if key == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > self.max_bytes:
+                    await self._refuse(send)
+                    return
+                break
+
+        received = 0
+        response_started = False
+
+        async def receive_wrapper() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise _BodyTooLarge()
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+            await self._refuse(send)
+
+
+PROFILE_HEADER = "x-profile-token"
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+
+def profiling_token_valid(secret: Optional[str], token: Optional[str]) -> bool:
+    """Constant-time check of a caller-supplied profiling token."""
+
+    if not secret or not token:
+        return False
+    return secrets.compare_digest(secret.encode("utf-8"), token.encode("utf-8"))
+
+
+def _request_token(scope: Scope) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key.decode("latin-1").lower() == PROFILE_HEADER:
+            return value.decode("latin-1")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    values = query.get(PROFILE_QUERY_PARAM)
+    return values[0] if values else None
+
+
+class ProfilingMiddleware:
+    """Capture a sampling profile for selected requests.
+
+    A request is profiled when it carries the admin secret in the
+    ``X-Profile-Token`` header or ``?profile=`` query parameter, or when it is
+    picked by random sampling. The profile id is returned in the
+    ``X-Profile-Id`` response header and the profile can be downloaded from
+    ``/profiles/{profile_id}``.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        secret: Optional[str],
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+    ) -> None:
+        self.app = app
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.interval = interval
+
+    def _should_profile(self, scope: Scope) -> bool:
+        if self.secret and profiling_token_valid(self.secret, _request_token(scope)):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(threading.get_ident(), self.interval)
+        profile_id = ""
+        name = f"{scope['method']} {scope['path']}"
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal profile_id
+            if message["type"] == "http.response.start":
+                # Headers go out before a streamed body is rendered, so the id
+                # is reserved up front and the file is written once the body
+                # has been produced.
+                profile_id = get_profile_store().reserve_id()
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile = profiler.stop(name)
+            await asyncio.to_thread(get_profile_store().save, profile, profile_id or None)
+
+
+__all__ = [
+    "BodySizeLimitMiddleware",
+    "MetricsMiddleware",
+    "ProfilingMiddleware",
+    "TracingMiddleware",
+    "profiling_token_valid",
+    "route_template",
+]
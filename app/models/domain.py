@@ -2,10 +2,42 @@
 
 from __future__ import annotations
 
+import sys
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence
 
-from pydantic import BaseModel, EmailStr, Field
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator, model_validator
+
+RECIPIENT_FIELDS = ("title", "first_name", "last_name", "email")
+
+# Distinct values a column may collect before the table checks whether
+# deduplicating it is still worthwhile (fewer than one distinct value per
+# two rows).
+_DEDUPE_SAMPLE = 1024
+
+
+def known_timezone(value: Optional[str]) -> Optional[str]:
+    """Return ``value`` if it names an IANA timezone (empty means none)."""
+
+    if not value:
+        return None
+    try:
+        ZoneInfo(value)
+    except (ZoneInfoNotFoundError, ValueError) as exc:
+        raise ValueError(f"Unknown timezone {value!r}") from exc
+    return value
+
+
+def email_domain(email: str) -> str:
+    """Return the domain of ``email``, lower-cased and IDNA encoded, for grouping sends."""
+
+    domain = email.rpartition("@")[2].strip().rstrip(".").lower()
+    try:
+        return domain.encode("idna").decode("ascii")
+    except UnicodeError:
+        return domain
 
 
 class Recipient(BaseModel):
@@ -15,6 +47,16 @@ class Recipient(BaseModel):
     first_name: str = Field(..., min_length=1, max_length=120)
     last_name: str = Field(..., min_length=1, max_length=120)
     email: EmailStr
+    timezone: Optional[str] = Field(None, description="IANA timezone for recipient-local scheduling")
+    domain: str = Field("", description="Normalised email domain, derived once when the row is parsed")
+
+    _known_timezone = field_validator("timezone", mode="before")(known_timezone)
+
+    @model_validator(mode="after")
+    def _derive_domain(self) -> "Recipient":
+        if not self.domain:
+            self.domain = email_domain(self.email)
+        return self
 
     def display_name(self) -> str:
         """Return a formatted full name."""
@@ -22,6 +64,102 @@ class Recipient(BaseModel):
         return f"{self.title.strip()} {self.first_name.strip()} {self.last_name.strip()}".strip()
 
 
+class RecipientTable:
+    """Column-oriented recipient storage for an uploaded CSV.
+
+    Each column is a list of strings, and no per-row dict or model is kept.
+    Repeated values (titles, company names, timezones) are deduplicated
+    through a per-column dict owned by the table, so they are stored once
+    however many rows share them and are freed with the table. A column that
+    turns out to be mostly unique (emails, names) stops being deduplicated.
+    Each row's normalised email domain is kept alongside the columns (not as
+    a column, so it never shadows a user's ``domain`` placeholder).
+    ``Recipient`` objects are built on demand when indexing or iterating.
+    """
+
+    def __init__(self, columns: Sequence[str] = RECIPIENT_FIELDS) -> None:
+        self.columns: tuple[str, ...] = tuple(columns)
+        self._data: dict[str, list[str]] = {column: [] for column in self.columns}
+        self._pools: dict[str, Optional[dict[str, str]]] = {column: {} for column in self.columns}
+        self._domains: list[str] = []
+        self._domain_pool: dict[str, str] = {}
+        self._length = 0
+
+    def append(self, row: Mapping[str, str], domain: Optional[str] = None) -> None:
+        """Add a row; missing columns are stored as empty strings.
+
+        ``domain`` is the already normalised email domain, if known.
+        """
+
+        if domain is None:
+            domain = email_domain(row.get("email") or "")
+        self._domains.append(self._domain_pool.setdefault(domain, domain))
+        self._length += 1
+        for column, values in self._data.items():
+            value = row.get(column) or ""
+            pool = self._pools[column]
+            if pool is not None:
+                value = pool.setdefault(value, value)
+                if len(pool) > _DEDUPE_SAMPLE and len(pool) * 2 > self._length:
+                    self._pools[column] = None
+            values.append(value)
+
+    def add_column(self, name: str) -> None:
+        """Add a column, empty for the rows already stored."""
+
+        if name not in self._data:
+            self.columns += (name,)
+            self._data[name] = [""] * self._length
+            self._pools[name] = {}
+
+    def __len__(self) -> int:
+        return self._length
+
+    def column(self, name: str) -> List[str]:
+        return self._data[name]
+
+    def domain(self, index: int) -> str:
+        return self._domains[index]
+
+    def row(self, index: int) -> Dict[str, str]:
+        """Return every column of one row, as used for template rendering."""
+
+        return {column: values[index] for column, values in self._data.items()}
+
+    def rows(self) -> Iterator[Dict[str, str]]:
+        for index in range(self._length):
+            yield self.row(index)
+
+    def __getitem__(self, index: int) -> Recipient:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("recipient index out of range")
+        timezone = self._data["timezone"][index] if "timezone" in self._data else ""
+        # Rows were validated when they were added.
+        return Recipient.model_construct(
+            **{field: self._data[field][index] for field in RECIPIENT_FIELDS},
+            timezone=timezone or None,
+            domain=self._domains[index],
+        )
+
+    def __iter__(self) -> Iterator[Recipient]:
+        for index in range(self._length):
+            yield self[index]
+
+    def text_bytes(self) -> int:
+        """Approximate bytes of string data, counting each shared value once."""
+
+        seen: set[int] = set()
+        total = 0
+        for values in self._data.values():
+            for value in values:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    total += sys.getsizeof(value)
+        return total
+
+
 class TemplateContent(BaseModel):
     """Subject and body template provided by the user."""
 
@@ -37,7 +175,7 @@ class RenderedEmail(BaseModel):
     subject: str
     body: str
     approved: bool = True
-    status: str = Field("pending", description="pending|sent|failed|skipped")
+    status: str = Field("pending", description="pending|scheduled|queued|sent|failed|skipped")
     error_message: Optional[str] = None
     sent_at: Optional[datetime] = None
 
@@ -45,10 +183,17 @@ class RenderedEmail(BaseModel):
 class BatchState(BaseModel):
     """Holds all in-memory data for a user's workflow."""
 
-    recipients: List[Recipient] = Field(default_factory=list)
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    recipients: RecipientTable = Field(default_factory=RecipientTable)
     template: Optional[TemplateContent] = None
     messages: List[RenderedEmail] = Field(default_factory=list)
     gmail_authorized: bool = False
+    sender_accounts: int = 0
+    send_batch_id: Optional[str] = None
+    domain_warnings: Dict[str, str] = Field(
+        default_factory=dict, description="Recipient domains flagged by the deliverability precheck, with the reason"
+    )
 
     def approvals(self) -> Dict[str, bool]:
         """Return approval flags keyed by recipient email."""
@@ -57,7 +202,11 @@ class BatchState(BaseModel):
 
 
 __all__ = [
+    "RECIPIENT_FIELDS",
+    "email_domain",
+    "known_timezone",
     "Recipient",
+    "RecipientTable",
     "TemplateContent",
     "RenderedEmail",
     "BatchState",
@@ -0,0 +1,181 @@
+"""Admission control: turn overload away early instead of degrading everyone.
+
+Three limits protect the process:
+
+* request bodies larger than ``max_request_bytes`` are refused with 413 by
+  ``BodySizeLimitMiddleware`` before they are buffered;
+* CSV parsing, DOCX extraction and rendering hold a slot of the shared
+  ``WorkLimiter``; a request that cannot get one within
+  ``admission_wait_seconds`` is answered 503;
+* new sends are refused with 429 while ``max_queued_sends`` messages are
+  already waiting (the send queue in worker mode, the fair send gate inline).
+
+Refusals raise ``Overloaded``, which the app turns into a response with a
+``Retry-After`` header. ``load_report`` summarises current load for
+``/ready``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+
+from app.config import get_settings
+from app.services.fair_share import get_send_gate
+from app.services.metrics import get_registry
+
+_registry = get_registry()
+_REJECTED = _registry.counter(
+    "bulkmailer_admission_rejected_total",
+    "Requests turned away by admission control, by reason.",
+    labelnames=("reason",),
+)
+
+
+class Overloaded(Exception):
+    """Raised when a request is refused to protect the process."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int, reason: str) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        _REJECTED.labels(reason).inc()
+
+
+class WorkLimiter:
+    """Bound the CPU and memory heavy operations running at once.
+
+    Callers wait up to ``wait_seconds`` for a slot; waiting longer than that
+    means the process is saturated, so the caller is refused instead.
+    """
+
+    def __init__(self, limit: int, wait_seconds: float, retry_after: int) -> None:
+        self.limit = max(limit, 1)
+        self.wait_seconds = wait_seconds
+        self.retry_after = retry_after
+        self.in_use = 0
+        # Futures are created per call, so the limiter is not tied to one
+        # event loop the way an ``asyncio.Semaphore`` would be.
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes straight to the next waiter.
+                waiter.set_result(None)
+                return
+        self.in_use -= 1
+
+    async def _acquire(self) -> None:
+        if self.in_use < self.limit and not self.waiting:
+            self.in_use += 1
+            return
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.wait_seconds)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise Overloaded(
+                "The server is busy processing other uploads; please retry shortly.",
+                503,
+                self.retry_after,
+                "work",
+            ) from None
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Hold a slot for the block, or raise ``Overloaded`` after waiting too long."""
+
+        await self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+
+@lru_cache
+def get_work_limiter() -> WorkLimiter:
+    """Return the limiter shared by parse, extraction and render work."""
+
+    settings = get_settings()
+    return WorkLimiter(
+        settings.max_concurrent_work,
+        settings.admission_wait_seconds,
+        settings.overload_retry_after_seconds,
+    )
+
+
+def _queue_backlog() -> int:
+    settings = get_settings()
+    if settings.send_mode == "worker":
+        if not settings.send_queue_path.exists():
+            return 0
+        from app.services.send_queue import get_send_queue
+
+        return get_send_queue().pending_count()
+    return get_send_gate().waiting
+
+
+def check_batch_rows(rows: int, limit: Optional[int] = None) -> None:
+    """Refuse a batch with more than ``limit`` (default ``max_batch_rows``) recipients."""
+
+    if limit is None:
+        limit = get_settings().max_batch_rows
+    if rows > limit:
+        raise Overloaded(f"Too many recipients: a batch may hold at most {limit}.", 413, 0, "rows")
+
+
+def check_send_capacity(messages: int) -> None:
+    """Refuse ``messages`` new sends if the send backlog is already full.
+
+    Blocking (reads the queue database in worker mode); call off the event loop.
+    """
+
+    settings = get_settings()
+    backlog = _queue_backlog()
+    if backlog and backlog + messages > settings.max_queued_sends:
+        raise Overloaded(
+            f"{backlog} messages are already waiting to be sent; please retry later.",
+            429,
+            settings.overload_retry_after_seconds,
+            "sends",
+        )
+
+
+def load_report() -> dict[str, object]:
+    """Current load and limits, as reported by ``/ready`` (blocking)."""
+
+    settings = get_settings()
+    limiter = get_work_limiter()
+    backlog = _queue_backlog()
+    saturated = limiter.in_use >= limiter.limit and limiter.waiting > 0
+    full = backlog >= settings.max_queued_sends
+    return {
+        "status": "overloaded" if saturated or full else "ready",
+        "work": {"in_use": limiter.in_use, "waiting": limiter.waiting, "limit": limiter.limit},
+        "sends": {
+            "waiting": backlog,
+            "in_flight": get_send_gate().running,
+            "limit": settings.max_queued_sends,
+        },
+    }
+
+
+__all__ = [
+    "Overloaded",
+    "WorkLimiter",
+    "check_batch_rows",
+    "check_send_capacity",
+    "get_work_limiter",
+    "load_report",
+]
@@ -0,0 +1,40 @@
+"""Bearer tokens for the JSON API.
+
+A token is the session id signed with the app's secret key, so it needs no
+storage: it grants access to the same batch and connected Gmail accounts as
+the browser session that issued it, until it expires or the secret changes.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from app.config import get_settings
+
+_SALT = "bulkmailer-api-token"
+
+
+def _serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(get_settings().secret_key, salt=_SALT)
+
+
+def issue_api_token(session_id: str) -> str:
+    """Return a token that authenticates API calls as ``session_id``."""
+
+    return _serializer().dumps(session_id)
+
+
+def api_token_session(token: str) -> Optional[str]:
+    """Return the session id a token was issued for, or ``None`` if it is invalid or expired."""
+
+    max_age = get_settings().api_token_max_age_days * 24 * 3600
+    try:
+        session_id = _serializer().loads(token, max_age=max_age)
+    except BadSignature:
+        return None
+    return session_id if isinstance(session_id, str) and session_id else None
+
+
+__all__ = ["api_token_session", "issue_api_token"]
@@ -0,0 +1,156 @@
+"""Send, queue or schedule a session's batch.
+
+Shared by the HTML wizard and the JSON API so both drive the same sending
+paths: inline delivery from the web process, the durable queue consumed by
+``python -m app.worker``, and scheduled plans.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import secrets
+import time
+from typing import Optional
+
+from app.config import get_settings
+from app.models.domain import BatchState, RenderedEmail, email_domain
+from app.services.domain_throttle import get_domain_throttle, interleave_by_domain
+from app.services.fair_share import get_send_gate
+from app.services.mime_builder import MessageEncodingError, pre_encode
+from app.services.scheduler import SendPlan, get_schedule_store, release_times
+from app.services.send_queue import get_send_queue
+from app.services.sender_pool import SenderPool
+from app.services.sending import deliver, encoding_failure, record_skipped
+from app.services.tracing import span
+
+
+async def send_single_message(
+    senders: SenderPool,
+    message: RenderedEmail,
+    raw: Optional[str] = None,
+) -> RenderedEmail:
+    if not message.approved:
+        message.status = "skipped"
+        record_skipped()
+        return message
+    message.status, message.error_message, message.sent_at = await deliver(
+        senders, message.recipient.email, message.subject, message.body, raw=raw, domain=_domain(message)
+    )
+    return message
+
+
+def _domain(message: RenderedEmail) -> str:
+    # Normally derived when the recipient row was parsed.
+    return message.recipient.domain or email_domain(message.recipient.email)
+
+
+async def send_inline(session_id: str, senders: SenderPool, state: BatchState) -> None:
+    """Send every approved message from this process and record the outcomes.
+
+    Approved messages are sent round robin across recipient domains, and
+    each waits for its domain's slot (``DomainThrottle``) before taking a
+    slot of the process-wide ``FairSendGate``, so concurrent sessions share
+    the send slots fairly, small batches go first, and no receiving domain
+    gets a burst.
+    """
+
+    gate = get_send_gate()
+    throttle = get_domain_throttle()
+    indexed = list(enumerate(state.messages))
+    approved = interleave_by_domain(
+        [(index, message) for index, message in indexed if message.approved], lambda item: _domain(item[1])
+    )
+    small = len(approved) <= get_settings().send_small_batch_max
+    attributes = {"batch.messages": len(state.messages), "batch.approved": len(approved), "batch.small": small}
+    with span("batch.send_inline", attributes):
+        encoded = pre_encode([(message.recipient.email, message.subject, message.body) for _, message in approved])
+
+        async def send_one(position: int, index: int, message: RenderedEmail) -> None:
+            with span("message", {"message.index": index}) as current:
+                try:
+                    with span("mime.encode_wait"):
+                        raw = await encoded.raw(position)
+                except MessageEncodingError as exc:
+                    message.status, message.error_message, message.sent_at = encoding_failure(exc)
+                    return
+                waited = time.perf_counter()
+                async with throttle.slot(_domain(message)):
+                    current.set_attribute("domain.wait_ms", (time.perf_counter() - waited) * 1000)
+                    waited = time.perf_counter()
+                    async with gate.slot(session_id, cost=len(raw), priority=small):
+                        current.set_attribute("send_gate.wait_ms", (time.perf_counter() - waited) * 1000)
+                        await send_single_message(senders, message, raw=raw)
+
+        for _, message in indexed:
+            if not message.approved:
+                await send_single_message(senders, message)
+        await asyncio.gather(
+            *(send_one(position, index, message) for position, (index, message) in enumerate(approved))
+        )
+
+
+def _take_approved(state: BatchState, new_status: str) -> list[tuple[int, str, str, str]]:
+    """Mark approved messages ``new_status`` (others skipped) and return them for queueing."""
+
+    taken = []
+    for index, message in enumerate(state.messages):
+        if not message.approved:
+            message.status = "skipped"
+            record_skipped()
+            continue
+        message.status = new_status
+        message.error_message = None
+        message.sent_at = None
+        taken.append((index, message.recipient.email, message.subject, message.body))
+    return taken
+
+
+def enqueue_messages(session_id: str, state: BatchState) -> int:
+    """Hand approved messages to the send workers and mark them queued."""
+
+    batch_id = secrets.token_urlsafe(8)
+    queued = _take_approved(state, "queued")
+    get_send_queue().enqueue(session_id, batch_id, queued)
+    state.send_batch_id = batch_id
+    return len(queued)
+
+
+def schedule_messages(session_id: str, state: BatchState, plan: SendPlan) -> int:
+    """Store a send plan for the approved messages and mark them scheduled."""
+
+    batch_id = secrets.token_urlsafe(8)
+    scheduled = _take_approved(state, "scheduled")
+    timezones = [state.messages[index].recipient.timezone for index, *_ in scheduled]
+    store = get_schedule_store()
+    store.create(session_id, batch_id, plan, scheduled, release_times(plan, timezones))
+    state.send_batch_id = batch_id
+    return len(scheduled)
+
+
+def sync_queue_results(session_id: str, state: BatchState) -> None:
+    """Copy results written by the send workers into the session's messages.
+
+    A result is applied only if the message at its index still has the
+    recipient it was queued for, so results never land on a different batch.
+    """
+
+    if not state.send_batch_id:
+        return
+    for result in get_send_queue().results(session_id, state.send_batch_id):
+        if result.message_index >= len(state.messages):
+            continue
+        message = state.messages[result.message_index]
+        if message.recipient.email != result.to_email:
+            continue
+        message.status = "queued" if result.status in ("queued", "leased") else result.status
+        message.error_message = result.error_message
+        message.sent_at = result.sent_at
+
+
+__all__ = [
+    "enqueue_messages",
+    "schedule_messages",
+    "send_inline",
+    "send_single_message",
+    "sync_queue_results",
+]
@@ -1,17 +1,54 @@
-"""CSV parsing utilities."""
+"""Recipient file parsing: CSV, XLSX and NDJSON, optionally gzip-compressed."""
 
 from __future__ import annotations
 
+import codecs
 import csv
 import io
-from typing import List
+import json
+import re
+import tempfile
+import time
+import zlib
+from typing import Iterable, List, Mapping, Optional, Sequence
 
 from fastapi import UploadFile
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
-from app.models.domain import Recipient
+from app.config import get_settings
+from app.models.domain import RECIPIENT_FIELDS, Recipient, RecipientTable
+from app.services.admission import check_batch_rows
+from app.services.metrics import get_registry
+from app.services.tracing import current_span, traced
+from app.services.xlsx_reader import XlsxReadError, iter_xlsx_rows
 
-REQUIRED_COLUMNS = ["title", "first_name", "last_name", "email"]
+REQUIRED_COLUMNS = list(RECIPIENT_FIELDS)
+OPTIONAL_COLUMNS = ["timezone"]
+
+_NON_IDENTIFIER = re.compile(r"[^0-9a-z]+")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZIP_MAGIC = b"PK\x03\x04"
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Bytes read or decompressed per step, and spooled in memory before disk.
+_CHUNK_BYTES = 1024 * 1024
+_SPOOL_BYTES = 1024 * 1024
+# Leading whitespace looked through for a ``{`` before a file counts as CSV.
+_DETECT_BYTES = 64 * 1024
+
+_registry = get_registry()
+_PARSE_SECONDS = _registry.histogram(
+    "bulkmailer_csv_parse_duration_seconds",
+    "Time spent parsing and validating an uploaded recipient CSV.",
+)
+_ROWS_PARSED = _registry.counter(
+    "bulkmailer_csv_rows_parsed_total",
+    "CSV data rows processed, valid or not.",
+)
+_ROWS_PER_SECOND = _registry.gauge(
+    "bulkmailer_csv_parse_rows_per_second",
+    "Throughput of the most recent CSV parse.",
+)
 
 
 class CSVParsingError(Exception):
@@ -21,46 +58,477 @@ class CSVParsingError(Exception):
 class ParsedCSV(BaseModel):
     """Result of parsing a CSV upload."""
 
-    recipients: List[Recipient]
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    recipients: RecipientTable
     errors: List[str]
 
 
-def _normalize_row(row: dict[str, str]) -> dict[str, str]:
-    return {key: (value or "").strip() for key, value in row.items()}
+def normalize_header(header: str) -> str:
+    """Turn a CSV header into a placeholder name: ``"Company Name"`` -> ``company_name``."""
 
+    return _NON_IDENTIFIER.sub("_", header.strip().lower()).strip("_")
 
-def parse_recipients(file: UploadFile) -> ParsedCSV:
-    """Parse uploaded CSV file into recipient objects."""
 
-    contents = file.file.read()
-    file.file.seek(0)
+class RecipientBuilder:
+    """Validate recipient rows one at a time into a ``RecipientTable``.
 
-    try:
-        decoded = contents.decode("utf-8-sig")
-    except UnicodeDecodeError as exc:  # pragma: no cover - edge case
-        raise CSVParsingError("CSV must be UTF-8 encoded") from exc
+    Used for CSV uploads and for JSON/NDJSON records sent to the API, so both
+    apply exactly the same rules. More than ``max_rows`` rows (valid or not)
+    raises ``Overloaded`` as soon as the limit is crossed, so an oversized
+    batch is refused without being held in memory first.
+    """
 
-    reader = csv.DictReader(io.StringIO(decoded))
-    headers = [header.strip().lower() for header in reader.fieldnames or []]
-    missing = [column for column in REQUIRED_COLUMNS if column not in headers]
-    if missing:
-        raise CSVParsingError(
-            "Missing required columns: " + ", ".join(missing)
-        )
+    def __init__(self, columns: Sequence[str] = REQUIRED_COLUMNS, max_rows: Optional[int] = None) -> None:
+        self.recipients = RecipientTable(columns)
+        self.errors: List[str] = []
+        self.max_rows = get_settings().max_batch_rows if max_rows is None else max_rows
 
-    recipients: List[Recipient] = []
-    errors: List[str] = []
+    def _check_rows(self) -> None:
+        rows = len(self.recipients) + len(self.errors)
+        if rows >= self.max_rows:
+            check_batch_rows(rows + 1, self.max_rows)
 
-    for index, raw_row in enumerate(reader, start=2):
-        row = _normalize_row({key.strip().lower(): value for key, value in raw_row.items()})
+    def add(self, row: dict[str, str], label: str) -> None:
+        """Validate a row of normalised column names; invalid rows become errors."""
+
+        self._check_rows()
         try:
-            recipient = Recipient(**{key: row.get(key, "") for key in REQUIRED_COLUMNS})
+            recipient = Recipient(
+                **{key: row.get(key, "") for key in REQUIRED_COLUMNS},
+                **{key: row[key] for key in OPTIONAL_COLUMNS if row.get(key)},
+            )
         except Exception as exc:  # pragma: no cover - Pydantic error detail formatting
-            errors.append(f"Row {index}: {exc}")
-            continue
-        recipients.append(recipient)
+            self.errors.append(f"{label}: {exc}")
+            return
+        row["email"] = recipient.email
+        self.recipients.append(row, recipient.domain)
+
+    def add_record(self, record: object, number: int) -> None:
+        """Validate a JSON object; new keys become extra columns."""
+
+        self._check_rows()
+        label = f"Record {number}"
+        if not isinstance(record, Mapping):
+            self.errors.append(f"{label}: expected a JSON object")
+            return
+        row: dict[str, str] = {}
+        for key, value in record.items():
+            column = normalize_header(str(key))
+            if not column:
+                continue
+            if isinstance(value, (dict, list)):
+                self.errors.append(f"{label}: {column} must be a string")
+                return
+            row[column] = "" if value is None else str(value).strip()
+        for column in row:
+            if column not in self.recipients.columns:
+                self.recipients.add_column(column)
+        self.add(row, label)
+
+    def result(self) -> ParsedCSV:
+        return ParsedCSV(recipients=self.recipients, errors=self.errors)
+
+
+def parse_recipient_records(records: Iterable[object]) -> ParsedCSV:
+    """Validate recipients given as JSON objects, e.g. from the JSON API."""
+
+    builder = RecipientBuilder()
+    for number, record in enumerate(records, start=1):
+        builder.add_record(record, number)
+    return builder.result()
+
+
+class StreamParser:
+    """Base of the incremental recipient file parsers.
+
+    ``feed`` takes the file's bytes in chunks of any size and ``close``
+    returns the ``ParsedCSV``; ``rows`` and ``errors`` summarise what has been
+    validated so far and ``bytes`` counts what has been fed.
+    """
+
+    format = ""
+
+    def __init__(self, max_rows: Optional[int] = None) -> None:
+        self._max_rows = max_rows
+        self.bytes = 0
+
+    @property
+    def rows(self) -> int:
+        """Data rows validated so far, valid or not."""
+
+        return 0
+
+    @property
+    def errors(self) -> List[str]:
+        return []
+
+    def feed(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def close(self) -> ParsedCSV:
+        raise NotImplementedError
+
+
+class _TabularParser(StreamParser):
+    """Validate rows of cells against a header row, for CSV and XLSX files."""
+
+    def __init__(self, max_rows: Optional[int] = None) -> None:
+        super().__init__(max_rows)
+        self._positions: Optional[list[tuple[str, int]]] = None
+        self._builder: Optional[RecipientBuilder] = None
+
+    @property
+    def rows(self) -> int:
+        return len(self._builder.recipients) + len(self._builder.errors) if self._builder else 0
+
+    @property
+    def errors(self) -> List[str]:
+        return self._builder.errors if self._builder else []
+
+    def _start(self, raw_headers: list[str]) -> None:
+        headers = [normalize_header(header) for header in raw_headers]
+        missing = [column for column in REQUIRED_COLUMNS if column not in headers]
+        if missing:
+            raise CSVParsingError(
+                "Missing required columns: " + ", ".join(missing)
+            )
+        duplicates = sorted({header for header in headers if header and headers.count(header) > 1})
+        if duplicates:
+            raise CSVParsingError("Duplicate columns: " + ", ".join(duplicates))
+
+        # Columns beyond the required ones are kept and usable as placeholders.
+        columns = REQUIRED_COLUMNS + [header for header in headers if header and header not in REQUIRED_COLUMNS]
+        self._positions = [(header, position) for position, header in enumerate(headers) if header]
+        self._builder = RecipientBuilder(columns, max_rows=self._max_rows)
+
+    def _add(self, raw_row: Sequence[str], label: str) -> None:
+        builder, positions = self._builder, self._positions
+        assert builder is not None and positions is not None
+        row = {
+            header: raw_row[position].strip() if position < len(raw_row) else ""
+            for header, position in positions
+        }
+        builder.add(row, label)
+
+    def _result(self) -> ParsedCSV:
+        if self._builder is None:
+            self._start([])
+        assert self._builder is not None
+        return self._builder.result()
+
+
+class CSVStreamParser(_TabularParser):
+    """Parse a recipient CSV incrementally, as its bytes arrive.
+
+    ``feed`` decodes each chunk, splits off the complete records (a newline
+    inside a quoted field does not end a record) and validates them right
+    away; the incomplete tail waits for the next chunk. Header problems are
+    raised as ``CSVParsingError`` from the chunk that completes the header,
+    and the summary (``rows``, ``errors``) is current after every chunk, so
+    ``close`` only has the last record left to do.
+    """
+
+    format = "csv"
+
+    def __init__(self, max_rows: Optional[int] = None) -> None:
+        super().__init__(max_rows)
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._pending = ""
+        self._record = 1
+
+    def feed(self, data: bytes) -> None:
+        self.bytes += len(data)
+        try:
+            text = self._pending + self._decoder.decode(data)
+        except UnicodeDecodeError as exc:
+            raise CSVParsingError("CSV must be UTF-8 encoded") from exc
+        end = text.rfind("\n")
+        # A newline after an odd number of quotes is inside a quoted field.
+        while end >= 0 and text.count('"', 0, end) % 2:
+            end = text.rfind("\n", 0, end)
+        self._pending = text[end + 1 :]
+        if end >= 0:
+            self._parse(text[: end + 1])
+
+    def close(self) -> ParsedCSV:
+        """Parse whatever is left and return the result."""
+
+        try:
+            text = self._pending + self._decoder.decode(b"", final=True)
+        except UnicodeDecodeError as exc:
+            raise CSVParsingError("CSV must be UTF-8 encoded") from exc
+        self._pending = ""
+        self._parse(text)
+        return self._result()
+
+    def _parse(self, text: str) -> None:
+        if not text:
+            return
+        reader = csv.reader(io.StringIO(text))
+        if self._builder is None:
+            self._start(next(reader, []))
+        for raw_row in reader:
+            self._record += 1
+            if raw_row:
+                self._add(raw_row, f"Row {self._record}")
+
 
-    return ParsedCSV(recipients=recipients, errors=errors)
+class XLSXStreamParser(_TabularParser):
+    """Parse the first worksheet of an XLSX workbook.
+
+    A workbook is a zip archive whose directory is at the end, so the bytes
+    are spooled (to disk past a megabyte) and the rows are read at ``close``;
+    the worksheet itself is then streamed row by row rather than loaded.
+    Like a gzip file, the workbook may expand to at most ``max_upload_bytes``.
+    Row labels are the spreadsheet's own row numbers.
+    """
+
+    format = "xlsx"
+
+    def __init__(self, max_rows: Optional[int] = None) -> None:
+        super().__init__(max_rows)
+        self._spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_BYTES)
+
+    def feed(self, data: bytes) -> None:
+        self.bytes += len(data)
+        self._spool.write(data)
+
+    def close(self) -> ParsedCSV:
+        try:
+            self._spool.seek(0)
+            settings = get_settings()
+            rows = iter_xlsx_rows(self._spool, settings.max_upload_bytes, settings.xlsx_max_shared_chars)
+            for number, raw_row in rows:
+                if self._builder is None:
+                    self._start(raw_row)
+                elif any(raw_row):
+                    self._add(raw_row, f"Row {number}")
+        except XlsxReadError as exc:
+            raise CSVParsingError(str(exc)) from exc
+        finally:
+            self._spool.close()
+        return self._result()
+
+
+class NDJSONStreamParser(StreamParser):
+    """Parse newline-delimited JSON recipient records as their bytes arrive.
+
+    Each line is one object validated like the JSON API's records, with keys
+    becoming columns. A line that is not valid JSON rejects the file.
+    """
+
+    format = "ndjson"
+
+    def __init__(self, max_rows: Optional[int] = None) -> None:
+        super().__init__(max_rows)
+        self._builder = RecipientBuilder(max_rows=max_rows)
+        self._pending = b""
+        self._line = 0
+
+    @property
+    def rows(self) -> int:
+        return len(self._builder.recipients) + len(self._builder.errors)
+
+    @property
+    def errors(self) -> List[str]:
+        return self._builder.errors
+
+    def feed(self, data: bytes) -> None:
+        if not self.bytes and data.startswith(codecs.BOM_UTF8):
+            data = data[len(codecs.BOM_UTF8) :]
+        self.bytes += len(data)
+        *lines, self._pending = (self._pending + data).split(b"\n")
+        for line in lines:
+            self._parse(line)
+
+    def close(self) -> ParsedCSV:
+        self._parse(self._pending)
+        self._pending = b""
+        return self._builder.result()
+
+    def _parse(self, line: bytes) -> None:
+        self._line += 1
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+        except UnicodeDecodeError as exc:
+            raise CSVParsingError(f"Line {self._line}: not valid UTF-8") from exc
+        except json.JSONDecodeError as exc:
+            raise CSVParsingError(f"Line {self._line}: invalid JSON ({exc.msg})") from exc
+        self._builder.add_record(record, self._line)
+
+
+class GzipStreamParser(StreamParser):
+    """Decompress a gzip file as it arrives and parse what it contains.
+
+    The decompressed bytes go to a ``RecipientStreamParser``, so a compressed
+    CSV, XLSX or NDJSON file is handled like the plain one. Output is
+    produced in bounded pieces and capped at ``max_upload_bytes``, so a
+    small file cannot expand without limit.
+    """
+
+    def __init__(self, max_rows: Optional[int] = None) -> None:
+        super().__init__(max_rows)
+        self._inner = RecipientStreamParser(max_rows, decompress=False)
+        self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+        self._in_member = False
+        self._output = 0
+        self._limit = get_settings().max_upload_bytes
+
+    @property
+    def format(self) -> str:  # type: ignore[override]
+        return f"{self._inner.format}+gzip" if self._inner.format else "gzip"
+
+    @property
+    def rows(self) -> int:
+        return self._inner.rows
+
+    @property
+    def errors(self) -> List[str]:
+        return self._inner.errors
+
+    def feed(self, data: bytes) -> None:
+        self.bytes += len(data)
+        while True:
+            # A gzip file may hold several members; each needs a fresh decompressor.
+            if self._decompressor.eof:
+                data = self._decompressor.unused_data + data
+                self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+                self._in_member = False
+            if not data and not self._in_member:
+                return
+            self._in_member = True
+            try:
+                output = self._decompressor.decompress(data, _CHUNK_BYTES)
+            except zlib.error as exc:
+                raise CSVParsingError("The gzip file is corrupt") from exc
+            data = self._decompressor.unconsumed_tail
+            self._output += len(output)
+            if self._output > self._limit:
+                raise CSVParsingError(f"Decompressed file exceeds {self._limit} bytes")
+            if output:
+                self._inner.feed(output)
+            if not data and len(output) < _CHUNK_BYTES and not self._decompressor.eof:
+                return
+
+    def close(self) -> ParsedCSV:
+        if self._in_member and not self._decompressor.eof:
+            raise CSVParsingError("The gzip file is truncated")
+        return self._inner.close()
+
+
+class RecipientStreamParser(StreamParser):
+    """Parse a recipient file of any supported format, as its bytes arrive.
+
+    The format is detected from the first bytes rather than the file name:
+    gzip and zip (XLSX) by their magic numbers, NDJSON by a leading ``{``,
+    and anything else is read as CSV. Bytes are held back only until the
+    format is known; after that every chunk goes straight to the parser for
+    that format, so all of them share the same validation.
+    """
+
+    def __init__(self, max_rows: Optional[int] = None, decompress: bool = True) -> None:
+        super().__init__(max_rows)
+        self._decompress = decompress
+        self._head = b""
+        self._parser: Optional[StreamParser] = None
+
+    @property
+    def format(self) -> str:  # type: ignore[override]
+        return self._parser.format if self._parser else ""
+
+    @property
+    def rows(self) -> int:
+        return self._parser.rows if self._parser else 0
+
+    @property
+    def errors(self) -> List[str]:
+        return self._parser.errors if self._parser else []
+
+    def feed(self, data: bytes) -> None:
+        self.bytes += len(data)
+        if self._parser is None:
+            self._head += data
+            parser = self._detect(final=False)
+            if parser is None:
+                return
+            data, self._head = self._head, b""
+        else:
+            parser = self._parser
+        parser.feed(data)
+
+    def close(self) -> ParsedCSV:
+        if self._parser is None:
+            self._detect(final=True)
+            assert self._parser is not None
+            self._parser.feed(self._head)
+            self._head = b""
+        return self._parser.close()
+
+    def _detect(self, final: bool) -> Optional[StreamParser]:
+        head = self._head
+        if head.startswith(_GZIP_MAGIC):
+            if not self._decompress:
+                raise CSVParsingError("Nested gzip files are not supported")
+            self._parser = GzipStreamParser(self._max_rows)
+        elif head.startswith(_ZIP_MAGIC):
+            self._parser = XLSXStreamParser(self._max_rows)
+        else:
+            text = head[len(codecs.BOM_UTF8) :] if head.startswith(codecs.BOM_UTF8) else head
+            text = text.lstrip()
+            undecided = len(head) < len(_ZIP_MAGIC) or (not text and len(head) < _DETECT_BYTES)
+            if undecided and not final:
+                return None
+            self._parser = NDJSONStreamParser(self._max_rows) if text.startswith(b"{") else CSVStreamParser(self._max_rows)
+        return self._parser
+
+
+def record_parse(parser: StreamParser, elapsed: float) -> None:
+    """Record metrics and span attributes for a finished parse."""
+
+    rows = parser.rows
+    _PARSE_SECONDS.observe(elapsed)
+    _ROWS_PARSED.inc(rows)
+    if elapsed > 0:
+        _ROWS_PER_SECOND.set(rows / elapsed)
+    current_span().set_attributes(
+        {
+            "upload.bytes": parser.bytes,
+            "upload.format": parser.format,
+            "recipients.valid": rows - len(parser.errors),
+            "recipients.invalid": len(parser.errors),
+        }
+    )
+
+
+@traced("csv.parse_recipients")
+def parse_recipients(file: UploadFile) -> ParsedCSV:
+    """Parse an uploaded recipient file (CSV, XLSX or NDJSON, optionally gzipped)."""
+
+    started = time.perf_counter()
+    parser = RecipientStreamParser()
+    while chunk := file.file.read(_CHUNK_BYTES):
+        parser.feed(chunk)
+    file.file.seek(0)
+    result = parser.close()
+    record_parse(parser, time.perf_counter() - started)
+    return result
 
 
-__all__ = ["parse_recipients", "CSVParsingError", "ParsedCSV"]
+__all__ = [
+    "CSVStreamParser",
+    "GzipStreamParser",
+    "NDJSONStreamParser",
+    "RecipientStreamParser",
+    "StreamParser",
+    "XLSXStreamParser",
+    "parse_recipients",
+    "parse_recipient_records",
+    "normalize_header",
+    "CSVParsingError",
+    "ParsedCSV",
+    "RecipientBuilder",
+    "record_parse",
+]
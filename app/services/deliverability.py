@@ -0,0 +1,359 @@
+"""Precheck that recipient domains can receive mail before anything is sent.
+
+A typo such as ``gmial.com`` or a domain that no longer exists only shows up
+as a failed send, after it has used a send call and a unit of sender quota.
+The precheck runs once after recipients are uploaded:
+
+* every *unique* domain is looked up once, not every recipient: MX records
+  first, then an address record for domains that publish no MX (RFC 5321
+  section 5.1), with a null MX (RFC 7505) counting as "accepts no mail";
+* lookups run concurrently, ``concurrency`` at a time, each bounded by a
+  timeout; a lookup that times out or fails counts as unknown and is never
+  held against the domain;
+* results are cached in the send queue database with a TTL (shorter for
+  failures), so repeat uploads and other processes skip the DNS round trips;
+* domains one edit away from a well-known mail provider (``hotmial.com``)
+  are flagged as likely typos even when they resolve.
+
+Messages to flagged domains are rendered suspended, with the reason as their
+error message; the user can still approve them on the preview page.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Literal, Mapping, Optional, Sequence
+
+from pydantic import BaseModel
+
+from app.config import get_settings
+from app.models.domain import RecipientTable, RenderedEmail
+from app.services.metrics import get_registry
+from app.services.send_queue import SendQueue, get_send_queue
+from app.services.tracing import current_span, traced
+
+if TYPE_CHECKING:  # pragma: no cover - imported lazily at runtime
+    import dns.asyncresolver
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS domain_checks (
+    domain TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    expires_at REAL NOT NULL
+)
+"""
+
+DomainStatus = Literal["deliverable", "no_mail", "no_domain", "unknown"]
+
+DELIVERABLE: DomainStatus = "deliverable"
+NO_MAIL: DomainStatus = "no_mail"
+NO_DOMAIN: DomainStatus = "no_domain"
+UNKNOWN: DomainStatus = "unknown"
+
+# Mail providers whose near misses are almost always typos. Deployments add
+# their own domains (the university's, say) with
+# ``BATCH_APP_DOMAIN_PRECHECK_KNOWN_DOMAINS``.
+KNOWN_DOMAINS = (
+    "aol.com",
+    "att.net",
+    "comcast.net",
+    "gmail.com",
+    "gmx.com",
+    "gmx.de",
+    "gmx.net",
+    "googlemail.com",
+    "hotmail.co.uk",
+    "hotmail.com",
+    "icloud.com",
+    "live.com",
+    "mac.com",
+    "mail.com",
+    "me.com",
+    "msn.com",
+    "outlook.com",
+    "proton.me",
+    "protonmail.com",
+    "verizon.net",
+    "web.de",
+    "yahoo.co.uk",
+    "yahoo.com",
+    "yandex.com",
+    "ymail.com",
+    "zoho.com",
+)
+
+# Shorter domains are too close to too many legitimate ones to guess at.
+_MIN_TYPO_LENGTH = 8
+# SQLite bound parameters per statement.
+_SQL_CHUNK = 500
+
+_LOOKUPS = get_registry().counter(
+    "bulkmailer_domain_precheck_lookups_total",
+    "Recipient domains prechecked, by result; cached results are counted as 'cached'.",
+    labelnames=("result",),
+)
+_PRECHECK_SECONDS = get_registry().histogram(
+    "bulkmailer_domain_precheck_duration_seconds",
+    "Time spent prechecking the domains of one upload.",
+)
+
+_PROBLEMS = {
+    NO_DOMAIN: "domain does not exist",
+    NO_MAIL: "domain does not accept mail",
+}
+
+
+class DomainCheck(BaseModel):
+    """Precheck result for one recipient domain."""
+
+    domain: str
+    status: DomainStatus
+    suggestion: Optional[str] = None
+
+    @property
+    def problem(self) -> Optional[str]:
+        """Why messages to this domain should not be sent as is, if they should not."""
+
+        reason = _PROBLEMS.get(self.status)
+        if self.suggestion:
+            hint = f"did you mean {self.suggestion}?"
+            return f"{reason}; {hint}" if reason else f"possible typo, {hint}"
+        return reason
+
+
+def _within_one_edit(left: str, right: str) -> bool:
+    """True if ``left`` becomes ``right`` with at most one insertion,
+    deletion, substitution or swap of adjacent characters."""
+
+    if abs(len(left) - len(right)) > 1:
+        return False
+    start = 0
+    while start < min(len(left), len(right)) and left[start] == right[start]:
+        start += 1
+    tail_left, tail_right = left[start:], right[start:]
+    if len(tail_left) == len(tail_right):
+        return (
+            tail_left[1:] == tail_right[1:]
+            or (tail_left[:2] == tail_right[1::-1] and tail_left[2:] == tail_right[2:])
+        )
+    if len(tail_left) > len(tail_right):
+        return tail_left[1:] == tail_right
+    return tail_left == tail_right[1:]
+
+
+def suggest_domain(domain: str, known: Iterable[str] = KNOWN_DOMAINS) -> Optional[str]:
+    """Return the known domain that ``domain`` is most likely a typo of."""
+
+    if len(domain) < _MIN_TYPO_LENGTH:
+        return None
+    candidates = set(known)
+    if domain in candidates:
+        return None
+    for candidate in sorted(candidates):
+        if _within_one_edit(domain, candidate):
+            return candidate
+    return None
+
+
+class MXResolver:
+    """Classify a domain by its MX and address records."""
+
+    def __init__(
+        self,
+        nameservers: Sequence[str] = (),
+        port: int = 53,
+        timeout: float = 3.0,
+    ) -> None:
+        self.nameservers = list(nameservers)
+        self.port = port
+        self.timeout = timeout
+        self._resolver: Optional[dns.asyncresolver.Resolver] = None
+
+    def _get_resolver(self) -> dns.asyncresolver.Resolver:
+        # dnspython is imported on first use to keep app startup fast.
+        if self._resolver is None:
+            import dns.asyncresolver
+
+            resolver = dns.asyncresolver.Resolver(configure=not self.nameservers)
+            if self.nameservers:
+                resolver.nameservers = self.nameservers
+            resolver.port = self.port
+            resolver.lifetime = self.timeout
+            self._resolver = resolver
+        return self._resolver
+
+    async def lookup(self, domain: str) -> DomainStatus:
+        import dns.exception
+        import dns.name
+        import dns.resolver
+
+        resolver = self._get_resolver()
+        name = dns.name.from_text(domain)
+        try:
+            try:
+                answer = await resolver.resolve(name, "MX", search=False)
+            except dns.resolver.NoAnswer:
+                # No MX: the domain's own address is its mail server.
+                for rdtype in ("A", "AAAA"):
+                    try:
+                        await resolver.resolve(name, rdtype, search=False)
+                    except dns.resolver.NoAnswer:
+                        continue
+                    return DELIVERABLE
+                return NO_MAIL
+        except dns.resolver.NXDOMAIN:
+            return NO_DOMAIN
+        except dns.exception.DNSException:
+            return UNKNOWN
+        exchanges = [record.exchange for record in answer]
+        if exchanges == [dns.name.root]:
+            return NO_MAIL
+        return DELIVERABLE
+
+
+class DomainCheckCache:
+    """Precheck results with an expiry time, kept next to the send queue."""
+
+    def __init__(self, queue: SendQueue) -> None:
+        self._queue = queue
+        with queue.transaction() as connection:
+            connection.execute(_SCHEMA)
+
+    def get_many(self, domains: Sequence[str], now: Optional[float] = None) -> dict[str, DomainStatus]:
+        now = time.time() if now is None else now
+        found: dict[str, DomainStatus] = {}
+        for start in range(0, len(domains), _SQL_CHUNK):
+            chunk = domains[start : start + _SQL_CHUNK]
+            rows = self._queue.query(
+                f"SELECT domain, status FROM domain_checks WHERE expires_at > ? AND domain IN ({','.join('?' * len(chunk))})",
+                (now, *chunk),
+            )
+            found.update((row["domain"], row["status"]) for row in rows)
+        return found
+
+    def put_many(self, entries: Mapping[str, tuple[DomainStatus, float]], now: Optional[float] = None) -> None:
+        """Store ``{domain: (status, ttl_seconds)}``."""
+
+        now = time.time() if now is None else now
+        with self._queue.transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO domain_checks (domain, status, expires_at) VALUES (?, ?, ?)",
+                [(domain, status, now + ttl) for domain, (status, ttl) in entries.items()],
+            )
+            connection.execute("DELETE FROM domain_checks WHERE expires_at <= ?", (now,))
+
+
+class DomainPrechecker:
+    """Check many domains at once, through the cache."""
+
+    def __init__(
+        self,
+        resolver: MXResolver,
+        cache: DomainCheckCache,
+        concurrency: int = 64,
+        ttl: float = 24 * 3600,
+        failure_ttl: float = 3600,
+        known: Iterable[str] = KNOWN_DOMAINS,
+    ) -> None:
+        self.resolver = resolver
+        self.cache = cache
+        self.concurrency = max(concurrency, 1)
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.known = frozenset(known)
+
+    async def _resolve(self, domains: Sequence[str]) -> dict[str, DomainStatus]:
+        results: dict[str, DomainStatus] = {}
+        pending = iter(domains)
+
+        async def resolve_next() -> None:
+            for domain in pending:
+                results[domain] = await self.resolver.lookup(domain)
+
+        await asyncio.gather(*(resolve_next() for _ in range(min(self.concurrency, len(domains)))))
+        return results
+
+    async def check(self, domains: Iterable[str]) -> dict[str, DomainCheck]:
+        unique = sorted({domain for domain in domains if domain})
+        statuses = await asyncio.to_thread(self.cache.get_many, unique)
+        _LOOKUPS.labels("cached").inc(len(statuses))
+        misses = [domain for domain in unique if domain not in statuses]
+        resolved = await self._resolve(misses)
+        for status in resolved.values():
+            _LOOKUPS.labels(status).inc()
+        entries = {
+            domain: (status, self.ttl if status == DELIVERABLE else self.failure_ttl)
+            for domain, status in resolved.items()
+            # A timeout says nothing about the domain; ask again next time.
+            if status != UNKNOWN
+        }
+        if entries:
+            await asyncio.to_thread(self.cache.put_many, entries)
+        statuses.update(resolved)
+        current_span().set_attributes({"precheck.domains": len(unique), "precheck.resolved": len(misses)})
+        return {
+            domain: DomainCheck(domain=domain, status=status, suggestion=suggest_domain(domain, self.known))
+            for domain, status in statuses.items()
+        }
+
+
+@lru_cache
+def get_domain_prechecker() -> DomainPrechecker:
+    """Return the prechecker configured from settings."""
+
+    settings = get_settings()
+    resolver = MXResolver(
+        settings.domain_precheck_nameservers,
+        settings.domain_precheck_port,
+        settings.domain_precheck_timeout_seconds,
+    )
+    return DomainPrechecker(
+        resolver,
+        DomainCheckCache(get_send_queue()),
+        concurrency=settings.domain_precheck_concurrency,
+        ttl=settings.domain_precheck_ttl_seconds,
+        failure_ttl=settings.domain_precheck_failure_ttl_seconds,
+        known=(*KNOWN_DOMAINS, *(domain.lower() for domain in settings.domain_precheck_known_domains)),
+    )
+
+
+@traced("recipients.precheck_domains")
+async def precheck_recipients(recipients: RecipientTable) -> dict[str, str]:
+    """Return ``{domain: problem}`` for recipient domains that look undeliverable.
+
+    Returns an empty mapping when the precheck is disabled.
+    """
+
+    if not get_settings().domain_precheck_enabled:
+        return {}
+    with _PRECHECK_SECONDS.time():
+        domains = {recipients.domain(index) for index in range(len(recipients))}
+        checks = await get_domain_prechecker().check(domains)
+    return {domain: check.problem for domain, check in checks.items() if check.problem}
+
+
+def suspend_flagged(messages: Iterable[RenderedEmail], warnings: Mapping[str, str]) -> None:
+    """Suspend messages to flagged domains, with the reason as the error message."""
+
+    if not warnings:
+        return
+    for message in messages:
+        problem = warnings.get(message.recipient.domain)
+        if problem:
+            message.approved = False
+            message.error_message = f"{message.recipient.domain}: {problem}"
+
+
+__all__ = [
+    "DomainCheck",
+    "DomainCheckCache",
+    "DomainPrechecker",
+    "KNOWN_DOMAINS",
+    "MXResolver",
+    "get_domain_prechecker",
+    "precheck_recipients",
+    "suggest_domain",
+    "suspend_flagged",
+]
@@ -1,27 +1,178 @@
-"""Utilities for handling DOCX template uploads."""
+"""Utilities for handling DOCX template uploads.
+
+Only the paragraph text of the main document part is needed, so instead of
+loading the whole package through python-docx the extractor streams that one
+XML part out of the zip with ``iterparse`` and discards each top-level block
+once its text has been read. Embedded images and other parts are never
+decompressed. The text follows python-docx's rules exactly: body-level
+paragraphs only, runs directly inside the paragraph or one of its hyperlinks,
+and the same text for tabs, breaks and non-breaking hyphens.
+
+Results are cached by the SHA-256 of the upload, since the same template is
+often uploaded again while it is being edited.
+"""
 
 from __future__ import annotations
 
+import hashlib
+import posixpath
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
 from io import BytesIO
+from threading import Lock
+from typing import IO, Optional
+from xml.etree.ElementTree import Element, ParseError, iterparse
+
+from app.config import get_settings
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_BODY = _W + "body"
+_PARAGRAPH = _W + "p"
+_RUN = _W + "r"
+_HYPERLINK = _W + "hyperlink"
+_TEXT = _W + "t"
+_BREAK = _W + "br"
+_BREAK_TYPE = _W + "type"
+# Run children with a fixed text equivalent (``w:br`` depends on its type).
+_RUN_SYMBOLS = {_W + "tab": "\t", _W + "ptab": "\t", _W + "cr": "\n", _W + "noBreakHyphen": "-"}
 
-from docx import Document
+_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+_MAIN_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"
+_RELATIONSHIPS = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+_OVERRIDE = "{http://schemas.openxmlformats.org/package/2006/content-types}Override"
 
 
 class DocxProcessingError(Exception):
     """Raised when a DOCX file cannot be parsed."""
 
 
-def extract_plain_text(docx_bytes: bytes) -> str:
-    """Convert a DOCX file into plain text preserving basic paragraph breaks."""
+def _run_text(run: Element) -> str:
+    parts = []
+    for child in run:
+        if child.tag == _TEXT:
+            parts.append(child.text or "")
+        elif child.tag == _BREAK:
+            parts.append("\n" if child.get(_BREAK_TYPE, "textWrapping") == "textWrapping" else "")
+        else:
+            parts.append(_RUN_SYMBOLS.get(child.tag, ""))
+    return "".join(parts)
+
+
+def _paragraph_text(paragraph: Element) -> str:
+    parts = []
+    for child in paragraph:
+        if child.tag == _RUN:
+            parts.append(_run_text(child))
+        elif child.tag == _HYPERLINK:
+            parts.extend(_run_text(run) for run in child if run.tag == _RUN)
+    return "".join(parts)
 
+
+def _main_part(archive: zipfile.ZipFile) -> str:
+    """Return the zip member name of the main document part."""
+
+    target = "word/document.xml"
     try:
-        document = Document(BytesIO(docx_bytes))
-    except Exception as exc:  # pragma: no cover - library specific
+        with archive.open("_rels/.rels") as rels:
+            for _, element in iterparse(rels):
+                if element.tag == _RELATIONSHIPS and element.get("Type") == _OFFICE_DOCUMENT:
+                    target = posixpath.normpath(element.get("Target", target).lstrip("/"))
+                    break
+        with archive.open("[Content_Types].xml") as content_types:
+            for _, element in iterparse(content_types):
+                if element.tag == _OVERRIDE and element.get("PartName", "").lstrip("/") == target:
+                    if element.get("ContentType") != _MAIN_CONTENT_TYPE:
+                        raise DocxProcessingError("Unable to read DOCX file")
+                    break
+    except (KeyError, ParseError) as exc:
+        raise DocxProcessingError("Unable to read DOCX file") from exc
+    return target
+
+
+def _stream_paragraphs(document: IO[bytes]) -> list[str]:
+    paragraphs: list[str] = []
+    body: Optional[Element] = None
+    depth = 0
+    body_depth = -1
+    for event, element in iterparse(document, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if body is None and element.tag == _BODY:
+                body, body_depth = element, depth
+            continue
+        if body is not None and depth == body_depth + 1:
+            if element.tag == _PARAGRAPH:
+                paragraphs.append(_paragraph_text(element).strip())
+            # Top-level blocks are not needed once read; drop them to keep
+            # memory flat on long documents.
+            body.remove(element)
+        depth -= 1
+    return paragraphs
+
+
+def read_docx_text(docx_bytes: bytes) -> str:
+    """Extract the text without consulting the cache."""
+
+    try:
+        with zipfile.ZipFile(BytesIO(docx_bytes)) as archive:
+            with archive.open(_main_part(archive)) as document:
+                paragraphs = _stream_paragraphs(document)
+    except DocxProcessingError:
+        raise
+    except (zipfile.BadZipFile, KeyError, ParseError, OSError, EOFError) as exc:
         raise DocxProcessingError("Unable to read DOCX file") from exc
 
-    paragraphs = [paragraph.text.strip() for paragraph in document.paragraphs]
     text = "\n".join(filter(None, paragraphs))
     return text.strip()
 
 
-__all__ = ["extract_plain_text", "DocxProcessingError"]
+class DocxTextCache:
+    """Small LRU of extracted text keyed by the SHA-256 of the upload."""
+
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(digest)
+            if text is not None:
+                self._entries.move_to_end(digest)
+            return text
+
+    def put(self, digest: str, text: str) -> None:
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = text
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+@lru_cache
+def get_docx_cache() -> DocxTextCache:
+    """Return the process-wide extracted text cache."""
+
+    return DocxTextCache(get_settings().docx_cache_entries)
+
+
+def extract_plain_text(docx_bytes: bytes) -> str:
+    """Convert a DOCX file into plain text preserving basic paragraph breaks."""
+
+    digest = hashlib.sha256(docx_bytes).hexdigest()
+    cache = get_docx_cache()
+    text = cache.get(digest)
+    if text is None:
+        text = read_docx_text(docx_bytes)
+        cache.put(digest, text)
+    return text
+
+
+__all__ = ["extract_plain_text", "read_docx_text", "get_docx_cache", "DocxTextCache", "DocxProcessingError"]
@@ -0,0 +1,161 @@
+"""Pace sends per recipient domain.
+
+Gmail accepting a message does not mean the receiving server will: a burst
+of thousands of messages to one domain (the university's own mail servers,
+say) gets deferred or throttled on the receiving side. Sends are therefore
+limited per recipient domain, independently of which sender account or
+session they come from:
+
+* at most ``concurrency`` sends to one domain are in flight at once;
+* each domain has a token bucket (``rate`` per second, ``burst`` tokens),
+  with optional per-domain rates that also apply to subdomains;
+* batches are ordered round robin across domains (``interleave_by_domain``)
+  so no single receiver gets the whole batch in one stretch.
+
+A send waits for its domain slot before it takes a general send slot, so a
+slow domain holds back only its own messages. Limits are per process; with
+several send workers each applies them on its own.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Iterable, Mapping, Optional, TypeVar
+
+from app.config import get_settings
+from app.services.sender_pool import TokenBucket
+
+T = TypeVar("T")
+
+# Idle domains are forgotten once this many are tracked.
+_SWEEP_THRESHOLD = 1024
+
+
+def interleave_by_domain(items: Iterable[T], domain: Callable[[T], str]) -> list[T]:
+    """Order ``items`` round robin across domains, keeping order within each.
+
+    Domains take turns in order of first appearance:
+    ``a1 a2 a3 b1 c1 c2`` becomes ``a1 b1 c1 a2 c2 a3``.
+    """
+
+    groups: dict[str, deque[T]] = {}
+    for item in items:
+        groups.setdefault(domain(item), deque()).append(item)
+    ordered: list[T] = []
+    queues = deque(groups.values())
+    while queues:
+        queue = queues.popleft()
+        ordered.append(queue.popleft())
+        if queue:
+            queues.append(queue)
+    return ordered
+
+
+class _DomainState:
+    __slots__ = ("bucket", "in_flight", "waiters")
+
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.bucket = bucket
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future[None]] = deque()
+
+
+class DomainThrottle:
+    """Per-domain concurrency caps and rate limits for sends.
+
+    ``rates`` overrides ``rate`` for particular domains and their subdomains
+    (an entry for ``example.edu`` also covers ``mail.example.edu``).
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        rate: float,
+        burst: float,
+        rates: Optional[Mapping[str, float]] = None,
+    ) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.rate = rate
+        self.burst = burst
+        self.rates = {domain.lower().rstrip("."): value for domain, value in (rates or {}).items()}
+        self._domains: dict[str, _DomainState] = {}
+
+    def rate_for(self, domain: str) -> float:
+        labels = domain.split(".")
+        for start in range(len(labels)):
+            override = self.rates.get(".".join(labels[start:]))
+            if override is not None:
+                return override
+        return self.rate
+
+    def in_flight(self, domain: str) -> int:
+        state = self._domains.get(domain)
+        return state.in_flight if state else 0
+
+    def _state(self, domain: str) -> _DomainState:
+        state = self._domains.get(domain)
+        if state is None:
+            if len(self._domains) >= _SWEEP_THRESHOLD:
+                self._sweep()
+            state = self._domains[domain] = _DomainState(TokenBucket(self.rate_for(domain), self.burst))
+        return state
+
+    def _sweep(self) -> None:
+        for domain, state in list(self._domains.items()):
+            # A bucket that has refilled since its last use carries no
+            # history worth keeping.
+            if not state.in_flight and not state.waiters and state.bucket.available() >= state.bucket.burst:
+                del self._domains[domain]
+
+    def _release(self, state: _DomainState) -> None:
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                # The slot passes straight to the next waiter.
+                waiter.set_result(None)
+                return
+        state.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, domain: str) -> AsyncIterator[None]:
+        """Wait for a concurrency slot and a rate token for ``domain``."""
+
+        state = self._state(domain)
+        if state.in_flight < self.concurrency and not state.waiters:
+            state.in_flight += 1
+        else:
+            waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+            state.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Handed the slot just as the caller was cancelled.
+                    self._release(state)
+                else:
+                    state.waiters.remove(waiter)
+                raise
+        try:
+            await state.bucket.acquire()
+            yield
+        finally:
+            self._release(state)
+
+
+@lru_cache
+def get_domain_throttle() -> DomainThrottle:
+    """Return the throttle shared by every send in this process."""
+
+    settings = get_settings()
+    return DomainThrottle(
+        settings.domain_concurrency,
+        settings.domain_rate_per_second,
+        settings.domain_burst,
+        settings.domain_rate_overrides,
+    )
+
+
+__all__ = ["DomainThrottle", "get_domain_throttle", "interleave_by_domain"]
@@ -0,0 +1,263 @@
+"""Export a batch as a ZIP of ``.eml`` files or as a single mbox.
+
+Both formats are produced by generators that build each message's MIME only
+when it is written, so a download holds at most one chunk of output in
+memory however large the batch is. The exported bytes are exactly what
+``deliver`` hands to Gmail for the same message.
+
+``StreamingZipWriter`` is a minimal ZIP writer for this: unlike ``zipfile``,
+which keeps a ``ZipInfo`` object per entry until the archive is closed, it
+spools each central directory record to a temporary file as it goes and
+switches to ZIP64 records once an archive outgrows the classic format.
+
+A message that cannot be encoded (for example a subject with a line break)
+is left out rather than cutting the download short; the ZIP lists such
+messages in ``export-errors.txt``.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import struct
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from typing import Collection, Iterable, Iterator, Optional
+
+from app.models.domain import RenderedEmail
+from app.services.mime_builder import MessageEncodingError, get_builder
+
+logger = logging.getLogger("app.exporter")
+
+# Output is handed to the client in pieces of roughly this size.
+CHUNK_SIZE = 64 * 1024
+_SPOOL_BYTES = 1024 * 1024
+
+_ZIP16_LIMIT = 0xFFFF
+_ZIP32_LIMIT = 0xFFFFFFFF
+_UTF8_NAMES = 0x0800
+_DEFLATED = 8
+# "Version made by" host byte for Unix, so external attributes are file modes.
+_MADE_BY_UNIX = 3 << 8
+
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9@._+-]+")
+
+ERRORS_NAME = "export-errors.txt"
+
+
+def select_messages(
+    messages: Iterable[RenderedEmail],
+    statuses: Optional[Collection[str]] = None,
+    approved: Optional[bool] = None,
+) -> Iterator[tuple[int, RenderedEmail]]:
+    """Yield ``(index, message)`` pairs matching the status and approval filters."""
+
+    for index, message in enumerate(messages):
+        if statuses and message.status not in statuses:
+            continue
+        if approved is not None and message.approved != approved:
+            continue
+        yield index, message
+
+
+def _encoded(
+    selected: Iterable[tuple[int, RenderedEmail]], skipped: list[str]
+) -> Iterator[tuple[int, RenderedEmail, bytes]]:
+    """Yield each selected message with its bytes, noting the ones that cannot be encoded."""
+
+    for index, message in selected:
+        try:
+            data = get_builder().build_bytes(message.recipient.email, message.subject, message.body)
+        except MessageEncodingError as exc:
+            logger.warning("export skipped message=%s error=%s", index + 1, exc)
+            skipped.append(f"{index + 1}\t{message.recipient.email}\t{exc}\n")
+            continue
+        yield index, message, data
+
+
+def _dos_datetime(moment: datetime) -> tuple[int, int]:
+    year = min(max(moment.year, 1980), 2107)
+    dos_time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    dos_date = ((year - 1980) << 9) | (moment.month << 5) | moment.day
+    return dos_time, dos_date
+
+
+class StreamingZipWriter:
+    """Write a deflated ZIP archive front to back, returning bytes as it goes."""
+
+    def __init__(self, level: int = 6) -> None:
+        self._level = level
+        self._offset = 0
+        self._entries = 0
+        self._central = tempfile.SpooledTemporaryFile(max_size=_SPOOL_BYTES)
+        self._closed = False
+
+    def add(self, name: str, data: bytes, modified: Optional[datetime] = None) -> bytes:
+        """Compress one entry and return its local header and data."""
+
+        encoded_name = name.encode("utf-8")
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        crc = zlib.crc32(data)
+        dos_time, dos_date = _dos_datetime(modified or datetime.now())
+        local = struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50,
+            20,
+            _UTF8_NAMES,
+            _DEFLATED,
+            dos_time,
+            dos_date,
+            crc,
+            len(compressed),
+            len(data),
+            len(encoded_name),
+            0,
+        )
+
+        offset = self._offset
+        extra = b""
+        if offset >= _ZIP32_LIMIT:
+            extra = struct.pack("<HHQ", 0x0001, 8, offset)
+        self._central.write(
+            struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                _MADE_BY_UNIX | (45 if extra else 20),
+                45 if extra else 20,
+                _UTF8_NAMES,
+                _DEFLATED,
+                dos_time,
+                dos_date,
+                crc,
+                len(compressed),
+                len(data),
+                len(encoded_name),
+                len(extra),
+                0,
+                0,
+                0,
+                0o644 << 16,
+                min(offset, _ZIP32_LIMIT),
+            )
+        )
+        self._central.write(encoded_name)
+        self._central.write(extra)
+
+        self._entries += 1
+        self._offset += len(local) + len(encoded_name) + len(compressed)
+        return local + encoded_name + compressed
+
+    def close(self) -> Iterator[bytes]:
+        """Yield the central directory and end records."""
+
+        if self._closed:
+            return
+        self._closed = True
+        directory_offset = self._offset
+        directory_size = self._central.tell()
+        self._central.seek(0)
+        while True:
+            chunk = self._central.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        self._central.close()
+
+        end = b""
+        if (
+            self._entries >= _ZIP16_LIMIT
+            or directory_size >= _ZIP32_LIMIT
+            or directory_offset >= _ZIP32_LIMIT
+        ):
+            zip64_offset = directory_offset + directory_size
+            end += struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064B50,
+                44,
+                45,
+                45,
+                0,
+                0,
+                self._entries,
+                self._entries,
+                directory_size,
+                directory_offset,
+            )
+            end += struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1)
+        end += struct.pack(
+            "<IHHHHIIH",
+            0x06054B50,
+            0,
+            0,
+            min(self._entries, _ZIP16_LIMIT),
+            min(self._entries, _ZIP16_LIMIT),
+            min(directory_size, _ZIP32_LIMIT),
+            min(directory_offset, _ZIP32_LIMIT),
+            0,
+        )
+        yield end
+
+
+def _chunked(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    buffer: list[bytes] = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def eml_name(index: int, message: RenderedEmail) -> str:
+    """File name of a message inside the ZIP export."""
+
+    return f"{index + 1:06d}-{_UNSAFE_NAME.sub('_', message.recipient.email)}.eml"
+
+
+def stream_eml_zip(selected: Iterable[tuple[int, RenderedEmail]]) -> Iterator[bytes]:
+    """Yield a ZIP archive with one ``.eml`` file per selected message."""
+
+    def pieces() -> Iterator[bytes]:
+        writer = StreamingZipWriter()
+        skipped: list[str] = []
+        for index, message, data in _encoded(selected, skipped):
+            yield writer.add(eml_name(index, message), data, message.sent_at)
+        if skipped:
+            yield writer.add(ERRORS_NAME, "".join(skipped).encode("utf-8"))
+        yield from writer.close()
+
+    return _chunked(pieces())
+
+
+def stream_mbox(selected: Iterable[tuple[int, RenderedEmail]]) -> Iterator[bytes]:
+    """Yield the selected messages as one mbox file, leaving out unencodable ones.
+
+    Bodies are base64 encoded and header continuation lines start with
+    whitespace, so no line can begin with ``From `` and no quoting is needed.
+    """
+
+    def pieces() -> Iterator[bytes]:
+        for _, message, data in _encoded(selected, []):
+            moment = time.asctime(message.sent_at.timetuple()) if message.sent_at else time.asctime()
+            yield f"From MAILER-DAEMON {moment}\n".encode("ascii")
+            yield data
+            yield b"\n"
+
+    return _chunked(pieces())
+
+
+__all__ = [
+    "CHUNK_SIZE",
+    "ERRORS_NAME",
+    "StreamingZipWriter",
+    "eml_name",
+    "select_messages",
+    "stream_eml_zip",
+    "stream_mbox",
+]
@@ -0,0 +1,266 @@
+"""Fair sharing of send capacity between sessions.
+
+Without it, whoever starts sending first takes all of the outbound capacity:
+a 50k-message batch started a minute earlier holds every send slot while a
+colleague's 20 messages wait behind it. Capacity is handed out by deficit
+round robin (DRR) with one queue per tenant (session): each visit adds a
+quantum to the tenant's deficit and serves queued items while their cost
+fits, so tenants get equal shares of cost (bytes sent, or messages) however
+many items each has waiting.
+
+Two refinements sit on top of DRR:
+
+* a per-tenant cap on items in flight, so one tenant cannot occupy every slot
+  even when nobody else is waiting yet and then hold them as others arrive;
+* a priority class for small batches, served ahead of the normal class, so a
+  short batch is not slowed down by long ones. Small batches are bounded in
+  size, so they cannot starve the normal class for long.
+
+``FairSendGate`` applies this to inline sends inside one process.
+``allocate_claims`` applies the same policy when send workers claim jobs from
+the shared queue.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Generic, Mapping, Optional, Sequence, TypeVar
+
+from app.config import get_settings
+
+T = TypeVar("T")
+
+
+class DeficitRoundRobin(Generic[T]):
+    """Deficit round robin over per-tenant FIFO queues (not thread-safe)."""
+
+    def __init__(self, quantum: float = 1.0) -> None:
+        if quantum <= 0:
+            raise ValueError("quantum must be positive")
+        self.quantum = quantum
+        self._queues: dict[str, deque[tuple[T, float]]] = {}
+        self._deficits: dict[str, float] = {}
+        self._active: deque[str] = deque()
+        # Whether the tenant at the head of ``_active`` still has to receive
+        # its quantum for the current visit.
+        self._fresh_visit = True
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def push(self, tenant: str, item: T, cost: float = 1.0) -> None:
+        """Queue ``item`` for ``tenant``; ``cost`` is charged when it is served."""
+
+        queue = self._queues.get(tenant)
+        if queue is None:
+            queue = self._queues[tenant] = deque()
+            self._deficits[tenant] = 0.0
+            self._active.append(tenant)
+        queue.append((item, cost))
+        self._length += 1
+
+    def _next_tenant(self) -> None:
+        self._active.rotate(-1)
+        self._fresh_visit = True
+
+    def pop(self, eligible: Optional[Callable[[str], bool]] = None) -> Optional[tuple[str, T]]:
+        """Return the next ``(tenant, item)``, skipping tenants ``eligible`` rejects.
+
+        Returns ``None`` when nothing is queued for an eligible tenant.
+        Skipped tenants keep their place and deficit for later calls.
+        """
+
+        skipped = 0
+        while self._active and skipped < len(self._active):
+            tenant = self._active[0]
+            if eligible is not None and not eligible(tenant):
+                skipped += 1
+                self._next_tenant()
+                continue
+            if self._fresh_visit:
+                self._deficits[tenant] += self.quantum
+                self._fresh_visit = False
+                skipped = 0
+            queue = self._queues[tenant]
+            item, cost = queue[0]
+            if cost > self._deficits[tenant]:
+                self._next_tenant()
+                continue
+            queue.popleft()
+            self._length -= 1
+            self._deficits[tenant] -= cost
+            if not queue:
+                # An idle tenant does not bank credit for later.
+                del self._queues[tenant], self._deficits[tenant]
+                self._active.popleft()
+                self._fresh_visit = True
+            return tenant, item
+        return None
+
+    def discard(self, predicate: Callable[[T], bool]) -> int:
+        """Drop queued items matching ``predicate``; returns how many were dropped."""
+
+        dropped = 0
+        for tenant in list(self._active):
+            queue = self._queues[tenant]
+            kept = deque(entry for entry in queue if not predicate(entry[0]))
+            dropped += len(queue) - len(kept)
+            if kept:
+                self._queues[tenant] = kept
+                continue
+            was_head = self._active[0] == tenant
+            del self._queues[tenant], self._deficits[tenant]
+            self._active.remove(tenant)
+            if was_head:
+                self._fresh_visit = True
+        self._length -= dropped
+        return dropped
+
+
+class FairQueue(Generic[T]):
+    """A priority DRR ring served strictly before a normal one."""
+
+    def __init__(self, quantum: float = 1.0) -> None:
+        self._priority: DeficitRoundRobin[T] = DeficitRoundRobin(quantum)
+        self._normal: DeficitRoundRobin[T] = DeficitRoundRobin(quantum)
+
+    def __len__(self) -> int:
+        return len(self._priority) + len(self._normal)
+
+    def push(self, tenant: str, item: T, cost: float = 1.0, priority: bool = False) -> None:
+        (self._priority if priority else self._normal).push(tenant, item, cost)
+
+    def pop(self, eligible: Optional[Callable[[str], bool]] = None) -> Optional[tuple[str, T]]:
+        return self._priority.pop(eligible) or self._normal.pop(eligible)
+
+    def discard(self, predicate: Callable[[T], bool]) -> int:
+        return self._priority.discard(predicate) + self._normal.discard(predicate)
+
+
+class FairSendGate:
+    """Admit concurrent sends from many tenants in fair order.
+
+    At most ``concurrency`` sends run at once in total and at most
+    ``tenant_concurrency`` per tenant; waiting sends are admitted through a
+    ``FairQueue``. Use one gate per event loop.
+    """
+
+    def __init__(self, concurrency: int, tenant_concurrency: int, quantum: float = 1.0) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.tenant_concurrency = max(tenant_concurrency, 1)
+        self._waiting: FairQueue[asyncio.Future[None]] = FairQueue(quantum)
+        self._running = 0
+        self._in_flight: dict[str, int] = {}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def _eligible(self, tenant: str) -> bool:
+        return self._in_flight.get(tenant, 0) < self.tenant_concurrency
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency:
+            popped = self._waiting.pop(self._eligible)
+            if popped is None:
+                return
+            tenant, waiter = popped
+            if waiter.done():  # cancelled while waiting
+                continue
+            waiter.set_result(None)
+            self._running += 1
+            self._in_flight[tenant] = self._in_flight.get(tenant, 0) + 1
+
+    def _release(self, tenant: str) -> None:
+        self._running -= 1
+        remaining = self._in_flight[tenant] - 1
+        if remaining:
+            self._in_flight[tenant] = remaining
+        else:
+            del self._in_flight[tenant]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, cost: float = 1.0, priority: bool = False) -> AsyncIterator[None]:
+        """Wait for a send slot for ``tenant`` and hold it for the block."""
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiting.push(tenant, waiter, cost, priority)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as the caller was cancelled; give the slot back.
+                self._release(tenant)
+            else:
+                self._waiting.discard(lambda queued: queued is waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release(tenant)
+
+
+@lru_cache
+def get_send_gate() -> FairSendGate:
+    """Return the gate shared by inline sends in this process."""
+
+    settings = get_settings()
+    return FairSendGate(
+        settings.send_total_concurrency,
+        settings.send_concurrency,
+        quantum=settings.send_fair_quantum_bytes,
+    )
+
+
+def allocate_claims(
+    backlog: Sequence[tuple[str, str, int, bool]],
+    slots: int,
+    in_flight: Mapping[str, int],
+    tenant_cap: int,
+    order: Sequence[str] = (),
+) -> list[tuple[str, str, int]]:
+    """Split ``slots`` queued jobs fairly between sessions.
+
+    ``backlog`` holds ``(session, batch, waiting, small)`` per queued batch and
+    ``in_flight`` the jobs each session already has leased. Sessions are
+    visited in ``order`` first (least recently served, say), small batches
+    before others, and no session goes above ``tenant_cap`` jobs in flight.
+    Returns ``(session, batch, count)`` for each batch that gets jobs.
+    """
+
+    rank = {session: position for position, session in enumerate(order)}
+    queue: FairQueue[str] = FairQueue()
+    for session, batch, waiting, small in sorted(backlog, key=lambda entry: rank.get(entry[0], len(rank))):
+        for _ in range(min(waiting, slots)):
+            queue.push(session, batch, priority=small)
+
+    claimed: dict[str, int] = {}
+    counts: dict[tuple[str, str], int] = {}
+    while slots > 0:
+        popped = queue.pop(lambda session: in_flight.get(session, 0) + claimed.get(session, 0) < tenant_cap)
+        if popped is None:
+            break
+        session, batch = popped
+        claimed[session] = claimed.get(session, 0) + 1
+        counts[(session, batch)] = counts.get((session, batch), 0) + 1
+        slots -= 1
+    return [(session, batch, count) for (session, batch), count in counts.items()]
+
+
+__all__ = [
+    "DeficitRoundRobin",
+    "FairQueue",
+    "FairSendGate",
+    "allocate_claims",
+    "get_send_gate",
+]
@@ -1,65 +1,125 @@
-"""Wrapper around the Gmail API."""
+"""Wrapper around the Gmail API.
 
-from __future__ import annotations
+All network I/O (code exchange, token refresh and sends) goes through a shared
+``httpx.AsyncClient`` so it never blocks the event loop. The client keeps
+connections alive between requests and negotiates HTTP/2 when the optional
+``h2`` package is installed.
+"""
 
-import base64
-from email.mime.text import MIMEText
-from typing import Optional
+from __future__ import annotations
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+from urllib.parse import urlencode
 
 from app.config import get_settings
+from app.services.mime_builder import get_builder
 from app.services.token_store import get_token_store
+from app.services.tracing import KIND_CLIENT, current_span, span
+
+if TYPE_CHECKING:  # pragma: no cover - imported lazily at runtime
+    import httpx
+    from google.oauth2.credentials import Credentials
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 
+# Refresh slightly before the real expiry so a token does not lapse between
+# the check and the send request it is used for.
+_EXPIRY_MARGIN = timedelta(seconds=60)
+
+
+class GmailAuthError(Exception):
+    """Raised when Google rejects an authorization code or refresh token."""
+
+
+class GmailSendError(Exception):
+    """Raised when the Gmail API refuses to send a message."""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self) -> bool:
+        return self.status_code == 429
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _error_message(response: "httpx.Response") -> str:
+    try:
+        payload = response.json()
+    except ValueError:
+        return f"HTTP {response.status_code}"
+    error = payload.get("error")
+    if isinstance(error, dict):
+        return str(error.get("message") or f"HTTP {response.status_code}")
+    return str(payload.get("error_description") or error or f"HTTP {response.status_code}")
+
+
+def _retry_after(response: "httpx.Response", maximum: float) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    try:
+        delay = float(value) if value is not None else None
+    except ValueError:
+        return None
+    return None if delay is None else min(max(delay, 0.0), maximum)
+
 
 class GmailClient:
     """Handle OAuth flows and message sending via Gmail."""
 
-    def __init__(self) -> None:
+    def __init__(self, transport: Optional["httpx.AsyncBaseTransport"] = None) -> None:
         self._settings = get_settings()
         self._token_store = get_token_store()
+        self._transport = transport
+        self._http: Optional["httpx.AsyncClient"] = None
+        # user id -> (lock, callers holding or waiting for it)
+        self._refresh_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+    def _client(self) -> "httpx.AsyncClient":
+        if self._http is None:
+            import httpx
+
+            self._http = httpx.AsyncClient(
+                http2=self._settings.gmail_http2 and self._transport is None and _http2_available(),
+                timeout=self._settings.gmail_timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=self._settings.gmail_max_connections,
+                    max_keepalive_connections=self._settings.gmail_max_connections,
+                ),
+                transport=self._transport,
+            )
+        return self._http
 
-    def _client_config(
+    async def aclose(self) -> None:
+        """Close pooled connections; a new pool is created on next use."""
+
+        if self._http is not None:
+            http, self._http = self._http, None
+            await http.aclose()
+
+    def _client_credentials(
         self,
         client_id_override: Optional[str] = None,
         client_secret_override: Optional[str] = None,
         redirect_override: Optional[str] = None,
-    ) -> dict:
+    ) -> tuple[Optional[str], Optional[str], str]:
         client_id = client_id_override or self._settings.google_client_id
         client_secret = client_secret_override or self._settings.google_client_secret
         redirect_uri = redirect_override or self._settings.google_redirect_uri
-        return {
-            "web": {
-                "client_id": client_id,
-                "client_secret": client_secret,
-                "redirect_uris": [redirect_uri],
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-            }
-        }
-
-    def _build_flow(
-        self,
-        state: str,
-        client_id_override: Optional[str] = None,
-        client_secret_override: Optional[str] = None,
-        redirect_override: Optional[str] = None,
-    ) -> Flow:
-        return Flow.from_client_config(
-            self._client_config(
-                client_id_override=client_id_override,
-                client_secret_override=client_secret_override,
-                redirect_override=redirect_override,
-            ),
-            scopes=SCOPES,
-            redirect_uri=redirect_override or self._settings.google_redirect_uri,
-            state=state,
-        )
+        return client_id, client_secret, redirect_uri
 
     def authorization_url(
         self,
@@ -68,19 +128,57 @@ class GmailClient:
         client_secret_override: Optional[str] = None,
         redirect_override: Optional[str] = None,
     ) -> str:
-        flow = self._build_flow(
-            state,
+        client_id, _, redirect_uri = self._client_credentials(
             client_id_override=client_id_override,
             client_secret_override=client_secret_override,
             redirect_override=redirect_override,
         )
-        auth_url, _ = flow.authorization_url(
-            access_type="offline",
-            prompt="consent",
+        query = urlencode(
+            {
+                "response_type": "code",
+                "client_id": client_id or "",
+                "redirect_uri": redirect_uri,
+                "scope": " ".join(SCOPES),
+                "state": state,
+                "access_type": "offline",
+                "prompt": "consent",
+            }
+        )
+        return f"{self._settings.google_auth_uri}?{query}"
+
+    def _credentials_from_token_response(
+        self,
+        payload: dict,
+        client_id: Optional[str],
+        client_secret: Optional[str],
+        refresh_token: Optional[str] = None,
+    ) -> Credentials:
+        from google.oauth2.credentials import Credentials
+
+        expiry = None
+        if payload.get("expires_in") is not None:
+            # google-auth compares against naive UTC timestamps.
+            expiry = datetime.utcnow() + timedelta(seconds=int(payload["expires_in"]))
+        scopes = payload.get("scope")
+        return Credentials(
+            token=payload["access_token"],
+            refresh_token=payload.get("refresh_token") or refresh_token,
+            token_uri=self._settings.google_token_uri,
+            client_id=client_id,
+            client_secret=client_secret,
+            scopes=scopes.split() if scopes else SCOPES,
+            expiry=expiry,
         )
-        return auth_url
 
-    def exchange_code(
+    async def _token_request(self, data: dict[str, str]) -> dict:
+        with span("gmail.token_request", {"oauth.grant_type": data["grant_type"]}, kind=KIND_CLIENT) as current:
+            response = await self._client().post(self._settings.google_token_uri, data=data)
+            current.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code != 200:
+                raise GmailAuthError(_error_message(response))
+            return response.json()
+
+    async def exchange_code(
         self,
         state: str,
         code: str,
@@ -88,40 +186,146 @@ class GmailClient:
         client_secret_override: Optional[str] = None,
         redirect_override: Optional[str] = None,
     ) -> Credentials:
-        flow = self._build_flow(
-            state,
+        client_id, client_secret, redirect_uri = self._client_credentials(
             client_id_override=client_id_override,
             client_secret_override=client_secret_override,
             redirect_override=redirect_override,
         )
-        flow.fetch_token(code=code)
-        credentials = flow.credentials
-        self._token_store.save_credentials(state, credentials)
+        payload = await self._token_request(
+            {
+                "grant_type": "authorization_code",
+                "code": code,
+                "client_id": client_id or "",
+                "client_secret": client_secret or "",
+                "redirect_uri": redirect_uri,
+            }
+        )
+        credentials = self._credentials_from_token_response(payload, client_id, client_secret)
+        await asyncio.to_thread(self._token_store.save_credentials, state, credentials)
         return credentials
 
-    def get_credentials(self, user_id: str) -> Optional[Credentials]:
-        credentials = self._token_store.load_credentials(user_id)
-        if credentials and credentials.expired and credentials.refresh_token:
-            credentials.refresh(Request())
-            self._token_store.save_credentials(user_id, credentials)
-        return credentials
+    @asynccontextmanager
+    async def _refresh_lock(self, user_id: str) -> AsyncIterator[None]:
+        """Hold the user's refresh lock; the entry is dropped once nobody needs it."""
+
+        lock, users = self._refresh_locks.get(user_id, (asyncio.Lock(), 0))
+        self._refresh_locks[user_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._refresh_locks[user_id]
+            if users > 1:
+                self._refresh_locks[user_id] = (lock, users - 1)
+            else:
+                del self._refresh_locks[user_id]
+
+    @staticmethod
+    def _needs_refresh(credentials: Credentials) -> bool:
+        if not credentials.refresh_token:
+            return False
+        if credentials.expiry is None:
+            return not credentials.token
+        return datetime.utcnow() >= credentials.expiry - _EXPIRY_MARGIN
+
+    async def get_credentials(self, user_id: str) -> Optional[Credentials]:
+        with span("gmail.get_credentials", {"credentials.refreshed": False}):
+            return await self._get_credentials(user_id)
+
+    async def _get_credentials(self, user_id: str) -> Optional[Credentials]:
+        current = current_span()
+        credentials = await asyncio.to_thread(self._token_store.load_credentials, user_id)
+        if not credentials or not self._needs_refresh(credentials):
+            return credentials
+        # Concurrent callers for the same user wait for one refresh instead of
+        # each spending a token request, then pick up the stored result.
+        waited = time.perf_counter()
+        async with self._refresh_lock(user_id):
+            current.set_attribute("credentials.refresh_lock_wait_ms", (time.perf_counter() - waited) * 1000)
+            latest = await asyncio.to_thread(self._token_store.load_credentials, user_id)
+            if latest and not self._needs_refresh(latest):
+                return latest
+            current.set_attribute("credentials.refreshed", True)
+            credentials = latest or credentials
+            payload = await self._token_request(
+                {
+                    "grant_type": "refresh_token",
+                    "refresh_token": credentials.refresh_token,
+                    "client_id": credentials.client_id or "",
+                    "client_secret": credentials.client_secret or "",
+                }
+            )
+            refreshed = self._credentials_from_token_response(
+                payload,
+                credentials.client_id,
+                credentials.client_secret,
+                refresh_token=credentials.refresh_token,
+            )
+            await asyncio.to_thread(self._token_store.save_credentials, user_id, refreshed)
+            return refreshed
+
+    @staticmethod
+    def build_raw_message(to_email: str, subject: str, body: str) -> str:
+        return get_builder().build(to_email, subject, body)
+
+    async def send_raw(self, credentials: Credentials, raw_message: str, retry_throttled: bool = True) -> dict:
+        """Send an already encoded message, retrying when that cannot send it twice.
+
+        ``messages.send`` is not idempotent: a 5xx may arrive after Gmail
+        accepted the message, so it is raised rather than retried. Only a 429
+        and a connection that failed before the request went out are retried.
+        With ``retry_throttled=False`` a 429 is raised immediately so the
+        caller can move the message to another account instead of waiting.
+        ``Retry-After`` is capped at ``gmail_max_retry_after_seconds``.
+        """
 
-    def send_message(self, credentials: Credentials, to_email: str, subject: str, body: str) -> dict:
-        message = MIMEText(body, "plain", "utf-8")
-        message["to"] = to_email
-        message["subject"] = subject
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
-        service = build("gmail", "v1", credentials=credentials)
-        return service.users().messages().send(userId="me", body={"raw": raw_message}).execute()
+        import httpx
 
+        url = f"{self._settings.gmail_api_base_url.rstrip('/')}/gmail/v1/users/me/messages/send"
+        headers = {"Authorization": f"Bearer {credentials.token}"}
+        attempt = 0
+        with span("gmail.send", {"message.bytes": len(raw_message)}, kind=KIND_CLIENT) as current:
+            while True:
+                current.set_attribute("gmail.attempts", attempt + 1)
+                try:
+                    response = await self._client().post(url, json={"raw": raw_message}, headers=headers)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                    # Nothing was sent, so sending again cannot duplicate the message.
+                    if attempt >= self._settings.gmail_max_retries:
+                        raise
+                    delay = 0.5 * 2**attempt
+                else:
+                    current.set_attribute("http.response.status_code", response.status_code)
+                    if response.status_code == 200:
+                        return response.json()
+                    error = GmailSendError(
+                        _error_message(response),
+                        response.status_code,
+                        retry_after=_retry_after(response, self._settings.gmail_max_retry_after_seconds),
+                    )
+                    retryable = error.throttled and retry_throttled
+                    if not retryable or attempt >= self._settings.gmail_max_retries:
+                        raise error
+                    delay = error.retry_after if error.retry_after is not None else 0.5 * 2**attempt
+                attempt += 1
+                current.add_event("retry", {"retry.delay_seconds": float(delay)})
+                await asyncio.sleep(delay)
 
-_client = GmailClient()
+    async def send_message(self, credentials: Credentials, to_email: str, subject: str, body: str) -> dict:
+        return await self.send_raw(credentials, self.build_raw_message(to_email, subject, body))
 
 
+@lru_cache
 def get_gmail_client() -> GmailClient:
-    """Return shared Gmail client."""
+    """Return shared Gmail client, constructing it on first use."""
 
-    return _client
+    return GmailClient()
 
 
-__all__ = ["GmailClient", "get_gmail_client", "SCOPES"]
+__all__ = [
+    "GmailAuthError",
+    "GmailClient",
+    "GmailSendError",
+    "SCOPES",
+    "get_gmail_client",
+]
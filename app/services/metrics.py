@@ -0,0 +1,333 @@
+"""Low-overhead in-process metrics exposed in Prometheus text format.
+
+Every metric child keeps one value cell per thread. The hot path only ever
+writes to the calling thread's own cell, so recording a sample never takes a
+lock; a scrape sums the cells of all threads. The only synchronisation is a
+list append the first time a given thread touches a given child.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Iterable, Iterator, Optional, Sequence
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class _Sharded:
+    """Per-thread list cells of a fixed width."""
+
+    __slots__ = ("_width", "_local", "_cells")
+
+    def __init__(self, width: int) -> None:
+        self._width = width
+        self._local = threading.local()
+        self._cells: list[list[float]] = []
+
+    def cell(self) -> list[float]:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0.0] * self._width
+            self._local.cell = cell
+            self._cells.append(cell)
+            return cell
+
+    def totals(self) -> list[float]:
+        totals = [0.0] * self._width
+        for cell in list(self._cells):
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self) -> None:
+        self._shards = _Sharded(1)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._shards.cell()[0] += amount
+
+    def value(self) -> float:
+        return self._shards.totals()[0]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._shards.cell()[0] -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_shards")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self._bounds = bounds
+        # One slot per bucket, one for +Inf and a trailing running sum.
+        self._shards = _Sharded(len(bounds) + 2)
+
+    def observe(self, value: float) -> None:
+        cell = self._shards.cell()
+        cell[bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> tuple[list[float], float]:
+        totals = self._shards.totals()
+        return totals[:-1], totals[-1]
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def _child(self, values: tuple[str, ...]) -> object:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self) -> Iterable[tuple[str, tuple[tuple[str, str], ...], float]]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [
+            f"# HELP {self.name} {_escape_help(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def labels(self, *values: str) -> _CounterChild:
+        return self._child(tuple(str(value) for value in values))  # type: ignore[return-value]
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> Iterable[tuple[str, tuple[tuple[str, str], ...], float]]:
+        for values, child in list(self._children.items()):
+            yield self.name, tuple(zip(self.labelnames, values)), child.value()  # type: ignore[attr-defined]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be computed at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+        self._value: Optional[float] = None
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def labels(self, *values: str) -> _GaugeChild:
+        return self._child(tuple(str(value) for value in values))  # type: ignore[return-value]
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        """Record an absolute value; a single attribute store, last write wins."""
+
+        self._value = float(value)
+
+    def set_function(self, callback: Callable[[], float]) -> None:
+        self._callback = callback
+
+    def _samples(self) -> Iterable[tuple[str, tuple[tuple[str, str], ...], float]]:
+        if self._callback is not None:
+            yield self.name, (), float(self._callback())
+            return
+        if self._value is not None:
+            yield self.name, (), self._value
+            return
+        for values, child in list(self._children.items()):
+            yield self.name, tuple(zip(self.labelnames, values)), child.value()  # type: ignore[attr-defined]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._bounds = tuple(sorted(float(bound) for bound in buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self._bounds)
+
+    def labels(self, *values: str) -> _HistogramChild:
+        return self._child(tuple(str(value) for value in values))  # type: ignore[return-value]
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> ContextManager[None]:
+        return self.labels().time()
+
+    def _samples(self) -> Iterable[tuple[str, tuple[tuple[str, str], ...], float]]:
+        for values, child in list(self._children.items()):
+            base = tuple(zip(self.labelnames, values))
+            counts, total = child.snapshot()  # type: ignore[attr-defined]
+            cumulative = 0.0
+            for bound, count in zip(self._bounds + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", base + (("le", _format_value(bound)),), cumulative
+            yield f"{self.name}_sum", base, total
+            yield f"{self.name}_count", base, cumulative
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together on scrape."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], float]] = None,
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """Return the process-wide metrics registry."""
+
+    return REGISTRY
+
+
+__all__ = [
+    "CONTENT_TYPE",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "REGISTRY",
+    "get_registry",
+]
@@ -0,0 +1,218 @@
+"""Fast construction of base64url-encoded raw messages for the Gmail API.
+
+``RawMessageBuilder`` produces exactly the bytes of
+``MIMEText(body, "plain", "utf-8")`` with ``to``/``subject`` headers, but
+without building an ``email.message`` object per recipient. The invariant
+MIME header block is encoded once; only the per-recipient headers and body
+are encoded per message, into a buffer that is reused between calls.
+
+For large batches ``PreEncodedBatch`` hands chunks of messages to a process
+pool as soon as it is created, so senders find their payload ready instead of
+encoding on the event loop thread. This module only imports the standard
+library so pool workers start quickly.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email import policy
+from email.errors import HeaderParseError
+from functools import lru_cache
+from typing import Optional, Sequence, Union
+
+_HEADER_BLOCK = (
+    b'Content-Type: text/plain; charset="utf-8"\n'
+    b"MIME-Version: 1.0\n"
+    b"Content-Transfer-Encoding: base64\n"
+)
+_MAX_LINE = policy.compat32.max_line_length
+_URLSAFE = bytes.maketrans(b"+/", b"-_")
+_local = threading.local()
+
+MessageParts = tuple[str, str, str]
+
+
+class MessageEncodingError(ValueError):
+    """Raised when one message cannot be encoded, e.g. a header with a line break."""
+
+
+def _header(name: str, value: str) -> bytes:
+    line = f"{name}: {value}\n"
+    if len(line) <= _MAX_LINE + 1 and line.isascii() and "\r" not in value and "\n" not in value:
+        return line.encode("ascii")
+    # Non-ASCII or long values need RFC 2047 encoding or folding; defer to
+    # the same policy ``as_bytes`` uses so the output stays identical.
+    return policy.compat32.fold_binary(name, value)
+
+
+class RawMessageBuilder:
+    """Build raw Gmail payloads with the invariant header block precomputed.
+
+    Instances keep a scratch buffer and are not thread-safe; use one per
+    thread or process.
+    """
+
+    def __init__(self) -> None:
+        # base64 of a concatenation equals the concatenation of the parts'
+        # base64 as long as the first part's length is a multiple of three.
+        aligned = len(_HEADER_BLOCK) - len(_HEADER_BLOCK) % 3
+        self._encoded_prefix = base64.urlsafe_b64encode(_HEADER_BLOCK[:aligned]).decode("ascii")
+        self._prefix_tail = _HEADER_BLOCK[aligned:]
+        self._buffer = bytearray()
+
+    def build(self, to_email: str, subject: str, body: str) -> str:
+        """Return the base64url-encoded RFC 2822 message for one recipient.
+
+        Raises ``MessageEncodingError`` if the message cannot be encoded.
+        """
+
+        buffer = self._buffer
+        buffer.clear()
+        buffer += self._prefix_tail
+        try:
+            buffer += _header("to", to_email)
+            buffer += _header("subject", subject)
+            buffer += b"\n"
+            buffer += base64.encodebytes(body.encode("utf-8"))
+        except (HeaderParseError, UnicodeError) as exc:
+            raise MessageEncodingError(f"Could not encode message: {exc}") from exc
+        encoded = binascii.b2a_base64(buffer, newline=False).translate(_URLSAFE)
+        return self._encoded_prefix + encoded.decode("ascii")
+
+    def build_bytes(self, to_email: str, subject: str, body: str) -> bytes:
+        """Return the same message unencoded, as written to ``.eml`` exports."""
+
+        try:
+            return b"".join(
+                (
+                    _HEADER_BLOCK,
+                    _header("to", to_email),
+                    _header("subject", subject),
+                    b"\n",
+                    base64.encodebytes(body.encode("utf-8")),
+                )
+            )
+        except (HeaderParseError, UnicodeError) as exc:
+            raise MessageEncodingError(f"Could not encode message: {exc}") from exc
+
+    def build_many(self, messages: Sequence[MessageParts]) -> list[Union[str, MessageEncodingError]]:
+        """Encode several messages; one that fails is returned as its error."""
+
+        encoded: list[Union[str, MessageEncodingError]] = []
+        for to_email, subject, body in messages:
+            try:
+                encoded.append(self.build(to_email, subject, body))
+            except MessageEncodingError as exc:
+                encoded.append(exc)
+        return encoded
+
+
+def get_builder() -> RawMessageBuilder:
+    """Return the calling thread's builder."""
+
+    builder = getattr(_local, "builder", None)
+    if builder is None:
+        builder = _local.builder = RawMessageBuilder()
+    return builder
+
+
+def encode_chunk(messages: Sequence[MessageParts]) -> list[Union[str, MessageEncodingError]]:
+    """Process pool entry point: encode a chunk of ``(to, subject, body)``."""
+
+    return get_builder().build_many(messages)
+
+
+@lru_cache
+def get_encoding_pool() -> ProcessPoolExecutor:
+    """Return the shared pre-encoding process pool, starting it on first use."""
+
+    from app.config import get_settings
+
+    # "spawn" avoids forking a process that already runs threads (the event
+    # loop's default executor, token store I/O).
+    return ProcessPoolExecutor(
+        max_workers=get_settings().mime_encode_processes,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def shutdown_encoding_pool() -> None:
+    """Stop the pool workers if the pool was started."""
+
+    if get_encoding_pool.cache_info().currsize:
+        get_encoding_pool().shutdown(wait=False, cancel_futures=True)
+        get_encoding_pool.cache_clear()
+
+
+class PreEncodedBatch:
+    """Raw payloads for a batch, encoded ahead of the senders.
+
+    With an executor every chunk is submitted immediately, so by the time a
+    sender asks for message ``i`` its chunk is usually finished. Without one
+    each payload is built on demand on the calling thread.
+    """
+
+    def __init__(
+        self,
+        messages: Sequence[MessageParts],
+        executor: Optional[Executor] = None,
+        chunk_size: int = 256,
+    ) -> None:
+        self._messages = messages
+        self._chunk_size = chunk_size
+        self._chunks: list[asyncio.Future[list[Union[str, MessageEncodingError]]]] = []
+        if executor is not None:
+            loop = asyncio.get_running_loop()
+            self._chunks = [
+                loop.run_in_executor(executor, encode_chunk, messages[start : start + chunk_size])
+                for start in range(0, len(messages), chunk_size)
+            ]
+
+    async def raw(self, index: int) -> str:
+        """Return the encoded payload of ``messages[index]``.
+
+        Raises ``MessageEncodingError`` for a message that cannot be encoded;
+        the rest of its chunk is unaffected.
+        """
+
+        if self._chunks:
+            try:
+                chunk = await self._chunks[index // self._chunk_size]
+            except BrokenProcessPool:
+                pass
+            else:
+                encoded = chunk[index % self._chunk_size]
+                if isinstance(encoded, MessageEncodingError):
+                    raise encoded
+                return encoded
+        return get_builder().build(*self._messages[index])
+
+
+def pre_encode(messages: Sequence[MessageParts]) -> PreEncodedBatch:
+    """Start encoding ``messages`` using the pool when the batch is large enough."""
+
+    from app.config import get_settings
+
+    settings = get_settings()
+    executor = None
+    if settings.mime_encode_processes > 0 and len(messages) >= settings.mime_encode_min_batch:
+        executor = get_encoding_pool()
+    return PreEncodedBatch(messages, executor=executor, chunk_size=settings.mime_encode_chunk_size)
+
+
+__all__ = [
+    "MessageEncodingError",
+    "PreEncodedBatch",
+    "RawMessageBuilder",
+    "encode_chunk",
+    "get_builder",
+    "get_encoding_pool",
+    "pre_encode",
+    "shutdown_encoding_pool",
+]
@@ -8,12 +8,11 @@ Values are encrypted at rest using the app's Fernet key.
 from __future__ import annotations
 
 import json
+from functools import lru_cache
 from pathlib import Path
 from threading import Lock
 from typing import Optional, Tuple
 
-from cryptography.fernet import Fernet, InvalidToken
-
 from app.config import get_settings
 
 
@@ -21,6 +20,8 @@ class StateCredentialStore:
     """Persist minimal credentials keyed by OAuth `state`."""
 
     def __init__(self) -> None:
+        from cryptography.fernet import Fernet
+
         settings = get_settings()
         # Reuse the data directory; keep a separate file from token storage
         self._path: Path = Path("data/pending_credentials.json")
@@ -29,6 +30,8 @@ class StateCredentialStore:
         self._lock = Lock()
 
     def _load(self) -> dict[str, dict[str, str]]:
+        from cryptography.fernet import InvalidToken
+
         if not self._path.exists():
             return {}
         try:
@@ -69,11 +72,9 @@ class StateCredentialStore:
             return record["client_id"], record["client_secret"]
 
 
-_state_store = StateCredentialStore()
-
-
+@lru_cache
 def get_state_store() -> StateCredentialStore:
-    return _state_store
+    return StateCredentialStore()
 
 
 __all__ = ["StateCredentialStore", "get_state_store"]
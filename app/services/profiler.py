@@ -0,0 +1,238 @@
+"""Sampling profiler for individual requests.
+
+A background thread periodically captures the stack of the thread handling
+the request (the event loop thread for async routes), plus the stacks of the
+event loop's worker threads while they run ``asyncio.to_thread`` calls, and
+aggregates identical stacks. Results can be exported as collapsed stacks
+(``flamegraph.pl`` / ``inferno`` input) or as a speedscope JSON document.
+
+Because requests share the event loop and its worker threads, samples taken
+while a profiled request is awaiting I/O may show other requests' frames.
+The profile is most precise for CPU-bound work such as ``parse_recipients``
+and DOCX extraction. Batches whose templates run Jinja code render in a
+separate process (see ``RenderPool``), which is not sampled; the profile
+shows only the wait for it.
+"""
+
+from __future__ import annotations
+
+import json
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import thread as futures_thread
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+from types import FrameType
+from typing import Optional
+
+from app.config import get_settings
+
+Frame = tuple[str, str, int]
+
+# Threads of the event loop's default executor, which ``asyncio.to_thread`` uses.
+_WORKER_THREAD_PREFIX = "asyncio_"
+# Frame that runs a submitted call; idle executor threads have none.
+_WORK_ITEM = ("_WorkItem.run", "run")
+_WORK_ITEM_FILE = futures_thread.__file__
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+PROFILE_FORMATS = ("speedscope", "collapsed")
+
+
+def _frame_key(frame: FrameType) -> Frame:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return name, code.co_filename, code.co_firstlineno
+
+
+def _stack(frame: Optional[FrameType]) -> tuple[Frame, ...]:
+    frames: list[Frame] = []
+    while frame is not None:
+        frames.append(_frame_key(frame))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+def _thread_cpu_time(thread_id: int) -> Optional[float]:
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):  # pragma: no cover - platform specific
+        return None
+
+
+class RequestProfile:
+    """Aggregated samples for one profiled request."""
+
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        stacks: Counter[tuple[Frame, ...]],
+        wall_seconds: float,
+        cpu_seconds: Optional[float],
+    ) -> None:
+        self.name = name
+        self.interval = interval
+        self.stacks = stacks
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+
+    @property
+    def sample_count(self) -> int:
+        return sum(self.stacks.values())
+
+    def to_collapsed(self) -> str:
+        lines = []
+        for stack, count in sorted(self.stacks.items()):
+            label = ";".join(f"{name} ({Path(filename).name}:{line})" for name, filename, line in stack)
+            lines.append(f"{label} {count}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def to_speedscope(self) -> dict:
+        frame_index: dict[Frame, int] = {}
+        frames: list[dict] = []
+        samples: list[list[int]] = []
+        weights: list[float] = []
+        interval_ms = self.interval * 1000
+        for stack, count in self.stacks.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    name, filename, line = frame
+                    frames.append({"name": name, "file": filename, "line": line})
+                indices.append(frame_index[frame])
+            samples.append(indices)
+            weights.append(count * interval_ms)
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": self.name,
+            "exporter": "email-batch-app",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self.name,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+            "metadata": {
+                "wall_seconds": self.wall_seconds,
+                "cpu_seconds": self.cpu_seconds,
+                "sample_interval_seconds": self.interval,
+            },
+        }
+
+
+def _running_work(stack: tuple[Frame, ...]) -> bool:
+    return any(name in _WORK_ITEM and filename == _WORK_ITEM_FILE for name, filename, _ in stack)
+
+
+class SamplingProfiler:
+    """Sample the stack of one thread at a fixed interval until stopped.
+
+    Event loop worker threads (``asyncio.to_thread``) are sampled too while
+    they run a call, so blocking work moved off the loop stays visible.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005) -> None:
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stacks: Counter[tuple[Frame, ...]] = Counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._started_wall = 0.0
+        self._started_cpu: Optional[float] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            frames = sys._current_frames()
+            frame = frames.get(self._thread_id)
+            if frame is not None:
+                self._stacks[_stack(frame)] += 1
+            for thread in threading.enumerate():
+                if thread.ident is None or not thread.name.startswith(_WORKER_THREAD_PREFIX):
+                    continue
+                frame = frames.get(thread.ident)
+                stack = _stack(frame) if frame is not None else ()
+                if _running_work(stack):
+                    self._stacks[stack] += 1
+
+    def start(self) -> None:
+        self._started_wall = time.perf_counter()
+        self._started_cpu = _thread_cpu_time(self._thread_id)
+        self._sampler.start()
+
+    def stop(self, name: str) -> RequestProfile:
+        self._stop.set()
+        self._sampler.join()
+        wall = time.perf_counter() - self._started_wall
+        ended_cpu = _thread_cpu_time(self._thread_id)
+        cpu = None
+        if self._started_cpu is not None and ended_cpu is not None:
+            cpu = ended_cpu - self._started_cpu
+        return RequestProfile(name, self._interval, self._stacks, wall, cpu)
+
+
+class ProfileStore:
+    """Keep the most recent profiles on disk for later download."""
+
+    def __init__(self, directory: Path, retention: int) -> None:
+        self._directory = directory
+        self._retention = retention
+        self._lock = Lock()
+
+    def reserve_id(self) -> str:
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{secrets.token_hex(4)}"
+
+    def save(self, profile: RequestProfile, profile_id: Optional[str] = None) -> str:
+        profile_id = profile_id or self.reserve_id()
+        with self._lock:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            (self._directory / f"{profile_id}.speedscope.json").write_text(
+                json.dumps(profile.to_speedscope()), encoding="utf-8"
+            )
+            (self._directory / f"{profile_id}.collapsed").write_text(profile.to_collapsed(), encoding="utf-8")
+            self._prune()
+        return profile_id
+
+    def _prune(self) -> None:
+        profiles = sorted(self._directory.glob("*.speedscope.json"))
+        for stale in profiles[: max(len(profiles) - self._retention, 0)]:
+            profile_id = stale.name[: -len(".speedscope.json")]
+            stale.unlink(missing_ok=True)
+            (self._directory / f"{profile_id}.collapsed").unlink(missing_ok=True)
+
+    def path_for(self, profile_id: str, fmt: str) -> Optional[Path]:
+        if fmt not in PROFILE_FORMATS or not profile_id.replace("-", "").isalnum():
+            return None
+        suffix = ".speedscope.json" if fmt == "speedscope" else ".collapsed"
+        path = self._directory / f"{profile_id}{suffix}"
+        return path if path.exists() else None
+
+
+@lru_cache
+def get_profile_store() -> ProfileStore:
+    """Return the shared profile store, constructing it on first use."""
+
+    settings = get_settings()
+    return ProfileStore(settings.profile_storage_path, settings.profile_retention)
+
+
+__all__ = [
+    "PROFILE_FORMATS",
+    "ProfileStore",
+    "RequestProfile",
+    "SamplingProfiler",
+    "get_profile_store",
+]
@@ -0,0 +1,378 @@
+"""Scheduled and time-windowed sending.
+
+A send plan says when a batch should go out: a wall-clock start time in a
+timezone (optionally interpreted in each recipient's own timezone), a window
+to spread the messages over, and a maximum hourly rate. Creating a plan
+computes a release time for every message and stores both in the send queue's
+SQLite database, so plans survive restarts.
+
+``Scheduler`` keeps a heap with one entry per plan, keyed by that plan's next
+release time, and sleeps until the earliest one. When it fires, every due
+message of the plan moves into ``send_jobs`` in one transaction and the plan
+is pushed back with its following release time. Several schedulers (web
+process and workers) may run against the same database; releases are atomic,
+so a message is only ever queued once.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Collection, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+from pydantic import BaseModel, Field, field_validator
+
+from app.config import get_settings
+from app.models.domain import known_timezone
+from app.services.send_queue import SendQueue, get_send_queue
+
+logger = logging.getLogger("app.scheduler")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS send_plans (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    batch_id TEXT NOT NULL,
+    start_at TEXT NOT NULL,
+    timezone TEXT NOT NULL,
+    recipient_local INTEGER NOT NULL,
+    window_minutes INTEGER NOT NULL,
+    max_per_hour INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    released INTEGER NOT NULL DEFAULT 0,
+    last_release_at REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS send_plans_session ON send_plans (session_id);
+CREATE INDEX IF NOT EXISTS send_plans_status ON send_plans (status);
+CREATE TABLE IF NOT EXISTS scheduled_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plan_id TEXT NOT NULL,
+    message_index INTEGER NOT NULL,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    release_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduled_messages_due ON scheduled_messages (plan_id, release_at);
+"""
+
+SCHEDULED = "scheduled"
+RELEASED = "released"
+CANCELLED = "cancelled"
+
+
+class SendPlan(BaseModel):
+    """When and how fast a batch should be sent."""
+
+    start_at: datetime = Field(..., description="Wall-clock start time, without timezone")
+    timezone: str = "UTC"
+    recipient_local_time: bool = Field(
+        False, description="Use each recipient's own timezone for the start time when known"
+    )
+    window_minutes: int = Field(0, ge=0, le=7 * 24 * 60)
+    max_per_hour: int = Field(0, ge=0)
+
+    @field_validator("timezone")
+    @classmethod
+    def _known_timezone(cls, value: str) -> str:
+        return known_timezone(value) or "UTC"
+
+
+class PlanSummary(BaseModel):
+    """A plan as shown on the schedule page."""
+
+    id: str
+    plan: SendPlan
+    status: str
+    total: int
+    released: int
+    next_release_at: Optional[datetime] = None
+    last_release_at: Optional[datetime] = None
+
+
+def _utc(timestamp: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc) if timestamp is not None else None
+
+
+def release_times(
+    plan: SendPlan,
+    recipient_timezones: Sequence[Optional[str]],
+    now: Optional[float] = None,
+) -> list[float]:
+    """Return a UTC release timestamp for each message, in input order.
+
+    Messages that share a start instant are spread evenly over the window,
+    then consecutive releases are pushed apart to honour ``max_per_hour``.
+    With ``recipient_local_time`` a start that has already passed in a
+    recipient's timezone moves to the same time on the next day.
+    """
+
+    now = time.time() if now is None else now
+    starts: dict[str, float] = {}
+
+    def start_for(name: str, roll_forward: bool) -> float:
+        if name not in starts:
+            moment = plan.start_at.replace(tzinfo=ZoneInfo(name))
+            while roll_forward and moment.timestamp() < now:
+                moment += timedelta(days=1)
+            starts[name] = max(moment.timestamp(), now)
+        return starts[name]
+
+    bases = [
+        start_for(tz, True) if plan.recipient_local_time and tz else start_for(plan.timezone, False)
+        for tz in recipient_timezones
+    ]
+    groups: dict[float, list[int]] = {}
+    for index, base in enumerate(bases):
+        groups.setdefault(base, []).append(index)
+
+    candidates = [0.0] * len(bases)
+    window = plan.window_minutes * 60
+    for base, members in groups.items():
+        step = window / len(members)
+        for position, index in enumerate(members):
+            candidates[index] = base + position * step
+
+    interval = 3600 / plan.max_per_hour if plan.max_per_hour else 0.0
+    releases = [0.0] * len(bases)
+    previous: Optional[float] = None
+    for index in sorted(range(len(bases)), key=lambda item: (candidates[item], item)):
+        release = candidates[index] if previous is None else max(candidates[index], previous + interval)
+        releases[index] = previous = release
+    return releases
+
+
+class ScheduleStore:
+    """Plans and not-yet-released messages, kept next to the send queue."""
+
+    def __init__(self, queue: SendQueue) -> None:
+        self._queue = queue
+        with queue.transaction() as connection:
+            for statement in filter(str.strip, _SCHEMA.split(";")):
+                connection.execute(statement)
+
+    def create(
+        self,
+        session_id: str,
+        batch_id: str,
+        plan: SendPlan,
+        messages: Sequence[tuple[int, str, str, str]],
+        releases: Sequence[float],
+    ) -> str:
+        """Store a plan with the release time of each ``(index, to, subject, body)``."""
+
+        plan_id = secrets.token_urlsafe(8)
+        with self._queue.transaction() as connection:
+            connection.execute(
+                "INSERT INTO send_plans (id, session_id, batch_id, start_at, timezone, recipient_local,"
+                " window_minutes, max_per_hour, status, total, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    plan_id,
+                    session_id,
+                    batch_id,
+                    plan.start_at.isoformat(),
+                    plan.timezone,
+                    int(plan.recipient_local_time),
+                    plan.window_minutes,
+                    plan.max_per_hour,
+                    SCHEDULED if messages else RELEASED,
+                    len(messages),
+                    time.time(),
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO scheduled_messages (plan_id, message_index, to_email, subject, body, release_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(plan_id, *message, release) for message, release in zip(messages, releases)],
+            )
+        return plan_id
+
+    def release_due(self, plan_id: str, now: Optional[float] = None) -> tuple[int, Optional[float]]:
+        """Queue every due message of a plan; return (released, next release time)."""
+
+        now = time.time() if now is None else now
+        with self._queue.transaction() as connection:
+            plan = connection.execute(
+                "SELECT session_id, batch_id FROM send_plans WHERE id = ? AND status = ?",
+                (plan_id, SCHEDULED),
+            ).fetchone()
+            if plan is None:
+                return 0, None
+            due = connection.execute(
+                "SELECT id, message_index, to_email, subject, body FROM scheduled_messages"
+                " WHERE plan_id = ? AND release_at <= ? ORDER BY release_at, id",
+                (plan_id, now),
+            ).fetchall()
+            if due:
+                SendQueue.insert_jobs(
+                    connection,
+                    plan["session_id"],
+                    plan["batch_id"],
+                    [(row["message_index"], row["to_email"], row["subject"], row["body"]) for row in due],
+                )
+                connection.executemany("DELETE FROM scheduled_messages WHERE id = ?", [(row["id"],) for row in due])
+            following = connection.execute(
+                "SELECT MIN(release_at) FROM scheduled_messages WHERE plan_id = ?", (plan_id,)
+            ).fetchone()[0]
+            connection.execute(
+                "UPDATE send_plans SET released = released + ?, status = ?,"
+                " last_release_at = COALESCE(?, last_release_at) WHERE id = ?",
+                (len(due), SCHEDULED if following is not None else RELEASED, now if due else None, plan_id),
+            )
+        return len(due), following
+
+    def scheduled_plan_ids(self) -> set[str]:
+        """Return the ids of every plan that still has messages to release."""
+
+        return {row[0] for row in self._queue.query("SELECT id FROM send_plans WHERE status = ?", (SCHEDULED,))}
+
+    def next_releases(self, plan_ids: Collection[str]) -> list[tuple[str, float]]:
+        """Return ``(plan id, next release)`` for those of ``plan_ids`` with unreleased messages."""
+
+        ids = list(plan_ids)
+        releases: list[tuple[str, float]] = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = self._queue.query(
+                f"SELECT plan_id, MIN(release_at) FROM scheduled_messages"
+                f" WHERE plan_id IN ({placeholders}) GROUP BY plan_id",
+                chunk,
+            )
+            releases.extend((row[0], row[1]) for row in rows)
+        return releases
+
+    def summaries(self, session_id: str) -> list[PlanSummary]:
+        """Return the session's plans, newest first."""
+
+        rows = self._queue.query(
+            "SELECT p.*, (SELECT MIN(release_at) FROM scheduled_messages m WHERE m.plan_id = p.id)"
+            " AS next_release FROM send_plans p WHERE p.session_id = ? ORDER BY p.created_at DESC",
+            (session_id,),
+        )
+        return [
+            PlanSummary(
+                id=row["id"],
+                plan=SendPlan(
+                    start_at=datetime.fromisoformat(row["start_at"]),
+                    timezone=row["timezone"],
+                    recipient_local_time=bool(row["recipient_local"]),
+                    window_minutes=row["window_minutes"],
+                    max_per_hour=row["max_per_hour"],
+                ),
+                status=row["status"],
+                total=row["total"],
+                released=row["released"],
+                next_release_at=_utc(row["next_release"]),
+                last_release_at=_utc(row["last_release_at"]),
+            )
+            for row in rows
+        ]
+
+    def cancel(self, session_id: str, plan_id: str) -> tuple[Optional[str], list[int]]:
+        """Cancel the unreleased part of a plan; return its batch id and the cancelled indexes."""
+
+        with self._queue.transaction() as connection:
+            plan = connection.execute(
+                "SELECT batch_id FROM send_plans WHERE id = ? AND session_id = ? AND status = ?",
+                (plan_id, session_id, SCHEDULED),
+            ).fetchone()
+            if plan is None:
+                return None, []
+            indexes = [
+                row[0]
+                for row in connection.execute(
+                    "SELECT message_index FROM scheduled_messages WHERE plan_id = ?", (plan_id,)
+                )
+            ]
+            connection.execute("DELETE FROM scheduled_messages WHERE plan_id = ?", (plan_id,))
+            connection.execute("UPDATE send_plans SET status = ? WHERE id = ?", (CANCELLED, plan_id))
+        return plan["batch_id"], indexes
+
+    def purge_session(self, session_id: str) -> None:
+        """Drop every plan of a session together with its unreleased messages."""
+
+        with self._queue.transaction() as connection:
+            connection.execute(
+                "DELETE FROM scheduled_messages WHERE plan_id IN (SELECT id FROM send_plans WHERE session_id = ?)",
+                (session_id,),
+            )
+            connection.execute("DELETE FROM send_plans WHERE session_id = ?", (session_id,))
+
+
+@lru_cache
+def get_schedule_store() -> ScheduleStore:
+    """Return the shared schedule store (same database as the send queue)."""
+
+    return ScheduleStore(get_send_queue())
+
+
+class Scheduler:
+    """Release scheduled messages on time using a heap of per-plan deadlines."""
+
+    def __init__(self, store: Optional[ScheduleStore] = None, poll_interval: Optional[float] = None) -> None:
+        self.store = store or get_schedule_store()
+        # New plans written by other processes are picked up at this interval.
+        self.poll_interval = poll_interval or get_settings().worker_poll_interval_seconds
+        self._heap: list[tuple[float, str]] = []
+        # Plans already in the heap. Plan ids are random, so unlike rowids
+        # they are never reused after a session's plans are purged.
+        self._known: set[str] = set()
+
+    def _discover(self) -> None:
+        scheduled = self.store.scheduled_plan_ids()
+        for plan_id, next_release in self.store.next_releases(scheduled - self._known):
+            heapq.heappush(self._heap, (next_release, plan_id))
+        self._known = scheduled
+
+    def release_due(self, now: Optional[float] = None) -> int:
+        """Release every plan whose deadline has passed; returns messages queued."""
+
+        now = time.time() if now is None else now
+        released = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, plan_id = heapq.heappop(self._heap)
+            count, following = self.store.release_due(plan_id, now)
+            released += count
+            if following is not None:
+                heapq.heappush(self._heap, (following, plan_id))
+        return released
+
+    def next_deadline(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Release messages until ``stop`` is set."""
+
+        while not stop.is_set():
+            await asyncio.to_thread(self._discover)
+            released = await asyncio.to_thread(self.release_due)
+            if released:
+                logger.info("scheduler released messages=%s", released)
+            deadline = self.next_deadline()
+            timeout = self.poll_interval
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.time(), 0.0))
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+__all__ = [
+    "PlanSummary",
+    "ScheduleStore",
+    "Scheduler",
+    "SendPlan",
+    "get_schedule_store",
+    "release_times",
+]
@@ -0,0 +1,429 @@
+"""Durable SQLite queue that hands send jobs from the web tier to workers.
+
+The web process enqueues one job per approved message and later reads the
+results back into the session. Worker processes (``python -m app.worker``)
+claim jobs under a time-limited lease and extend it with heartbeats while the
+send is in flight. If a worker dies its leases expire and another worker picks
+the jobs up, so delivery is at-least-once: a worker that crashes between the
+Gmail call and recording the result can cause that message to be sent twice.
+
+Queued jobs are not claimed strictly in order: ``claim`` shares each claim
+between sessions with ``allocate_claims`` (small batches first, a cap on the
+jobs one session may have leased), so a large batch does not hold up a
+colleague's short one.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence
+
+from pydantic import BaseModel
+
+from app.config import get_settings
+from app.services.fair_share import allocate_claims
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS send_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    batch_id TEXT NOT NULL,
+    message_index INTEGER NOT NULL,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error_message TEXT,
+    sent_at TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS send_jobs_claim ON send_jobs (status, lease_expires, id);
+CREATE INDEX IF NOT EXISTS send_jobs_batch ON send_jobs (session_id, batch_id);
+CREATE INDEX IF NOT EXISTS send_jobs_backlog ON send_jobs (status, session_id, batch_id, id);
+"""
+
+QUEUED = "queued"
+LEASED = "leased"
+SENT = "sent"
+FAILED = "failed"
+
+
+class SendJob(BaseModel):
+    """A message claimed by a worker."""
+
+    id: int
+    session_id: str
+    batch_id: str
+    message_index: int
+    to_email: str
+    subject: str
+    body: str
+    attempts: int
+
+
+class SendResult(BaseModel):
+    """Current state of one queued message, as read by the web process."""
+
+    message_index: int
+    to_email: str
+    status: str
+    error_message: Optional[str] = None
+    sent_at: Optional[datetime] = None
+
+
+class SendQueue:
+    """Lease-based job queue stored in a single SQLite file.
+
+    Each thread gets its own connection; claims run inside ``BEGIN IMMEDIATE``
+    so concurrent workers on the same machine never lease the same job.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_attempts: int = 3,
+        session_concurrency: Optional[int] = None,
+        small_batch_max: int = 0,
+    ) -> None:
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._max_attempts = max_attempts
+        self._session_concurrency = session_concurrency
+        self._small_batch_max = small_batch_max
+        # Claim counter at which each session last got jobs, so the least
+        # recently served sessions are visited first by this process.
+        self._served: dict[str, int] = {}
+        self._claims = 0
+        self._served_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30.0, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        """Close this thread's connection."""
+
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in one write transaction on this thread's connection.
+
+        Other stores kept in the same database file (the scheduler) use this
+        to move rows into the queue atomically.
+        """
+
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def query(self, sql: str, parameters: Sequence[object] = ()) -> list[sqlite3.Row]:
+        """Run a read-only statement on this thread's connection."""
+
+        return self._connect().execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def insert_jobs(
+        connection: sqlite3.Connection,
+        session_id: str,
+        batch_id: str,
+        messages: Iterable[tuple[int, str, str, str]],
+    ) -> int:
+        """Insert queued jobs using ``connection``'s open transaction."""
+
+        now = time.time()
+        rows = [
+            (session_id, batch_id, index, to_email, subject, body, now, now)
+            for index, to_email, subject, body in messages
+        ]
+        connection.executemany(
+            "INSERT INTO send_jobs (session_id, batch_id, message_index, to_email, subject, body,"
+            " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        return len(rows)
+
+    def enqueue(
+        self,
+        session_id: str,
+        batch_id: str,
+        messages: Iterable[tuple[int, str, str, str]],
+    ) -> int:
+        """Queue ``(index, to_email, subject, body)`` tuples; returns the count."""
+
+        with self.transaction() as connection:
+            return self.insert_jobs(connection, session_id, batch_id, messages)
+
+    def claim(self, worker_id: str, limit: int, lease_seconds: float) -> list[SendJob]:
+        """Lease up to ``limit`` queued or abandoned jobs to ``worker_id``.
+
+        Abandoned jobs (expired leases) are reclaimed first. The rest of the
+        claim is shared fairly between the sessions with queued jobs. Jobs
+        whose lease expired ``max_attempts`` times are marked failed instead
+        of being handed out again.
+        """
+
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE send_jobs SET status = ?, error_message = ?, lease_owner = NULL,"
+                " lease_expires = NULL, subject = '', body = '', updated_at = ?"
+                " WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, "Send abandoned by worker too many times", now, LEASED, now, self._max_attempts),
+            )
+            rows = connection.execute(
+                "SELECT * FROM send_jobs WHERE status = ? AND lease_expires < ? ORDER BY id LIMIT ?",
+                (LEASED, now, limit),
+            ).fetchall()
+            if len(rows) < limit:
+                rows += self._fair_queued(connection, limit - len(rows), now)
+            if rows:
+                connection.executemany(
+                    "UPDATE send_jobs SET status = ?, lease_owner = ?, lease_expires = ?,"
+                    " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    [(LEASED, worker_id, now + lease_seconds, now, row["id"]) for row in rows],
+                )
+        return [
+            SendJob(
+                id=row["id"],
+                session_id=row["session_id"],
+                batch_id=row["batch_id"],
+                message_index=row["message_index"],
+                to_email=row["to_email"],
+                subject=row["subject"],
+                body=row["body"],
+                attempts=row["attempts"] + 1,
+            )
+            for row in rows
+        ]
+
+    def _fair_queued(self, connection: sqlite3.Connection, slots: int, now: float) -> list[sqlite3.Row]:
+        backlog_rows = connection.execute(
+            "SELECT session_id, batch_id, COUNT(*) AS waiting FROM send_jobs WHERE status = ?"
+            " GROUP BY session_id, batch_id",
+            (QUEUED,),
+        ).fetchall()
+        if not backlog_rows:
+            return []
+        backlog = []
+        for row in backlog_rows:
+            small = False
+            if row["waiting"] <= self._small_batch_max:
+                # Small means the whole batch, not a large batch's tail.
+                total = connection.execute(
+                    "SELECT COUNT(*) FROM send_jobs WHERE session_id = ? AND batch_id = ?",
+                    (row["session_id"], row["batch_id"]),
+                ).fetchone()[0]
+                small = total <= self._small_batch_max
+            backlog.append((row["session_id"], row["batch_id"], row["waiting"], small))
+
+        in_flight: dict[str, int] = {}
+        cap = self._session_concurrency or slots
+        if self._session_concurrency:
+            in_flight = {
+                row[0]: row[1]
+                for row in connection.execute(
+                    "SELECT session_id, COUNT(*) FROM send_jobs WHERE status = ? AND lease_expires >= ?"
+                    " GROUP BY session_id",
+                    (LEASED, now),
+                )
+            }
+        with self._served_lock:
+            order = sorted({entry[0] for entry in backlog}, key=lambda session: self._served.get(session, -1))
+        allocation = allocate_claims(backlog, slots, in_flight, cap, order)
+
+        rows: list[sqlite3.Row] = []
+        for session_id, batch_id, count in allocation:
+            rows += connection.execute(
+                "SELECT * FROM send_jobs WHERE status = ? AND session_id = ? AND batch_id = ? ORDER BY id LIMIT ?",
+                (QUEUED, session_id, batch_id, count),
+            ).fetchall()
+        with self._served_lock:
+            self._claims += 1
+            waiting = {entry[0] for entry in backlog}
+            self._served = {session: served for session, served in self._served.items() if session in waiting}
+            for session_id, _, _ in allocation:
+                self._served[session_id] = self._claims
+        return rows
+
+    def heartbeat(self, worker_id: str, job_ids: Sequence[int], lease_seconds: float) -> int:
+        """Extend the leases ``worker_id`` still holds; returns how many were extended."""
+
+        if not job_ids:
+            return 0
+        now = time.time()
+        placeholders = ",".join("?" for _ in job_ids)
+        cursor = self._connect().execute(
+            f"UPDATE send_jobs SET lease_expires = ?, updated_at = ?"
+            f" WHERE status = ? AND lease_owner = ? AND id IN ({placeholders})",
+            (now + lease_seconds, now, LEASED, worker_id, *job_ids),
+        )
+        return cursor.rowcount
+
+    def complete(
+        self,
+        job_id: int,
+        worker_id: str,
+        status: str,
+        error_message: Optional[str] = None,
+        sent_at: Optional[datetime] = None,
+    ) -> bool:
+        """Record the outcome of a leased job.
+
+        Returns ``False`` if the lease was lost to another worker, in which
+        case the result is discarded. The message's subject and body are not
+        needed once it is finished and are cleared.
+        """
+
+        cursor = self._connect().execute(
+            "UPDATE send_jobs SET status = ?, error_message = ?, sent_at = ?, lease_owner = NULL,"
+            " lease_expires = NULL, subject = '', body = '', updated_at = ?"
+            " WHERE id = ? AND status = ? AND lease_owner = ?",
+            (
+                status,
+                error_message,
+                sent_at.isoformat() if sent_at else None,
+                time.time(),
+                job_id,
+                LEASED,
+                worker_id,
+            ),
+        )
+        return cursor.rowcount == 1
+
+    def release(self, worker_id: str, job_ids: Sequence[int], error_message: str) -> int:
+        """Return leased jobs to the queue without a result; returns how many were released.
+
+        Used when a worker cannot attempt the send at all, such as when the
+        session's accounts could not be loaded. The claim still counts as an
+        attempt, and jobs that have used up ``max_attempts`` are failed with
+        ``error_message`` instead of being queued again.
+        """
+
+        if not job_ids:
+            return 0
+        now = time.time()
+        placeholders = ",".join("?" for _ in job_ids)
+        cursor = self._connect().execute(
+            f"UPDATE send_jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+            f" error_message = CASE WHEN attempts >= ? THEN ? ELSE NULL END,"
+            f" subject = CASE WHEN attempts >= ? THEN '' ELSE subject END,"
+            f" body = CASE WHEN attempts >= ? THEN '' ELSE body END,"
+            f" lease_owner = NULL, lease_expires = NULL, updated_at = ?"
+            f" WHERE status = ? AND lease_owner = ? AND id IN ({placeholders})",
+            (
+                self._max_attempts,
+                FAILED,
+                QUEUED,
+                self._max_attempts,
+                error_message,
+                self._max_attempts,
+                self._max_attempts,
+                now,
+                LEASED,
+                worker_id,
+                *job_ids,
+            ),
+        )
+        return cursor.rowcount
+
+    def results(self, session_id: str, batch_id: str) -> list[SendResult]:
+        """Return the state of every job in a batch, ordered by message index."""
+
+        rows = self._connect().execute(
+            "SELECT message_index, to_email, status, error_message, sent_at FROM send_jobs"
+            " WHERE session_id = ? AND batch_id = ? ORDER BY message_index",
+            (session_id, batch_id),
+        ).fetchall()
+        return [
+            SendResult(
+                message_index=row["message_index"],
+                to_email=row["to_email"],
+                status=row["status"],
+                error_message=row["error_message"],
+                sent_at=datetime.fromisoformat(row["sent_at"]) if row["sent_at"] else None,
+            )
+            for row in rows
+        ]
+
+    def pending_count(self) -> int:
+        """Return the number of jobs not yet finished."""
+
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM send_jobs WHERE status IN (?, ?)", (QUEUED, LEASED)
+        ).fetchone()
+        return int(row[0])
+
+    def purge_finished(self, older_than_seconds: float) -> int:
+        """Delete sent and failed jobs last updated more than ``older_than_seconds`` ago.
+
+        Once the session that queued them has expired, nothing reads their
+        results any more. Returns how many jobs were deleted.
+        """
+
+        cursor = self._connect().execute(
+            "DELETE FROM send_jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (SENT, FAILED, time.time() - older_than_seconds),
+        )
+        return cursor.rowcount
+
+    def purge_session(self, session_id: str) -> None:
+        """Drop every job, finished or not, that belongs to a session."""
+
+        self._connect().execute("DELETE FROM send_jobs WHERE session_id = ?", (session_id,))
+
+
+@lru_cache
+def get_send_queue() -> SendQueue:
+    """Return the shared send queue, creating the database on first use."""
+
+    settings = get_settings()
+    return SendQueue(
+        settings.send_queue_path,
+        max_attempts=settings.send_max_attempts,
+        session_concurrency=settings.send_concurrency,
+        small_batch_max=settings.send_small_batch_max,
+    )
+
+
+__all__ = [
+    "FAILED",
+    "LEASED",
+    "QUEUED",
+    "SENT",
+    "SendJob",
+    "SendQueue",
+    "SendResult",
+    "get_send_queue",
+]
@@ -0,0 +1,284 @@
+"""Spread a batch across every Gmail account connected to a session.
+
+A session's first account is stored in the token store under the session id;
+additional sender accounts use ``"<session id>/sender/<n>"``. ``SenderPool``
+sends each message through one of them, chosen by smooth weighted round robin
+where an account's weight is its remaining daily quota scaled by the square of
+its recent success rate. Each account has its own token bucket, and a
+throttled account is skipped until its ``Retry-After`` passes while the
+message fails over to another account.
+
+Account health lives in a process-wide ``SenderLedger`` so it carries over
+between batches; in worker mode every worker process keeps its own ledger.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import date
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+from app.config import get_settings
+from app.services.gmail import GmailAuthError, GmailSendError
+from app.services.metrics import get_registry
+from app.services.token_store import get_token_store
+from app.services.tracing import current_span, span
+
+if TYPE_CHECKING:  # pragma: no cover - imported lazily at runtime
+    from google.oauth2.credentials import Credentials
+
+    from app.services.gmail import GmailClient
+
+logger = logging.getLogger("app.senders")
+
+_FAILOVERS = get_registry().counter(
+    "bulkmailer_sender_failovers_total",
+    "Messages moved to another sender account after a throttled send.",
+)
+
+# Weight of the latest outcome in each account's error-rate moving average.
+_ERROR_ALPHA = 0.2
+_MIN_HEALTH = 0.01
+_DEFAULT_THROTTLE_SECONDS = 1.0
+_ACCOUNT_PREFIX = "/sender/"
+
+
+def account_key(session_id: str, number: int) -> str:
+    """Token store key of a session's ``number``-th sender account (1 = primary)."""
+
+    return session_id if number <= 1 else f"{session_id}{_ACCOUNT_PREFIX}{number}"
+
+
+def account_keys(session_id: str) -> list[str]:
+    """Return the token store keys of all sender accounts a session connected."""
+
+    stored = get_token_store().user_ids(session_id)
+    extra = [key for key in stored if key.startswith(session_id + _ACCOUNT_PREFIX)]
+    extra.sort(key=lambda key: int(key.rsplit("/", 1)[1]))
+    return ([session_id] if session_id in stored else []) + extra
+
+
+class TokenBucket:
+    """Async rate limiter; callers reserve a token and sleep off any debt."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take one token and return how long the caller must wait for it."""
+
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+        self._updated = now
+        return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def available(self) -> float:
+        """Tokens the bucket holds now, negative while callers are in debt."""
+
+        if self.rate <= 0:
+            return self.burst
+        return min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SenderAccount:
+    """Quota, health and rate limit bookkeeping for one connected account."""
+
+    def __init__(self, key: str, daily_quota: int, rate: float, burst: float) -> None:
+        self.key = key
+        self.daily_quota = daily_quota
+        self.bucket = TokenBucket(rate, burst)
+        self.error_rate = 0.0
+        self.throttled_until = 0.0
+        self.current_weight = 0.0
+        self._day = date.today()
+        self._sent_today = 0
+
+    def _roll_over(self) -> None:
+        today = date.today()
+        if today != self._day:
+            self._day, self._sent_today = today, 0
+
+    @property
+    def remaining_quota(self) -> int:
+        self._roll_over()
+        return max(self.daily_quota - self._sent_today, 0)
+
+    def throttled(self, now: Optional[float] = None) -> bool:
+        return self.throttled_until > (time.monotonic() if now is None else now)
+
+    def weight(self, now: Optional[float] = None) -> float:
+        if self.throttled(now):
+            return 0.0
+        # Squaring the success rate moves traffic off a failing account
+        # quickly while a single blip barely changes its share; the floor
+        # keeps a trickle of probes so a recovered account wins traffic back.
+        return self.remaining_quota * max((1.0 - self.error_rate) ** 2, _MIN_HEALTH)
+
+    def record_success(self) -> None:
+        self._roll_over()
+        self._sent_today += 1
+        self.error_rate *= 1 - _ERROR_ALPHA
+
+    def record_error(self) -> None:
+        self.error_rate = self.error_rate * (1 - _ERROR_ALPHA) + _ERROR_ALPHA
+
+    def record_throttle(self, retry_after: Optional[float]) -> None:
+        delay = retry_after if retry_after is not None else _DEFAULT_THROTTLE_SECONDS
+        self.throttled_until = max(self.throttled_until, time.monotonic() + delay)
+        self.record_error()
+
+
+class SenderLedger:
+    """Process-wide registry of ``SenderAccount`` state keyed by token store key."""
+
+    def __init__(self) -> None:
+        self._accounts: dict[str, SenderAccount] = {}
+
+    def account(self, key: str) -> SenderAccount:
+        account = self._accounts.get(key)
+        if account is None:
+            settings = get_settings()
+            account = self._accounts[key] = SenderAccount(
+                key,
+                daily_quota=settings.sender_daily_quota,
+                rate=settings.sender_rate_per_second,
+                burst=settings.sender_burst,
+            )
+        return account
+
+    def forget(self, key: str) -> None:
+        self._accounts.pop(key, None)
+
+
+@lru_cache
+def get_sender_ledger() -> SenderLedger:
+    """Return the process-wide sender ledger."""
+
+    return SenderLedger()
+
+
+class SenderPool:
+    """Send raw messages through a session's connected accounts."""
+
+    def __init__(
+        self,
+        gmail: GmailClient,
+        credentials: dict[str, Credentials],
+        ledger: Optional[SenderLedger] = None,
+    ) -> None:
+        ledger = ledger or get_sender_ledger()
+        self._gmail = gmail
+        self._credentials = credentials
+        self._accounts = [ledger.account(key) for key in credentials]
+
+    @classmethod
+    async def connect(cls, gmail: GmailClient, session_id: str) -> SenderPool:
+        """Load credentials for every account of ``session_id``.
+
+        Accounts whose token cannot be refreshed, because it was revoked or
+        the token endpoint is unreachable, are skipped for this batch and the
+        others still send.
+        """
+
+        import httpx
+
+        credentials: dict[str, Credentials] = {}
+        for key in await asyncio.to_thread(account_keys, session_id):
+            try:
+                loaded = await gmail.get_credentials(key)
+            except (GmailAuthError, httpx.HTTPError) as exc:
+                logger.warning("sender_pool refresh_failed account=%s error=%r", key, exc)
+                continue
+            if loaded:
+                credentials[key] = loaded
+        return cls(gmail, credentials)
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def _choose(self, exclude: set[str]) -> Optional[SenderAccount]:
+        now = time.monotonic()
+        weighted = [(account, account.weight(now)) for account in self._accounts if account.key not in exclude]
+        weighted = [(account, weight) for account, weight in weighted if weight > 0]
+        if not weighted:
+            return None
+        total = sum(weight for _, weight in weighted)
+        for account, weight in weighted:
+            account.current_weight += weight
+        chosen = max(weighted, key=lambda item: item[0].current_weight)[0]
+        chosen.current_weight -= total
+        return chosen
+
+    async def send_raw(self, raw_message: str) -> dict:
+        """Send through the best available account, failing over on 429s."""
+
+        with span("sender_pool.send", {"sender.accounts": len(self._accounts), "sender.failovers": 0}):
+            return await self._send_raw(raw_message)
+
+    async def _send_raw(self, raw_message: str) -> dict:
+        current = current_span()
+        if not self._accounts:
+            raise GmailAuthError("No Gmail account is connected for this session.")
+        tried: set[str] = set()
+        waits = 0
+        while True:
+            account = self._choose(tried)
+            if account is None:
+                throttled = [item for item in self._accounts if item.remaining_quota and item.throttled()]
+                if not throttled:
+                    raise GmailSendError("Daily sending quota reached for every connected account.", 429)
+                if waits >= get_settings().gmail_max_retries:
+                    raise GmailSendError("Every connected account is being rate limited by Gmail.", 429)
+                waits += 1
+                tried.clear()
+                delay = min(item.throttled_until for item in throttled) - time.monotonic()
+                current.add_event("all_accounts_throttled", {"throttle.delay_seconds": delay})
+                await asyncio.sleep(delay)
+                continue
+            waited = time.perf_counter()
+            await account.bucket.acquire()
+            current.set_attribute("sender.rate_limit_wait_ms", (time.perf_counter() - waited) * 1000)
+            try:
+                response = await self._gmail.send_raw(
+                    self._credentials[account.key], raw_message, retry_throttled=False
+                )
+            except GmailSendError as exc:
+                if exc.throttled:
+                    account.record_throttle(exc.retry_after)
+                    tried.add(account.key)
+                    if len(tried) < len(self._accounts):
+                        _FAILOVERS.inc()
+                        current.set_attribute("sender.failovers", len(tried))
+                    continue
+                if exc.status_code >= 500 or exc.status_code == 401:
+                    account.record_error()
+                raise
+            except Exception:
+                account.record_error()
+                raise
+            account.record_success()
+            return response
+
+
+__all__ = [
+    "SenderAccount",
+    "SenderLedger",
+    "SenderPool",
+    "TokenBucket",
+    "account_key",
+    "account_keys",
+    "get_sender_ledger",
+]
@@ -0,0 +1,101 @@
+"""Single-message delivery shared by the inline send loop and send workers."""
+
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+
+from app.models.domain import email_domain
+from app.services.metrics import get_registry
+from app.services.mime_builder import MessageEncodingError, get_builder
+from app.services.tracing import span
+
+if TYPE_CHECKING:  # pragma: no cover - imported lazily at runtime
+    from app.services.sender_pool import SenderPool
+
+_registry = get_registry()
+_SEND_SECONDS = _registry.histogram(
+    "bulkmailer_send_duration_seconds",
+    "Latency of a single Gmail send call.",
+)
+_SEND_OUTCOMES = _registry.counter(
+    "bulkmailer_send_messages_total",
+    "Messages processed by the send loop, by outcome.",
+    labelnames=("outcome",),
+)
+
+# One record per message; written by the background log writer, so logging
+# here adds no I/O to the send path.
+events = logging.getLogger("app.send")
+
+
+Outcome = tuple[str, Optional[str], Optional[datetime]]
+
+
+def record_skipped() -> None:
+    """Count a message the user did not approve."""
+
+    _SEND_OUTCOMES.labels("skipped").inc()
+
+
+def encoding_failure(exc: MessageEncodingError) -> Outcome:
+    """Count and return the outcome of a message that could not be encoded."""
+
+    _SEND_OUTCOMES.labels("failed").inc()
+    events.warning("send_message", extra={"status": "failed", "reason": "encoding", "error": str(exc)})
+    return ("failed", str(exc), None)
+
+
+async def deliver(
+    senders: SenderPool,
+    to_email: str,
+    subject: str,
+    body: str,
+    raw: Optional[str] = None,
+    domain: Optional[str] = None,
+) -> Outcome:
+    """Send one message and return ``(status, error_message, sent_at)``.
+
+    ``raw`` is the already encoded payload when the batch was pre-encoded,
+    and ``domain`` the recipient's normalised domain when already known.
+    """
+
+    domain = domain or email_domain(to_email)
+    with span("send_message", {"message.recipient_domain": domain}) as current:
+        if raw is None:
+            try:
+                with span("mime.encode"):
+                    raw = get_builder().build(to_email, subject, body)
+            except MessageEncodingError as exc:
+                current.set_attribute("message.status", "failed")
+                return encoding_failure(exc)
+        current.set_attribute("message.bytes", len(raw))
+        started = time.perf_counter()
+        try:
+            await senders.send_raw(raw)
+        except Exception as exc:  # pragma: no cover - network dependent
+            outcome: Outcome = ("failed", str(exc), None)
+            current.set_error(str(exc))
+        else:
+            outcome = ("sent", None, datetime.utcnow())
+        elapsed = time.perf_counter() - started
+        _SEND_SECONDS.observe(elapsed)
+        _SEND_OUTCOMES.labels(outcome[0]).inc()
+        current.set_attribute("message.status", outcome[0])
+        events.log(
+            logging.INFO if outcome[1] is None else logging.WARNING,
+            "send_message",
+            extra={
+                "status": outcome[0],
+                "recipient_domain": domain,
+                "bytes": len(raw),
+                "duration_ms": round(elapsed * 1000, 2),
+                "error": outcome[1],
+            },
+        )
+        return outcome
+
+
+__all__ = ["Outcome", "deliver", "encoding_failure", "record_skipped"]
@@ -2,12 +2,15 @@
 
 from __future__ import annotations
 
+import sys
 from datetime import datetime, timedelta
+from functools import lru_cache
 from threading import Lock
 from typing import Dict
 
 from app.config import get_settings
 from app.models.domain import BatchState
+from app.services.metrics import get_registry
 
 
 class BatchStore:
@@ -41,14 +44,47 @@ class BatchStore:
         with self._lock:
             self._data.pop(session_id, None)
 
+    def session_count(self) -> int:
+        """Return the number of live sessions."""
 
-_store = BatchStore()
+        with self._lock:
+            return len(self._data)
 
+    def approximate_size(self) -> int:
+        """Estimate the bytes held by session text (recipients and messages).
+
+        Only string payloads are counted; object overhead is ignored so the
+        estimate stays cheap enough to compute on every metrics scrape.
+        """
+
+        with self._lock:
+            states = [state for _, state in self._data.values()]
+        total = 0
+        for state in states:
+            total += state.recipients.text_bytes()
+            for message in state.messages:
+                total += sys.getsizeof(message.subject) + sys.getsizeof(message.body)
+        return total
 
-def get_store() -> BatchStore:
-    """Return shared store instance."""
 
-    return _store
+@lru_cache
+def get_store() -> BatchStore:
+    """Return shared store instance, constructing it on first use."""
+
+    return BatchStore()
+
+
+_registry = get_registry()
+_registry.gauge(
+    "bulkmailer_batch_store_sessions",
+    "Sessions currently held in the in-memory batch store.",
+    callback=lambda: get_store().session_count(),
+)
+_registry.gauge(
+    "bulkmailer_batch_store_bytes",
+    "Approximate bytes of recipient and message text in the batch store.",
+    callback=lambda: get_store().approximate_size(),
+)
 
 
 __all__ = ["BatchStore", "get_store"]
@@ -0,0 +1,237 @@
+"""Structured logging that never waits on log I/O.
+
+``QueueLogHandler`` only appends the record to a bounded in-memory buffer;
+formatting and writing happen on a background ``LogWriter`` thread, which
+drains the buffer in batches and writes each batch with a single call. When
+the buffer is full the record is dropped and counted rather than blocking
+the caller, and the writer reports how many records were lost once it has
+caught up. Per-message send events can therefore be logged from the event
+loop at volume.
+
+Records are written as one JSON object per line. Fields passed through
+``extra=`` become top-level keys, and records logged inside a traced span
+carry its ``trace_id`` and ``span_id``.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Optional, TextIO
+
+from app.config import get_settings
+from app.services.metrics import get_registry
+from app.services.tracing import Span, current_span
+
+_DROPPED = get_registry().counter(
+    "bulkmailer_log_records_dropped_total",
+    "Log records dropped because the log buffer was full.",
+)
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+# Attributes every LogRecord has; anything else was passed with ``extra=``.
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "taskName",
+    "trace_id",
+    "span_id",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single-line JSON object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document: dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                document[key] = value
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            document["trace_id"] = trace_id
+            document["span_id"] = getattr(record, "span_id", None)
+        if record.exc_info:
+            document["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str, separators=(",", ":"))
+
+
+class LogWriter:
+    """Format and write buffered records from a daemon thread, in batches."""
+
+    def __init__(
+        self,
+        stream: TextIO,
+        formatter: logging.Formatter,
+        capacity: int = 10_000,
+        batch_size: int = 256,
+        flush_interval: float = 0.2,
+    ) -> None:
+        self.stream = stream
+        self.formatter = formatter
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._buffer: deque[logging.LogRecord] = deque()
+        self._ready = threading.Condition(threading.Lock())
+        self._unreported = 0
+        self._writing = False
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        with self._ready:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def offer(self, record: logging.LogRecord) -> bool:
+        """Queue ``record`` for writing; returns ``False`` if it was dropped."""
+
+        with self._ready:
+            if len(self._buffer) >= self.capacity:
+                self.dropped += 1
+                self._unreported += 1
+                _DROPPED.inc()
+                return False
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._ready.notify()
+        return True
+
+    def _take(self) -> tuple[list[logging.LogRecord], int]:
+        with self._ready:
+            if not self._buffer and not self._stopping:
+                self._ready.wait(self.flush_interval)
+            count = min(len(self._buffer), self.batch_size)
+            batch = [self._buffer.popleft() for _ in range(count)]
+            unreported, self._unreported = self._unreported, 0
+            self._writing = bool(batch or unreported)
+            return batch, unreported
+
+    def _write(self, batch: list[logging.LogRecord], unreported: int) -> None:
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:  # pragma: no cover - a broken record must not stop the writer
+                lines.append(f"unformattable log record from {record.name}")
+        if unreported:
+            notice = logging.makeLogRecord(
+                {
+                    "name": "app.logging",
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "log_records_dropped",
+                    "dropped": unreported,
+                }
+            )
+            lines.append(self.formatter.format(notice))
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except (OSError, ValueError):  # pragma: no cover - closed or broken stream
+            pass
+
+    def _run(self) -> None:
+        while True:
+            batch, unreported = self._take()
+            if batch or unreported:
+                self._write(batch, unreported)
+            with self._ready:
+                self._writing = False
+                self._ready.notify_all()
+                if self._stopping and not self._buffer:
+                    return
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything buffered so far has been written."""
+
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            self._ready.notify_all()
+            while self._buffer or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return False
+                self._ready.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._ready:
+            thread = self._thread
+            self._stopping = True
+            self._ready.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        with self._ready:
+            self._thread = None
+
+
+class QueueLogHandler(logging.Handler):
+    """Hand records to a ``LogWriter`` without formatting or writing them."""
+
+    def __init__(self, writer: LogWriter) -> None:
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Captured here, on the logging thread, where the span is current.
+        span = current_span()
+        if isinstance(span, Span):
+            vars(record).update(trace_id=span.trace_id, span_id=span.span_id)
+        self.writer.offer(record)
+
+    def flush(self) -> None:
+        self.writer.flush()
+
+
+@lru_cache
+def get_log_handler() -> QueueLogHandler:
+    """Return the process-wide handler, starting its writer thread."""
+
+    settings = get_settings()
+    formatter = JsonFormatter() if settings.log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    writer = LogWriter(sys.stderr, formatter, capacity=settings.log_buffer_records)
+    writer.start()
+    atexit.register(writer.stop)
+    return QueueLogHandler(writer)
+
+
+def configure_logging() -> None:
+    """Route the ``app`` loggers through the non-blocking handler (idempotent)."""
+
+    settings = get_settings()
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(settings.log_level.upper())
+    handler = get_log_handler()
+    if handler not in app_logger.handlers:
+        app_logger.addHandler(handler)
+    # Records are written by the handler above; by default do not write them
+    # twice through whatever the root logger has been given.
+    app_logger.propagate = settings.log_propagate
+
+
+__all__ = [
+    "JsonFormatter",
+    "LogWriter",
+    "QueueLogHandler",
+    "configure_logging",
+    "get_log_handler",
+]
@@ -1,22 +1,261 @@
-"""Jinja-based templating helpers."""
+"""Jinja-based templating helpers.
+
+Each template source is parsed and compiled once (``compile_template``) and
+analysed: the variables it references are recorded, and a template made only
+of text and plain ``{{ name }}`` lookups is folded into static segments that
+are joined with the escaped values instead of running Jinja. A batch renders
+each distinct combination of referenced values once, so a subject without
+placeholders is rendered a single time and shared by every message.
+
+Templates come from users, so Jinja runs sandboxed, and every render has a
+budget (``RenderLimits``): loop items produced by ``range``, calls and
+arithmetic operators count as operations, and output beyond a maximum length
+stops the render. ``render_batch(..., isolated=True)`` additionally renders
+batches whose templates execute Jinja code in a ``RenderPool`` worker process
+under a wall-clock timeout, so a pathological template cannot hold a web
+worker's CPU or memory.
+"""
 
 from __future__ import annotations
 
-from typing import Iterable, List
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Union
+
+from jinja2 import StrictUndefined, Template, TemplateError, meta, nodes
+from jinja2.runtime import Context
+from jinja2.sandbox import ImmutableSandboxedEnvironment, SecurityError
+from markupsafe import escape
+
+from app.config import get_settings
+from app.models.domain import RECIPIENT_FIELDS, Recipient, RecipientTable, RenderedEmail, TemplateContent
+from app.services.metrics import get_registry
+from app.services.tracing import current_span, traced
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore[assignment]
+
+
+class RenderLimits(NamedTuple):
+    """Work one render of one template may do."""
+
+    max_operations: int
+    max_output_chars: int
+
+
+@lru_cache
+def get_render_limits() -> RenderLimits:
+    settings = get_settings()
+    return RenderLimits(settings.render_max_operations, settings.render_max_output_chars)
+
+
+class _Budget:
+    __slots__ = ("limits", "remaining")
+
+    def __init__(self, limits: RenderLimits) -> None:
+        self.limits = limits
+        self.remaining = limits.max_operations
+
+    def spend(self, operations: int) -> None:
+        self.remaining -= operations
+        if self.remaining < 0:
+            raise SecurityError(f"Template exceeded {self.limits.max_operations} operations")
+
+    def check_length(self, length: int) -> None:
+        if length > self.limits.max_output_chars:
+            raise SecurityError(f"Template built a value longer than {self.limits.max_output_chars} characters")
+
+
+# Largest integer ``**`` may build; anything a template needs is far smaller.
+_MAX_POWER_BITS = 4096
+
+# The budget of the render running in this thread or task.
+_budget: ContextVar[Optional[_Budget]] = ContextVar("render_budget", default=None)
+
+
+def _spend(operations: int) -> Optional[_Budget]:
+    budget = _budget.get()
+    if budget is not None:
+        budget.spend(operations)
+    return budget
 
-from jinja2 import Environment, StrictUndefined, TemplateError
 
-from app.models.domain import Recipient, RenderedEmail, TemplateContent
+def _check_result(budget: Optional[_Budget], result: Any) -> Any:
+    if budget is not None and isinstance(result, (str, list, tuple)):
+        budget.check_length(len(result))
+    return result
 
-_ALLOWED_FIELDS = {"title", "first_name", "last_name", "email"}
 
-_env = Environment(autoescape=True, undefined=StrictUndefined, trim_blocks=True, lstrip_blocks=True)
+def _budgeted_filter(function: Any) -> Any:
+    # ``wraps`` copies the ``pass_context``-style markers Jinja dispatches on.
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        budget = _spend(1)
+        return _check_result(budget, function(*args, **kwargs))
+
+    return wrapper
+
+
+class _SandboxedEnvironment(ImmutableSandboxedEnvironment):
+    """Jinja sandbox that charges calls, filters, ``range`` items and operators to the render budget.
+
+    Strings and lists returned by operators, calls and filters are held to
+    the output length limit as they are built, so intermediate values such
+    as chained ``replace`` filters cannot grow past it either.
+    """
+
+    intercepted_binops = frozenset(["*", "**", "+"])
+
+    def __init__(self, **options: Any) -> None:
+        super().__init__(**options)
+        self.globals["range"] = self._range
+        self.filters = {name: _budgeted_filter(function) for name, function in self.filters.items()}
+
+    @staticmethod
+    def _range(*args: int) -> range:
+        items = range(*args)
+        _spend(len(items))
+        return items
+
+    def call(__self, __context: Context, __obj: Any, *args: Any, **kwargs: Any) -> Any:  # noqa: N805
+        budget = _spend(1)
+        return _check_result(budget, super().call(__context, __obj, *args, **kwargs))
+
+    def call_binop(self, context: Context, operator: str, left: Any, right: Any) -> Any:
+        budget = _spend(1)
+        if operator == "**" and isinstance(left, int) and isinstance(right, int):
+            if right > 0 and left.bit_length() * right > _MAX_POWER_BITS:
+                raise SecurityError("Exponent too large")
+        if operator == "*" and budget is not None:
+            # Size a repetition before building it.
+            for sequence, count in ((left, right), (right, left)):
+                if isinstance(sequence, (str, list, tuple)) and isinstance(count, int):
+                    budget.check_length(len(sequence) * count)
+        return _check_result(budget, self.binop_table[operator](left, right))
+
+
+_env = _SandboxedEnvironment(autoescape=True, undefined=StrictUndefined, trim_blocks=True, lstrip_blocks=True)
+
+_registry = get_registry()
+_RENDER_BATCH_SECONDS = _registry.histogram(
+    "bulkmailer_render_batch_duration_seconds",
+    "Time spent rendering every message of a batch.",
+)
+_MESSAGES_RENDERED = _registry.counter(
+    "bulkmailer_messages_rendered_total",
+    "Messages rendered by render_batch.",
+)
 
 
 class TemplateRenderingError(Exception):
     """Raised when the user-supplied template cannot be rendered."""
 
 
+class CompiledTemplate:
+    """A parsed template plus what static analysis learned about it."""
+
+    def __init__(self, source: str) -> None:
+        try:
+            tree = _env.parse(source)
+            self.variables: tuple[str, ...] = tuple(sorted(meta.find_undeclared_variables(tree)))
+            self._template: Template = _env.from_string(tree)
+        except TemplateError as exc:
+            raise TemplateRenderingError(str(exc)) from exc
+        self.segments = _fold(tree)
+
+    @property
+    def is_static(self) -> bool:
+        return not self.variables
+
+    def render(self, context: Mapping[str, object], limits: Optional[RenderLimits] = None) -> str:
+        """Render with ``context`` and strip surrounding whitespace."""
+
+        if self.segments is None:
+            return self._render_sandboxed(context, limits or get_render_limits())
+        parts = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            elif segment.name in context:
+                parts.append(str(escape(context[segment.name])))
+            else:
+                raise TemplateRenderingError(f"'{segment.name}' is undefined")
+        return "".join(parts).strip()
+
+    def _render_sandboxed(self, context: Mapping[str, object], limits: RenderLimits) -> str:
+        budget = _Budget(limits)
+        token = _budget.set(budget)
+        parts = []
+        length = 0
+        try:
+            # Streamed, so oversized output stops the render as it grows.
+            for chunk in self._template.generate(context):
+                length += len(chunk)
+                budget.check_length(length)
+                parts.append(chunk)
+        except TemplateError as exc:
+            raise TemplateRenderingError(str(exc)) from exc
+        except (MemoryError, OverflowError, RecursionError) as exc:
+            raise TemplateRenderingError(f"Template could not be rendered ({type(exc).__name__})") from exc
+        finally:
+            _budget.reset(token)
+        return "".join(parts).strip()
+
+    def render_cached(
+        self, context: Mapping[str, object], cache: dict[tuple, str], limits: Optional[RenderLimits] = None
+    ) -> str:
+        """Render, reusing ``cache`` for contexts with the same referenced values."""
+
+        key = tuple(context.get(name) for name in self.variables)
+        rendered = cache.get(key)
+        if rendered is None:
+            rendered = cache[key] = self.render(context, limits)
+        return rendered
+
+
+def _fold(tree: nodes.Template) -> Optional[list[Union[str, nodes.Name]]]:
+    """Constant-fold a template of text and ``{{ name }}`` outputs into segments.
+
+    Returns ``None`` when the template uses anything else (filters, tags,
+    attribute access), which then renders through Jinja.
+    """
+
+    segments: list[Union[str, nodes.Name]] = []
+    for statement in tree.body:
+        if not isinstance(statement, nodes.Output):
+            return None
+        for node in statement.nodes:
+            if isinstance(node, nodes.TemplateData):
+                text = node.data
+            elif isinstance(node, nodes.Const):
+                text = str(escape(node.value))
+            elif isinstance(node, nodes.Name) and node.ctx == "load":
+                segments.append(node)
+                continue
+            else:
+                return None
+            if segments and isinstance(segments[-1], str):
+                segments[-1] += text
+            else:
+                segments.append(text)
+    return segments
+
+
+@lru_cache(maxsize=64)
+def compile_template(source: str) -> CompiledTemplate:
+    """Return the compiled, analysed form of a template source."""
+
+    return CompiledTemplate(source)
+
+
 def _recipient_context(recipient: Recipient) -> dict[str, str]:
     return {
         "title": recipient.title,
@@ -26,30 +265,222 @@ def _recipient_context(recipient: Recipient) -> dict[str, str]:
     }
 
 
-def render_email(template: TemplateContent, recipient: Recipient) -> RenderedEmail:
-    """Render personalized subject and body for a recipient."""
+def template_placeholders(template: TemplateContent) -> set[str]:
+    """Return the variables the subject and body templates reference."""
 
-    try:
-        subject = _env.from_string(template.subject_template).render(
-            **_recipient_context(recipient)
-        )
-        body = _env.from_string(template.body_template).render(
-            **_recipient_context(recipient)
+    subject = compile_template(template.subject_template)
+    body = compile_template(template.body_template)
+    return set(subject.variables) | set(body.variables)
+
+
+def validate_placeholders(template: TemplateContent, columns: Sequence[str]) -> None:
+    """Raise if the template uses a placeholder that is not one of ``columns``."""
+
+    unknown = sorted(template_placeholders(template) - set(columns))
+    if unknown:
+        raise TemplateRenderingError(
+            "Unknown placeholder(s): "
+            + ", ".join(unknown)
+            + ". Available columns: "
+            + ", ".join(columns)
         )
-    except TemplateError as exc:
-        raise TemplateRenderingError(str(exc)) from exc
 
-    return RenderedEmail(recipient=recipient, subject=subject.strip(), body=body.strip())
 
+def render_email(
+    template: TemplateContent,
+    recipient: Recipient,
+    context: Optional[Mapping[str, str]] = None,
+) -> RenderedEmail:
+    """Render personalized subject and body for a recipient.
+
+    ``context`` holds the recipient's full CSV row when extra columns are in
+    use; by default only the standard recipient fields are available.
+    """
+
+    values = _recipient_context(recipient) if context is None else context
+    subject = compile_template(template.subject_template).render(values)
+    body = compile_template(template.body_template).render(values)
+    return RenderedEmail(recipient=recipient, subject=subject, body=body)
+
+
+def _render_contexts(
+    template: TemplateContent, contexts: Iterable[Mapping[str, object]], limits: Optional[RenderLimits] = None
+) -> tuple[list[str], list[str]]:
+    subject = compile_template(template.subject_template)
+    body = compile_template(template.body_template)
+    # Renders are shared between recipients whose referenced values match.
+    subject_cache: dict[tuple, str] = {}
+    body_cache: dict[tuple, str] = {}
+    subjects = []
+    bodies = []
+    for context in contexts:
+        subjects.append(subject.render_cached(context, subject_cache, limits))
+        bodies.append(body.render_cached(context, body_cache, limits))
+    return subjects, bodies
+
+
+def _render_table(
+    template: TemplateContent, recipients: RecipientTable, limits: Optional[RenderLimits] = None
+) -> tuple[list[str], list[str]]:
+    return _render_contexts(template, (recipients.row(index) for index in range(len(recipients))), limits)
+
+
+def _limit_memory(memory_limit_mb: int) -> None:
+    """Render process initializer: cap the address space."""
+
+    if resource is not None and memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class RenderPool:
+    """Render batches in worker processes, each under a wall-clock timeout.
+
+    A render that overruns is abandoned by killing the pool's processes; the
+    next render starts a fresh pool. Renders of other batches that were
+    running in the killed pool are retried once in the new one.
+    """
+
+    def __init__(self, workers: int, timeout: float, memory_limit_mb: int = 0) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # "spawn", like the encoding pool: never fork the threaded
+                # app process.
+                self._executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_limit_memory,
+                    initargs=(self.memory_limit_mb,),
+                )
+            return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        # ProcessPoolExecutor cannot cancel a running task; kill its workers.
+        for process in list(getattr(executor, "_processes", {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(
+        self, template: TemplateContent, recipients: RecipientTable, limits: RenderLimits
+    ) -> tuple[list[str], list[str]]:
+        for attempt in range(2):
+            executor = self._get()
+            future = executor.submit(_render_table, template, recipients, limits)
+            try:
+                return future.result(self.timeout)
+            except FutureTimeout as exc:
+                # Not the builtin ``TimeoutError`` before Python 3.11.
+                self._discard(executor)
+                raise TemplateRenderingError(
+                    f"Rendering took longer than {self.timeout:g} seconds; simplify the template"
+                ) from exc
+            except MemoryError as exc:
+                raise TemplateRenderingError(
+                    f"Rendering needed more than {self.memory_limit_mb} MiB of memory; simplify the template"
+                ) from exc
+            except BrokenProcessPool as exc:
+                # Killed under us (another render timed out) or out of memory.
+                self._discard(executor)
+                if attempt:
+                    raise TemplateRenderingError("Rendering failed; simplify the template") from exc
+        raise AssertionError("unreachable")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+@lru_cache
+def get_render_pool() -> RenderPool:
+    """Return the process pool that renders batches, sized like the admission limit."""
+
+    settings = get_settings()
+    return RenderPool(
+        settings.max_concurrent_work,
+        settings.render_timeout_seconds,
+        settings.render_memory_limit_mb,
+    )
+
+
+def shutdown_render_pool() -> None:
+    """Stop the render workers if the pool was started."""
+
+    if get_render_pool.cache_info().currsize:
+        get_render_pool().shutdown()
+        get_render_pool.cache_clear()
+
+
+@traced("template.render_batch")
+def render_batch(
+    template: TemplateContent,
+    recipients: RecipientTable | Iterable[Recipient],
+    isolated: bool = False,
+) -> List[RenderedEmail]:
+    """Render all emails and return preview objects.
 
-def render_batch(template: TemplateContent, recipients: Iterable[Recipient]) -> List[RenderedEmail]:
-    """Render all emails and return preview objects."""
+    Placeholders are checked against the available columns once, before any
+    row is rendered. With ``isolated``, a table whose templates run Jinja
+    code is rendered in a subprocess that is killed after
+    ``render_timeout_seconds`` (``TemplateRenderingError``); templates made
+    only of text and placeholders cannot run away and render in-process.
+    """
 
-    return [render_email(template, recipient) for recipient in recipients]
+    in_subprocess = False
+    with _RENDER_BATCH_SECONDS.time():
+        if isinstance(recipients, RecipientTable):
+            validate_placeholders(template, recipients.columns)
+            people = [recipients[index] for index in range(len(recipients))]
+            runs_code = not (
+                compile_template(template.subject_template).segments is not None
+                and compile_template(template.body_template).segments is not None
+            )
+            in_subprocess = isolated and runs_code and get_settings().render_timeout_seconds > 0
+            if in_subprocess:
+                subjects, bodies = get_render_pool().render(template, recipients, get_render_limits())
+            else:
+                subjects, bodies = _render_table(template, recipients)
+        else:
+            validate_placeholders(template, RECIPIENT_FIELDS)
+            people = list(recipients)
+            subjects, bodies = _render_contexts(template, map(_recipient_context, people))
+        messages = [
+            RenderedEmail(recipient=recipient, subject=subject, body=body)
+            for recipient, subject, body in zip(people, subjects, bodies)
+        ]
+    _MESSAGES_RENDERED.inc(len(messages))
+    current_span().set_attributes(
+        {
+            "batch.messages": len(messages),
+            "render.distinct_bodies": len({id(body) for body in bodies}),
+            "render.isolated": in_subprocess,
+        }
+    )
+    return messages
 
 
 __all__ = [
+    "CompiledTemplate",
+    "RenderLimits",
+    "RenderPool",
     "TemplateRenderingError",
+    "compile_template",
+    "get_render_limits",
+    "get_render_pool",
     "render_email",
     "render_batch",
+    "shutdown_render_pool",
+    "template_placeholders",
+    "validate_placeholders",
 ]
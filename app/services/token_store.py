@@ -3,27 +3,79 @@
 from __future__ import annotations
 
 import json
+import os
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from threading import Lock
-from typing import Optional
-
-from cryptography.fernet import Fernet, InvalidToken
-from google.oauth2.credentials import Credentials
+from typing import TYPE_CHECKING, Iterator, Optional
 
 from app.config import get_settings
+from app.services.metrics import get_registry
+from app.services.tracing import current_span, span
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+if TYPE_CHECKING:  # pragma: no cover - imported lazily at runtime
+    from google.oauth2.credentials import Credentials
+
+_TOKEN_STORE_SECONDS = get_registry().histogram(
+    "bulkmailer_token_store_duration_seconds",
+    "Latency of encrypted token store operations, including lock waits.",
+    labelnames=("operation",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
 
 
 class TokenStore:
-    """Persist Google OAuth credentials using Fernet encryption."""
+    """Persist Google OAuth credentials using Fernet encryption.
+
+    The file is shared with send worker processes, so updates take an
+    exclusive lock on a sidecar lock file and replace the store atomically;
+    readers therefore never see a half-written file.
+    """
 
     def __init__(self) -> None:
+        from cryptography.fernet import Fernet
+
         settings = get_settings()
         self._path: Path = settings.token_storage_path
         self._path.parent.mkdir(parents=True, exist_ok=True)
         self._fernet = Fernet(settings.fernet_key.encode("utf-8"))
         self._lock = Lock()
+        self._lock_path = self._path.with_name(self._path.name + ".lock")
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Lock waits are reported on the current span, separately from I/O.
+        started = time.perf_counter()
+        with self._lock:
+            current_span().set_attribute("token_store.lock_wait_ms", (time.perf_counter() - started) * 1000)
+            yield
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        started = time.perf_counter()
+        with self._lock:
+            if fcntl is None:
+                current_span().set_attribute("token_store.lock_wait_ms", (time.perf_counter() - started) * 1000)
+                yield
+                return
+            with open(self._lock_path, "a") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                current_span().set_attribute("token_store.lock_wait_ms", (time.perf_counter() - started) * 1000)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
 
     def _load_data(self) -> dict[str, str]:
+        from cryptography.fernet import InvalidToken
+
         if not self._path.exists():
             return {}
         try:
@@ -38,36 +90,44 @@ class TokenStore:
     def _save_data(self, data: dict[str, str]) -> None:
         payload = json.dumps(data).encode("utf-8")
         encrypted = self._fernet.encrypt(payload)
-        self._path.write_bytes(encrypted)
+        temporary = self._path.with_name(f"{self._path.name}.{os.getpid()}.tmp")
+        temporary.write_bytes(encrypted)
+        os.replace(temporary, self._path)
 
     def save_credentials(self, user_id: str, credentials: Credentials) -> None:
-        with self._lock:
+        with span("token_store.save"), _TOKEN_STORE_SECONDS.labels("save").time(), self._exclusive():
             data = self._load_data()
             data[user_id] = credentials.to_json()
             self._save_data(data)
 
     def load_credentials(self, user_id: str) -> Optional[Credentials]:
-        with self._lock:
+        with span("token_store.load"), _TOKEN_STORE_SECONDS.labels("load").time(), self._locked():
             data = self._load_data()
             if user_id not in data:
                 return None
+            from google.oauth2.credentials import Credentials
+
             info = json.loads(data[user_id]) if isinstance(data[user_id], str) else data[user_id]
             return Credentials.from_authorized_user_info(info)
 
+    def user_ids(self, prefix: str = "") -> list[str]:
+        """Return the stored user ids that start with ``prefix``."""
+
+        with span("token_store.list"), _TOKEN_STORE_SECONDS.labels("list").time(), self._locked():
+            return [user_id for user_id in self._load_data() if user_id.startswith(prefix)]
+
     def clear(self, user_id: str) -> None:
-        with self._lock:
+        with span("token_store.clear"), _TOKEN_STORE_SECONDS.labels("clear").time(), self._exclusive():
             data = self._load_data()
             data.pop(user_id, None)
             self._save_data(data)
 
 
-_store = TokenStore()
-
-
+@lru_cache
 def get_token_store() -> TokenStore:
-    """Return singleton token store."""
+    """Return singleton token store, constructing it on first use."""
 
-    return _store
+    return TokenStore()
 
 
 __all__ = ["TokenStore", "get_token_store"]
@@ -0,0 +1,440 @@
+"""In-process tracing with OpenTelemetry-compatible JSON export.
+
+Spans nest through a context variable, so a span opened inside a coroutine,
+an ``asyncio.gather`` task or an ``asyncio.to_thread`` call (all of which
+copy the current context) becomes a child of the span that was current when
+the work was started. Trace and span ids follow W3C Trace Context, so an
+incoming ``traceparent`` header continues the caller's trace.
+
+Finished spans are handed to a background thread that appends them to
+``trace_export_path`` in the OTLP/JSON encoding, one
+``ExportTraceServiceRequest`` object per line. The file can be read with
+``jq`` or replayed into an OpenTelemetry collector (``otlpjsonfile``
+receiver). Recording a span never touches the disk; when the writer falls
+behind, spans are dropped and counted instead of blocking requests.
+
+With tracing disabled every helper returns a shared no-op span, so the
+instrumentation costs a function call and nothing more.
+"""
+
+from __future__ import annotations
+
+import functools
+import inspect
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Iterator, Mapping, Optional, TypeVar, Union
+
+from app.config import get_settings
+from app.services.metrics import get_registry
+
+_registry = get_registry()
+_DROPPED = _registry.counter(
+    "bulkmailer_trace_spans_dropped_total",
+    "Finished spans dropped because the trace writer fell behind.",
+)
+
+AttributeValue = Union[str, bool, int, float]
+F = TypeVar("F", bound=Callable[..., Any])
+
+# OTLP ``Span.SpanKind`` and ``Status.StatusCode`` values.
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = (
+        "name",
+        "kind",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "attributes",
+        "events",
+        "status_code",
+        "status_message",
+        "start_ns",
+        "end_ns",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str],
+        kind: int = KIND_INTERNAL,
+        attributes: Optional[Mapping[str, AttributeValue]] = None,
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.attributes: dict[str, AttributeValue] = dict(attributes or {})
+        self.events: list[tuple[str, int, dict[str, AttributeValue]]] = []
+        self.status_code = STATUS_UNSET
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+
+    @property
+    def recording(self) -> bool:
+        return True
+
+    @property
+    def traceparent(self) -> str:
+        """The W3C ``traceparent`` header value naming this span."""
+
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Mapping[str, AttributeValue]) -> None:
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, attributes: Optional[Mapping[str, AttributeValue]] = None) -> None:
+        self.events.append((name, time.time_ns(), dict(attributes or {})))
+
+    def set_error(self, message: str = "") -> None:
+        self.status_code = STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.add_event(
+            "exception",
+            {"exception.type": type(exc).__qualname__, "exception.message": str(exc)},
+        )
+        self.set_error(str(exc))
+
+    def to_otlp(self) -> dict[str, Any]:
+        encoded: dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status_code},
+        }
+        if self.parent_span_id:
+            encoded["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            encoded["status"]["message"] = self.status_message
+        if self.events:
+            encoded["events"] = [
+                {"name": name, "timeUnixNano": str(at), "attributes": _otlp_attributes(attributes)}
+                for name, at, attributes in self.events
+            ]
+        return encoded
+
+
+class _NoOpSpan:
+    """Stands in for a span when tracing is disabled; every call is ignored."""
+
+    __slots__ = ()
+
+    recording = False
+    traceparent = ""
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        pass
+
+    def set_attributes(self, attributes: Mapping[str, AttributeValue]) -> None:
+        pass
+
+    def add_event(self, name: str, attributes: Optional[Mapping[str, AttributeValue]] = None) -> None:
+        pass
+
+    def set_error(self, message: str = "") -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+
+NOOP_SPAN = _NoOpSpan()
+_current: ContextVar[Union[Span, _NoOpSpan]] = ContextVar("current_span", default=NOOP_SPAN)
+
+
+def _otlp_value(value: AttributeValue) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Mapping[str, AttributeValue]) -> list[dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple[str, str]]:
+    """Return ``(trace_id, parent_span_id)`` from a W3C ``traceparent`` header."""
+
+    if not header:
+        return None
+    match = _TRACEPARENT.match(header.strip().lower())
+    if match is None or match.group(1) == _INVALID_TRACE_ID or match.group(2) == _INVALID_SPAN_ID:
+        return None
+    return match.group(1), match.group(2)
+
+
+class JsonSpanExporter:
+    """Append spans to a file as OTLP/JSON export requests, one per line.
+
+    The file is rotated to ``<name>.1`` once it grows past ``max_bytes``
+    (0 disables rotation).
+    """
+
+    def __init__(self, path: Path, service_name: str, max_bytes: int = 0) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._resource = {"attributes": _otlp_attributes({"service.name": service_name})}
+
+    def export(self, spans: list[Span]) -> None:
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": self._resource,
+                    "scopeSpans": [{"scope": {"name": "app"}, "spans": [span.to_otlp() for span in spans]}],
+                }
+            ]
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.max_bytes and self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+            os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(request, separators=(",", ":")) + "\n")
+
+
+class BatchSpanProcessor:
+    """Queue finished spans and export them in batches from a daemon thread."""
+
+    def __init__(
+        self,
+        exporter: JsonSpanExporter,
+        max_queue_size: int = 4096,
+        max_batch_size: int = 512,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self._exporter = exporter
+        self._queue: queue.Queue[Optional[Span]] = queue.Queue(max_queue_size)
+        self._max_batch_size = max_batch_size
+        self._flush_interval = flush_interval
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def on_end(self, span: Span) -> None:
+        self._ensure_started()
+        with self._flushed:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            with self._flushed:
+                self._pending -= 1
+            _DROPPED.inc()
+
+    def _run(self) -> None:
+        while True:
+            batch: list[Span] = []
+            deadline = time.monotonic() + self._flush_interval
+            stop = False
+            while len(batch) < self._max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._exporter.export(batch)
+                except OSError:
+                    _DROPPED.inc(len(batch))
+                with self._flushed:
+                    self._pending -= len(batch)
+                    self._flushed.notify_all()
+            if stop:
+                return
+
+    def force_flush(self, timeout: float = 5.0) -> bool:
+        """Wait until every span queued so far has been exported."""
+
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        self.force_flush(timeout)
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+class Tracer:
+    """Create spans and hand finished ones to ``processor``.
+
+    A tracer without a processor is disabled and only produces no-op spans.
+    """
+
+    def __init__(self, processor: Optional[BatchSpanProcessor] = None) -> None:
+        self.processor = processor
+
+    @property
+    def enabled(self) -> bool:
+        return self.processor is not None
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        attributes: Optional[Mapping[str, AttributeValue]] = None,
+        kind: int = KIND_INTERNAL,
+        parent: Optional[tuple[str, str]] = None,
+    ) -> Iterator[Union[Span, _NoOpSpan]]:
+        """Time the block as a child of the current span (or of ``parent``).
+
+        ``parent`` is a remote ``(trace_id, span_id)`` pair, as returned by
+        ``parse_traceparent``. An exception escaping the block marks the span
+        as failed and propagates.
+        """
+
+        if self.processor is None:
+            yield NOOP_SPAN
+            return
+        current = _current.get()
+        if parent is not None:
+            trace_id, parent_id = parent
+        elif isinstance(current, Span):
+            trace_id, parent_id = current.trace_id, current.span_id
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+        span = Span(name, trace_id, parent_id, kind, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.record_exception(exc)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current.reset(token)
+            self.processor.on_end(span)
+
+    def shutdown(self) -> None:
+        if self.processor is not None:
+            self.processor.shutdown()
+
+
+@lru_cache
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer, disabled unless ``tracing_enabled`` is set."""
+
+    settings = get_settings()
+    if not settings.tracing_enabled:
+        return Tracer()
+    exporter = JsonSpanExporter(
+        settings.trace_export_path,
+        settings.app_name,
+        max_bytes=settings.trace_export_max_bytes,
+    )
+    return Tracer(BatchSpanProcessor(exporter))
+
+
+def current_span() -> Union[Span, _NoOpSpan]:
+    """Return the active span, or the no-op span outside of any trace."""
+
+    return _current.get()
+
+
+def span(
+    name: str,
+    attributes: Optional[Mapping[str, AttributeValue]] = None,
+    kind: int = KIND_INTERNAL,
+) -> ContextManager[Union[Span, _NoOpSpan]]:
+    """Shorthand for ``get_tracer().span(...)``."""
+
+    return get_tracer().span(name, attributes, kind)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Decorate a function or coroutine function so each call is a span."""
+
+    def decorate(function: F) -> F:
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with get_tracer().span(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with get_tracer().span(name):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
+
+
+__all__ = [
+    "AttributeValue",
+    "KIND_CLIENT",
+    "KIND_INTERNAL",
+    "KIND_SERVER",
+    "NOOP_SPAN",
+    "BatchSpanProcessor",
+    "JsonSpanExporter",
+    "Span",
+    "Tracer",
+    "current_span",
+    "get_tracer",
+    "parse_traceparent",
+    "span",
+    "traced",
+]
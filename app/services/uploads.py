@@ -0,0 +1,190 @@
+"""Resumable chunked uploads of recipient files.
+
+A large file is sent as a series of chunks, each tagged with the byte offset
+it starts at. Chunks are appended to a temporary file, and a chunk whose
+offset does not match the bytes received so far is refused with the current
+offset, so a client whose connection dropped asks where to resume
+(``GET``) and continues from there instead of starting over.
+
+Every accepted chunk is also fed to a ``RecipientStreamParser``, so rows are
+validated while the rest of the file is still on its way and finishing the
+upload only has the last record left to parse. XLSX workbooks are the
+exception: a zip archive can only be read once it is complete, so their rows
+are validated when the upload is finished.
+"""
+
+from __future__ import annotations
+
+import secrets
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from app.config import get_settings
+from app.services.admission import Overloaded
+from app.services.csv_loader import CSVParsingError, ParsedCSV, RecipientStreamParser, record_parse
+
+
+class UploadError(Exception):
+    """Raised when an upload or one of its chunks cannot be accepted."""
+
+    def __init__(self, message: str, status_code: int, offset: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ChunkedUpload:
+    """An upload in progress: its temporary file and the parse so far."""
+
+    def __init__(self, upload_id: str, session_id: str, path: Path, length: Optional[int]) -> None:
+        self.id = upload_id
+        self.session_id = session_id
+        self.path = path
+        self.length = length
+        self.offset = 0
+        self.parser = RecipientStreamParser()
+        self.parse_seconds = 0.0
+        self.error: Optional[str] = None
+        self.touched = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class UploadStore:
+    """Chunked uploads of this process, keyed by id and owned by a session.
+
+    Uploads idle for ``expiry_seconds`` are discarded whenever the store is
+    used, and a session may have at most ``max_per_session`` in progress.
+
+    Methods block on file I/O and parsing; call them from a worker thread.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, expiry_seconds: float, max_per_session: int = 3) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.expiry_seconds = expiry_seconds
+        self.max_per_session = max_per_session
+        self._uploads: dict[str, ChunkedUpload] = {}
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str, length: Optional[int] = None) -> ChunkedUpload:
+        """Start an upload of ``length`` bytes (unknown if ``None``)."""
+
+        self.purge_expired()
+        self._purge_orphans()
+        if length is not None and length > self.max_bytes:
+            raise UploadError(f"Uploads are limited to {self.max_bytes} bytes", 413)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        upload_id = secrets.token_urlsafe(12)
+        path = self.directory / f"{upload_id}.part"
+        upload = ChunkedUpload(upload_id, session_id, path, length)
+        with self._lock:
+            open_uploads = sum(1 for other in self._uploads.values() if other.session_id == session_id)
+            if open_uploads >= self.max_per_session:
+                raise UploadError(
+                    f"At most {self.max_per_session} uploads may be in progress; finish or delete one first", 429
+                )
+            self._uploads[upload_id] = upload
+        path.touch()
+        return upload
+
+    def get(self, session_id: str, upload_id: str) -> ChunkedUpload:
+        self.purge_expired()
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None or upload.session_id != session_id:
+            raise UploadError("Unknown or expired upload", 404)
+        upload.touched = time.monotonic()
+        return upload
+
+    def append(self, upload: ChunkedUpload, offset: int, data: bytes) -> int:
+        """Write ``data`` at ``offset``, parse it and return the new offset."""
+
+        self.purge_expired()
+        with upload.lock:
+            if upload.error is not None:
+                raise UploadError(upload.error, 422, upload.offset)
+            if offset != upload.offset:
+                raise UploadError(f"Chunk starts at {offset}, expected {upload.offset}", 409, upload.offset)
+            limit = self.max_bytes if upload.length is None else min(upload.length, self.max_bytes)
+            if offset + len(data) > limit:
+                raise UploadError(f"Upload would exceed {limit} bytes", 413, upload.offset)
+            with upload.path.open("r+b") as handle:
+                handle.seek(offset)
+                handle.write(data)
+            upload.offset += len(data)
+            upload.touched = time.monotonic()
+            started = time.perf_counter()
+            try:
+                upload.parser.feed(data)
+            except CSVParsingError as exc:
+                upload.error = str(exc)
+                raise UploadError(upload.error, 422, upload.offset) from exc
+            except Overloaded as exc:
+                upload.error = str(exc)
+                raise
+            finally:
+                upload.parse_seconds += time.perf_counter() - started
+            return upload.offset
+
+    def complete(self, upload: ChunkedUpload) -> ParsedCSV:
+        """Finish parsing and forget the upload."""
+
+        with upload.lock:
+            if upload.error is not None:
+                raise UploadError(upload.error, 422, upload.offset)
+            if upload.length is not None and upload.offset != upload.length:
+                raise UploadError(f"Upload is incomplete: {upload.offset} of {upload.length} bytes", 409, upload.offset)
+            started = time.perf_counter()
+            try:
+                result = upload.parser.close()
+            except CSVParsingError as exc:
+                raise UploadError(str(exc), 422, upload.offset) from exc
+            finally:
+                self.discard(upload)
+            record_parse(upload.parser, upload.parse_seconds + time.perf_counter() - started)
+            return result
+
+    def discard(self, upload: ChunkedUpload) -> None:
+        with self._lock:
+            self._uploads.pop(upload.id, None)
+        upload.path.unlink(missing_ok=True)
+
+    def purge_expired(self) -> None:
+        cutoff = time.monotonic() - self.expiry_seconds
+        with self._lock:
+            expired = [upload for upload in self._uploads.values() if upload.touched < cutoff]
+        for upload in expired:
+            self.discard(upload)
+
+    def _purge_orphans(self) -> None:
+        # Files left by an earlier process, which no longer knows about them.
+        if not self.directory.is_dir():
+            return
+        cutoff = time.time() - self.expiry_seconds
+        with self._lock:
+            known = {upload.path.name for upload in self._uploads.values()}
+        for path in self.directory.glob("*.part"):
+            try:
+                if path.name not in known and path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                continue
+
+
+@lru_cache
+def get_upload_store() -> UploadStore:
+    """Return the process-wide upload store."""
+
+    settings = get_settings()
+    return UploadStore(
+        settings.upload_dir,
+        settings.max_upload_bytes,
+        settings.upload_expiry_minutes * 60,
+        settings.max_uploads_per_session,
+    )
+
+
+__all__ = ["ChunkedUpload", "UploadError", "UploadStore", "get_upload_store"]
@@ -0,0 +1,207 @@
+"""Stream the rows of the first worksheet of an XLSX workbook.
+
+Like the DOCX extractor, this reads the package with ``zipfile`` and
+``iterparse`` instead of loading a spreadsheet library: the worksheet XML is
+parsed as a stream and every row is dropped once its values have been read,
+so memory stays flat however long the sheet is. Only the shared strings
+table, which cells refer to by index, is held in memory.
+
+A small archive can expand to huge members, so the uncompressed size the
+archive declares is checked against ``max_bytes`` before any member is
+opened (``zipfile`` never returns more than a member declares), and the
+shared strings table is capped at ``max_shared_chars``.
+
+Cell values are returned as text the way a CSV export would show them:
+shared and inline strings as written, booleans as ``TRUE``/``FALSE`` and
+whole numbers without a trailing ``.0``. Number formats (dates, currency)
+are not applied.
+"""
+
+from __future__ import annotations
+
+import posixpath
+import zipfile
+from typing import IO, Iterator, Optional
+from xml.etree.ElementTree import Element, ParseError, iterparse
+
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_RELATIONSHIP_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_RELATIONSHIPS = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+_RELATIONSHIP_TYPES = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+_OFFICE_DOCUMENT = _RELATIONSHIP_TYPES + "officeDocument"
+_SHARED_STRINGS = _RELATIONSHIP_TYPES + "sharedStrings"
+
+_SHEET = _MAIN + "sheet"
+_SHEET_DATA = _MAIN + "sheetData"
+_ROW = _MAIN + "row"
+_CELL = _MAIN + "c"
+_VALUE = _MAIN + "v"
+_INLINE = _MAIN + "is"
+_STRING_ITEM = _MAIN + "si"
+_RUN = _MAIN + "r"
+_TEXT = _MAIN + "t"
+
+# Charged per shared string on top of its length: roughly what Python keeps
+# for each ``str``, so a table of millions of empty strings is bounded too.
+_STRING_OVERHEAD = 50
+# Columns a worksheet may have (``XFD``); a larger reference is corrupt.
+_MAX_COLUMNS = 16384
+
+
+class XlsxReadError(Exception):
+    """Raised when a workbook cannot be read."""
+
+
+def _relationships(archive: zipfile.ZipFile, part: str) -> dict[str, tuple[str, str]]:
+    """Return ``{id: (type, member name)}`` for the relationships of ``part``."""
+
+    directory, name = posixpath.split(part)
+    rels_name = posixpath.join(directory, "_rels", name + ".rels")
+    found: dict[str, tuple[str, str]] = {}
+    try:
+        rels = archive.open(rels_name)
+    except KeyError:
+        return found
+    with rels:
+        for _, element in iterparse(rels):
+            if element.tag == _RELATIONSHIPS and element.get("TargetMode") != "External":
+                target = element.get("Target", "")
+                member = target.lstrip("/") if target.startswith("/") else posixpath.join(directory, target)
+                found[element.get("Id", "")] = (element.get("Type", ""), posixpath.normpath(member))
+    return found
+
+
+def _first_sheet(archive: zipfile.ZipFile) -> tuple[str, Optional[str]]:
+    """Return the member names of the first worksheet and the shared strings."""
+
+    workbook = next(
+        (member for kind, member in _relationships(archive, "").values() if kind == _OFFICE_DOCUMENT),
+        None,
+    )
+    if workbook is None:
+        raise XlsxReadError("The file is not an XLSX workbook")
+    parts = _relationships(archive, workbook)
+    shared = next((member for kind, member in parts.values() if kind == _SHARED_STRINGS), None)
+    with archive.open(workbook) as document:
+        for _, element in iterparse(document):
+            if element.tag == _SHEET:
+                relation = parts.get(element.get(_RELATIONSHIP_ID, ""))
+                if relation is None:
+                    break
+                return relation[1], shared
+    raise XlsxReadError("The workbook has no worksheet")
+
+
+def _item_text(item: Element) -> str:
+    # Text runs only; phonetic hints (``rPh``) are not part of the value.
+    parts = []
+    for child in item:
+        if child.tag == _TEXT:
+            parts.append(child.text or "")
+        elif child.tag == _RUN:
+            parts.extend(text.text or "" for text in child if text.tag == _TEXT)
+    return "".join(parts)
+
+
+def _shared_strings(archive: zipfile.ZipFile, member: Optional[str], max_chars: int) -> list[str]:
+    strings: list[str] = []
+    if member is None:
+        return strings
+    budget = max_chars
+    with archive.open(member) as document:
+        for _, element in iterparse(document):
+            if element.tag == _STRING_ITEM:
+                text = _item_text(element)
+                budget -= len(text) + _STRING_OVERHEAD
+                if budget < 0:
+                    raise XlsxReadError(f"The workbook's shared strings exceed {max_chars} characters")
+                strings.append(text)
+                element.clear()
+    return strings
+
+
+def _column(reference: str) -> int:
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _number(text: str) -> str:
+    try:
+        value = float(text)
+    except ValueError:
+        return text
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return text
+
+
+def _cell_value(cell: Element, strings: list[str]) -> str:
+    kind = cell.get("t", "n")
+    if kind == "inlineStr":
+        inline = cell.find(_INLINE)
+        return _item_text(inline) if inline is not None else ""
+    value = cell.findtext(_VALUE)
+    if value is None:
+        return ""
+    if kind == "s":
+        try:
+            return strings[int(value)]
+        except (IndexError, ValueError) as exc:
+            raise XlsxReadError("The workbook refers to a missing shared string") from exc
+    if kind == "b":
+        return "TRUE" if value == "1" else "FALSE"
+    if kind == "n":
+        return _number(value)
+    return value
+
+
+def _stream_rows(document: IO[bytes], strings: list[str]) -> Iterator[tuple[int, list[str]]]:
+    sheet_data: Optional[Element] = None
+    number = 0
+    for event, element in iterparse(document, events=("start", "end")):
+        if event == "start":
+            if element.tag == _SHEET_DATA:
+                sheet_data = element
+            continue
+        if element.tag != _ROW:
+            continue
+        number = int(element.get("r") or number + 1)
+        values: list[str] = []
+        for cell in element.iter(_CELL):
+            reference = cell.get("r")
+            position = _column(reference) if reference else len(values)
+            if not 0 <= position < _MAX_COLUMNS:
+                raise XlsxReadError(f"Row {number} has a cell outside the sheet")
+            if position >= len(values):
+                values.extend([""] * (position - len(values) + 1))
+            values[position] = _cell_value(cell, strings)
+        yield number, values
+        # Rows are not needed once read; drop them to keep memory flat.
+        if sheet_data is not None:
+            sheet_data.remove(element)
+
+
+def iter_xlsx_rows(
+    file: IO[bytes], max_bytes: int, max_shared_chars: int
+) -> Iterator[tuple[int, list[str]]]:
+    """Yield ``(row number, cell values)`` for each row of the first worksheet."""
+
+    try:
+        with zipfile.ZipFile(file) as archive:
+            if sum(member.file_size for member in archive.infolist()) > max_bytes:
+                raise XlsxReadError(f"The workbook expands to more than {max_bytes} bytes")
+            sheet, shared = _first_sheet(archive)
+            strings = _shared_strings(archive, shared, max_shared_chars)
+            with archive.open(sheet) as document:
+                yield from _stream_rows(document, strings)
+    except XlsxReadError:
+        raise
+    except (zipfile.BadZipFile, KeyError, ParseError, OSError, EOFError, ValueError) as exc:
+        raise XlsxReadError("Unable to read XLSX file") from exc
+
+
+__all__ = ["XlsxReadError", "iter_xlsx_rows"]
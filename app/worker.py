@@ -0,0 +1,283 @@
+"""Send worker entry point: ``python -m app.worker``.
+
+With ``BATCH_APP_SEND_MODE=worker`` the web process only queues messages; one
+or more workers on the same machine claim them from the shared SQLite queue,
+build and send the MIME messages, and record the results for the web process
+to pick up. Start as many worker processes as the CPU allows; each claims its
+own jobs, and jobs leased by a worker that stops heartbeating are reclaimed by
+the others once the lease expires.
+
+Unless started with ``--drain``, each worker also runs a ``Scheduler`` that
+moves scheduled messages into the queue when they are due. In inline mode the
+web process runs the same pair itself (see ``run_embedded``) so scheduled
+sends work without a separate worker.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Optional
+
+from app.config import get_settings
+from app.models.domain import email_domain
+from app.services.domain_throttle import get_domain_throttle, interleave_by_domain
+from app.services.gmail import GmailClient, get_gmail_client
+from app.services.mime_builder import MessageEncodingError, PreEncodedBatch, pre_encode, shutdown_encoding_pool
+from app.services.scheduler import Scheduler
+from app.services.send_queue import FAILED, SendJob, SendQueue, get_send_queue
+from app.services.sender_pool import SenderPool
+from app.services.sending import Outcome, deliver, encoding_failure
+from app.services.structured_logging import configure_logging
+from app.services.tracing import AttributeValue, get_tracer, span
+
+logger = logging.getLogger("app.worker")
+
+_MAX_BACKOFF_SECONDS = 60.0
+# How often an idle worker deletes finished jobs of expired sessions.
+_PURGE_INTERVAL_SECONDS = 300.0
+# A draining worker gives up after this many failed iterations in a row.
+_MAX_DRAIN_FAILURES = 3
+
+
+class SendWorker:
+    """Claim queued send jobs and deliver them through Gmail."""
+
+    def __init__(
+        self,
+        queue: Optional[SendQueue] = None,
+        gmail: Optional[GmailClient] = None,
+        worker_id: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        lease_seconds: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+    ) -> None:
+        settings = get_settings()
+        self.queue = queue or get_send_queue()
+        self.gmail = gmail or get_gmail_client()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size or settings.worker_batch_size
+        self.concurrency = concurrency or settings.send_concurrency
+        self.lease_seconds = lease_seconds or settings.send_lease_seconds
+        self.poll_interval = poll_interval or settings.worker_poll_interval_seconds
+        self.retention_seconds = settings.session_lifetime_minutes * 60
+        self._in_flight: set[int] = set()
+        self._next_purge = 0.0
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if self._in_flight:
+                await asyncio.to_thread(
+                    self.queue.heartbeat, self.worker_id, list(self._in_flight), self.lease_seconds
+                )
+
+    async def _process(
+        self,
+        job: SendJob,
+        senders: SenderPool,
+        encoded: PreEncodedBatch,
+        position: int,
+        semaphore: asyncio.Semaphore,
+    ) -> None:
+        outcome: Outcome
+        domain = email_domain(job.to_email)
+        with span("message", {"job.id": job.id, "job.attempt": job.attempts}) as current:
+            try:
+                with span("mime.encode_wait"):
+                    raw = await encoded.raw(position)
+            except MessageEncodingError as exc:
+                # Retrying cannot help, so record the failure instead of letting
+                # the job be leased again.
+                outcome = encoding_failure(exc)
+            else:
+                waited = time.perf_counter()
+                async with get_domain_throttle().slot(domain):
+                    current.set_attribute("domain.wait_ms", (time.perf_counter() - waited) * 1000)
+                    waited = time.perf_counter()
+                    async with semaphore:
+                        current.set_attribute("worker.slot_wait_ms", (time.perf_counter() - waited) * 1000)
+                        if senders:
+                            outcome = await deliver(
+                                senders, job.to_email, job.subject, job.body, raw=raw, domain=domain
+                            )
+                        else:
+                            outcome = (FAILED, "Gmail is not connected for this session.", None)
+            status, error_message, sent_at = outcome
+            recorded = await asyncio.to_thread(
+                self.queue.complete, job.id, self.worker_id, status, error_message, sent_at
+            )
+        if not recorded:
+            logger.warning("send_worker lost lease job=%s worker=%s", job.id, self.worker_id)
+        self._in_flight.discard(job.id)
+
+    async def _connect(self, session_id: str) -> Optional[SenderPool]:
+        """Load a session's senders, or ``None`` if that failed unexpectedly."""
+
+        try:
+            return await SenderPool.connect(self.gmail, session_id)
+        except Exception:
+            logger.exception("send_worker connect_failed session=%s worker=%s", session_id[:6], self.worker_id)
+            return None
+
+    async def _release(self, jobs: list[SendJob]) -> None:
+        job_ids = [job.id for job in jobs]
+        await asyncio.to_thread(
+            self.queue.release, self.worker_id, job_ids, "Could not load the Gmail accounts for this session."
+        )
+        self._in_flight.difference_update(job_ids)
+
+    async def run_once(self) -> int:
+        """Claim and process one batch of jobs; returns how many were claimed."""
+
+        claimed = time.perf_counter()
+        jobs = await asyncio.to_thread(self.queue.claim, self.worker_id, self.batch_size, self.lease_seconds)
+        if not jobs:
+            return 0
+        attributes: dict[str, AttributeValue] = {
+            "worker.id": self.worker_id,
+            "batch.jobs": len(jobs),
+            "batch.sessions": len({job.session_id for job in jobs}),
+            "queue.claim_ms": (time.perf_counter() - claimed) * 1000,
+        }
+        with span("worker.batch", attributes):
+            await self._run_jobs(jobs)
+        return len(jobs)
+
+    async def _run_jobs(self, jobs: list[SendJob]) -> None:
+        # Encode and send round robin across recipient domains.
+        jobs = interleave_by_domain(jobs, lambda job: email_domain(job.to_email))
+        self._in_flight.update(job.id for job in jobs)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        encoded = pre_encode([(job.to_email, job.subject, job.body) for job in jobs])
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            pools: dict[str, Optional[SenderPool]] = {}
+            for job in jobs:
+                if job.session_id not in pools:
+                    pools[job.session_id] = await self._connect(job.session_id)
+            unavailable = [job for job in jobs if pools[job.session_id] is None]
+            if unavailable:
+                await self._release(unavailable)
+            await asyncio.gather(
+                *(
+                    self._process(job, senders, encoded, position, semaphore)
+                    for position, job in enumerate(jobs)
+                    if (senders := pools[job.session_id]) is not None
+                )
+            )
+        finally:
+            heartbeat.cancel()
+            self._in_flight.clear()
+
+    async def purge_finished(self) -> None:
+        """Delete finished jobs once their session has expired, at most every few minutes."""
+
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + _PURGE_INTERVAL_SECONDS
+        deleted = await asyncio.to_thread(self.queue.purge_finished, self.retention_seconds)
+        if deleted:
+            logger.info("send_worker purged_finished jobs=%s worker=%s", deleted, self.worker_id)
+
+    async def run(self, stop: asyncio.Event, drain: bool = False) -> None:
+        """Process jobs until ``stop`` is set (or, with ``drain``, the queue is empty)."""
+
+        logger.info("send_worker started worker=%s queue=%s", self.worker_id, self.queue.path)
+        failures = 0
+        try:
+            while not stop.is_set():
+                try:
+                    claimed = await self.run_once()
+                    failures = 0
+                except Exception:
+                    # A broken iteration (database locked, unexpected send
+                    # error) must not stop the worker; leases it held expire
+                    # and the jobs are claimed again.
+                    failures += 1
+                    logger.exception("send_worker iteration_failed worker=%s failures=%s", self.worker_id, failures)
+                    claimed = 0
+                    if drain and failures >= _MAX_DRAIN_FAILURES:
+                        break
+                if claimed:
+                    continue
+                if drain and not failures:
+                    break
+                try:
+                    await self.purge_finished()
+                except Exception:
+                    logger.exception("send_worker purge_failed worker=%s", self.worker_id)
+                delay = min(self.poll_interval * 2 ** min(failures, 10), _MAX_BACKOFF_SECONDS)
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.gmail.aclose()
+            shutdown_encoding_pool()
+            logger.info("send_worker stopped worker=%s", self.worker_id)
+
+
+async def run_embedded(stop: asyncio.Event) -> None:
+    """Run a scheduler and send worker inside the web process until ``stop`` is set.
+
+    Nothing is opened until the queue database exists, which happens the
+    first time a batch is scheduled.
+    """
+
+    settings = get_settings()
+    while not settings.send_queue_path.exists():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.worker_poll_interval_seconds)
+            return
+        except asyncio.TimeoutError:
+            pass
+    worker = SendWorker(worker_id=f"{socket.gethostname()}:{os.getpid()}:web")
+    await asyncio.gather(Scheduler().run(stop), worker.run(stop))
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Deliver messages queued by the web process.")
+    parser.add_argument("--worker-id", help="Identifier recorded on leased jobs (default host:pid)")
+    parser.add_argument("--batch-size", type=int, help="Jobs claimed at a time")
+    parser.add_argument("--concurrency", type=int, help="Messages sent concurrently")
+    parser.add_argument("--drain", action="store_true", help="Exit once the queue is empty")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    configure_logging()
+    worker = SendWorker(worker_id=args.worker_id, batch_size=args.batch_size, concurrency=args.concurrency)
+
+    async def execute() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except NotImplementedError:  # pragma: no cover - Windows
+                pass
+        if args.drain:
+            await worker.run(stop, drain=True)
+        else:
+            await asyncio.gather(Scheduler().run(stop), worker.run(stop))
+
+    try:
+        asyncio.run(execute())
+    finally:
+        get_tracer().shutdown()
+    return 0
+
+
+__all__ = ["SendWorker", "main", "run_embedded"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
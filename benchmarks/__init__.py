@@ -0,0 +1,4 @@
+"""Performance benchmarks for the email batch pipeline.
+
+Run with ``python -m benchmarks``; see ``benchmarks/README.md``.
+"""
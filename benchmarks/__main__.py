@@ -0,0 +1,172 @@
+"""Command line entry point: ``python -m benchmarks``."""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from benchmarks import datagen
+
+DEFAULT_SIZES = [1_000, 10_000]
+FULL_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_OUTPUT = Path("bench_results.json")
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+
+
+def _rounds_for(size: int, requested: int) -> int:
+    # Very large inputs take seconds per call; a single round keeps the full
+    # sweep tractable while small inputs still get a stable median.
+    if size >= 100_000:
+        return 1
+    return requested
+
+
+def time_call(run, rounds: int) -> list[float]:
+    run()  # warm-up: imports, Jinja compilation, first-touch allocations
+    timings = []
+    for _ in range(rounds):
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run_cases(names: list[str], sizes: list[int], rounds: int) -> dict[str, dict]:
+    from benchmarks.cases import CASES
+
+    results: dict[str, dict] = {}
+    for name in names:
+        case = CASES[name]
+        for size in case.sizes(sizes):
+            run, items = case.factory(size)
+            timings = time_call(run, _rounds_for(size, rounds))
+            median = statistics.median(timings)
+            results[case.key(size)] = {
+                "median_s": median,
+                "min_s": min(timings),
+                "rounds": len(timings),
+                "items": items,
+                "per_item_us": median / items * 1e6 if items else None,
+            }
+            print(f"{case.key(size):<40} {median * 1000:>12.2f} ms", flush=True)
+            del run
+            gc.collect()
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[dict]:
+    """Return one row per benchmark present in both runs, flagging regressions."""
+
+    rows = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        ratio = current["median_s"] / previous["median_s"] if previous["median_s"] else float("inf")
+        rows.append(
+            {
+                "benchmark": key,
+                "baseline_s": previous["median_s"],
+                "current_s": current["median_s"],
+                "ratio": ratio,
+                "regression": ratio > 1 + threshold,
+            }
+        )
+    return rows
+
+
+def _load_results(path: Path) -> Optional[dict[str, dict]]:
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8")).get("results", {})
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from benchmarks.cases import CASES
+
+    parser = argparse.ArgumentParser(description="Benchmark the email batch pipeline.")
+    parser.add_argument("--sizes", help="Comma separated recipient counts (default 1000,10000)")
+    parser.add_argument("--full", action="store_true", help="Use 1k, 10k, 100k and 1M recipients")
+    parser.add_argument("--only", help="Comma separated case names to run")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown versus baseline before failing (0.25 = 25%%)",
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="Write results to the baseline file")
+    parser.add_argument("--list", action="store_true", help="List available cases and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in CASES:
+            print(name)
+        return 0
+
+    sizes = FULL_SIZES if args.full else DEFAULT_SIZES
+    if args.sizes:
+        sizes = [int(value) for value in args.sizes.split(",") if value]
+    names = list(CASES)
+    if args.only:
+        names = [name for name in args.only.split(",") if name]
+        unknown = [name for name in names if name not in CASES]
+        if unknown:
+            parser.error("unknown cases: " + ", ".join(unknown))
+
+    datagen.configure_environment(datagen.scratch_dir())
+    results = run_cases(names, sizes, args.rounds)
+
+    document = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "sizes": sizes,
+        },
+        "results": results,
+    }
+    args.output.write_text(json.dumps(document, indent=2) + "\n", encoding="utf-8")
+    print(f"\nResults written to {args.output}")
+
+    if args.update_baseline:
+        baseline = _load_results(args.baseline) or {}
+        baseline.update(results)
+        document["results"] = baseline
+        args.baseline.write_text(json.dumps(document, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline updated at {args.baseline}")
+        return 0
+
+    baseline = _load_results(args.baseline)
+    if baseline is None:
+        print("No baseline found; skipping comparison.")
+        return 0
+
+    rows = compare(results, baseline, args.threshold)
+    print(f"\n{'benchmark':<40} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['benchmark']:<40} {row['baseline_s'] * 1000:>10.2f}ms "
+            f"{row['current_s'] * 1000:>10.2f}ms {row['ratio']:>8.2f}{flag}"
+        )
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Benchmark case definitions.
+
+Each case is a factory that receives the requested size and returns the
+callable to time plus the number of items one call processes, so results can
+be reported per item as well as per call. Expensive setup happens in the
+factory and is never timed.
+"""
+
+from __future__ import annotations
+
+import io
+import random
+from typing import Callable, Optional
+
+from benchmarks import datagen
+
+Runner = Callable[[], object]
+Factory = Callable[[int], tuple[Runner, int]]
+
+
+class Case:
+    """A named benchmark, optionally parametrised by recipient count."""
+
+    def __init__(self, name: str, factory: Factory, sized: bool = True, max_size: Optional[int] = None) -> None:
+        self.name = name
+        self.factory = factory
+        self.sized = sized
+        self.max_size = max_size
+
+    def sizes(self, requested: list[int]) -> list[int]:
+        if not self.sized:
+            return [0]
+        return [size for size in requested if self.max_size is None or size <= self.max_size]
+
+    def key(self, size: int) -> str:
+        return f"{self.name}[{size}]" if self.sized else self.name
+
+
+CASES: dict[str, Case] = {}
+
+
+def case(name: str, sized: bool = True, max_size: Optional[int] = None) -> Callable[[Factory], Factory]:
+    def register(factory: Factory) -> Factory:
+        CASES[name] = Case(name, factory, sized=sized, max_size=max_size)
+        return factory
+
+    return register
+
+
+@case("parse_recipients")
+def parse_recipients_case(size: int) -> tuple[Runner, int]:
+    from fastapi import UploadFile
+
+    from app.services.csv_loader import parse_recipients
+
+    payload = datagen.recipients_csv(size)
+
+    def run() -> object:
+        return parse_recipients(UploadFile(filename="bench.csv", file=io.BytesIO(payload)))
+
+    return run, size
+
+
+@case("render_batch")
+def render_batch_case(size: int) -> tuple[Runner, int]:
+    from app.models.domain import TemplateContent
+    from app.services.template_renderer import render_batch
+
+    recipients = datagen.recipients(size)
+    template = TemplateContent(
+        subject_template="Reminder for {{ first_name }}",
+        body_template=datagen.template_body(),
+    )
+
+    def run() -> object:
+        return render_batch(template, recipients)
+
+    return run, size
+
+
+@case("render_email", sized=False)
+def render_email_case(_: int) -> tuple[Runner, int]:
+    from app.models.domain import TemplateContent
+    from app.services.template_renderer import render_email
+
+    calls = 1000
+    recipients = datagen.recipients(calls)
+    template = TemplateContent(
+        subject_template="Reminder for {{ first_name }}",
+        body_template=datagen.template_body(),
+    )
+
+    def run() -> object:
+        return [render_email(template, recipient) for recipient in recipients]
+
+    return run, calls
+
+
+@case("batch_store_get")
+def batch_store_get_case(size: int) -> tuple[Runner, int]:
+    from app.services.store import BatchStore
+
+    store = BatchStore()
+    session_ids = [f"session-{index}" for index in range(size)]
+    for session_id in session_ids:
+        store.get(session_id)
+    lookups = random.Random(1).choices(session_ids, k=1000)
+
+    def run() -> object:
+        for session_id in lookups:
+            store.get(session_id)
+        return None
+
+    return run, len(lookups)
+
+
+@case("token_store_save_load", max_size=100_000)
+def token_store_case(size: int) -> tuple[Runner, int]:
+    from google.oauth2.credentials import Credentials
+
+    from app.services.token_store import TokenStore
+
+    store = TokenStore()
+    credentials = Credentials(
+        token="access-token",
+        refresh_token="refresh-token",
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id="client-id",
+        client_secret="client-secret",
+    )
+    serialized = credentials.to_json()
+    store._save_data({f"user-{index}": serialized for index in range(size)})
+
+    def run() -> object:
+        store.save_credentials("user-0", credentials)
+        return store.load_credentials("user-0")
+
+    return run, 1
+
+
+@case("extract_plain_text_large_docx", sized=False)
+def extract_plain_text_case(_: int) -> tuple[Runner, int]:
+    """First upload of a multi-MB DOCX: hashing plus streaming extraction."""
+
+    from app.services.docx_loader import extract_plain_text, get_docx_cache
+
+    payload = datagen.large_docx()
+
+    def run() -> object:
+        get_docx_cache().clear()
+        return extract_plain_text(payload)
+
+    return run, 1
+
+
+@case("extract_plain_text_large_docx_cached", sized=False)
+def extract_plain_text_cached_case(_: int) -> tuple[Runner, int]:
+    """Re-upload of the same multi-MB DOCX, answered from the content-hash cache."""
+
+    from app.services.docx_loader import extract_plain_text
+
+    payload = datagen.large_docx()
+    extract_plain_text(payload)
+
+    def run() -> object:
+        return extract_plain_text(payload)
+
+    return run, 1
+
+
+@case("extract_plain_text_python_docx", sized=False)
+def extract_plain_text_python_docx_case(_: int) -> tuple[Runner, int]:
+    """Reference: load the multi-MB DOCX through python-docx's object model."""
+
+    from docx import Document
+
+    payload = datagen.large_docx()
+
+    def run() -> object:
+        document = Document(io.BytesIO(payload))
+        paragraphs = [paragraph.text.strip() for paragraph in document.paragraphs]
+        return "\n".join(filter(None, paragraphs)).strip()
+
+    return run, 1
+
+
+@case("gmail_send_message", max_size=100_000)
+def gmail_send_message_case(size: int) -> tuple[Runner, int]:
+    """MIME building, encoding and request dispatch with a stubbed transport."""
+
+    import asyncio
+
+    import httpx
+    from google.oauth2.credentials import Credentials
+
+    from app.services.gmail import GmailClient
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"id": "stub"}))
+    credentials = Credentials(token="access-token")
+    body = datagen.template_body()
+    messages = [(email, f"Reminder for {first}") for _, first, _, email in datagen.recipient_rows(size)]
+
+    async def send_all() -> None:
+        client = GmailClient(transport=transport)
+        for email, subject in messages:
+            await client.send_message(credentials, email, subject, body)
+        await client.aclose()
+
+    def run() -> object:
+        return asyncio.run(send_all())
+
+    return run, len(messages)
+
+
+def _mime_inputs(size: int) -> list[tuple[str, str, str]]:
+    body = datagen.template_body()
+    return [(email, f"Reminder for {first}", body) for _, first, _, email in datagen.recipient_rows(size)]
+
+
+@case("mime_encode_stdlib", max_size=100_000)
+def mime_encode_stdlib_case(size: int) -> tuple[Runner, int]:
+    """Reference: ``MIMEText`` + ``as_bytes`` + base64url per message."""
+
+    import base64
+    from email.mime.text import MIMEText
+
+    messages = _mime_inputs(size)
+
+    def build(to_email: str, subject: str, body: str) -> str:
+        message = MIMEText(body, "plain", "utf-8")
+        message["to"] = to_email
+        message["subject"] = subject
+        return base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
+
+    def run() -> object:
+        return [build(*message) for message in messages]
+
+    return run, len(messages)
+
+
+@case("mime_encode_builder", max_size=100_000)
+def mime_encode_builder_case(size: int) -> tuple[Runner, int]:
+    """``RawMessageBuilder`` on one thread."""
+
+    from app.services.mime_builder import RawMessageBuilder
+
+    messages = _mime_inputs(size)
+    builder = RawMessageBuilder()
+
+    def run() -> object:
+        return builder.build_many(messages)
+
+    return run, len(messages)
+
+
+@case("mime_pre_encode_pool", max_size=100_000)
+def mime_pre_encode_pool_case(size: int) -> tuple[Runner, int]:
+    """``PreEncodedBatch`` over a warm two-process pool, awaiting every payload."""
+
+    import asyncio
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    from app.services.mime_builder import PreEncodedBatch
+
+    messages = _mime_inputs(size)
+    pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+    pool.submit(int).result()
+
+    async def encode_all() -> list[str]:
+        batch = PreEncodedBatch(messages, executor=pool)
+        return [await batch.raw(index) for index in range(len(messages))]
+
+    def run() -> object:
+        return asyncio.run(encode_all())
+
+    return run, len(messages)
+
+
+__all__ = ["CASES", "Case", "case"]
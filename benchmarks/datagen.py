@@ -0,0 +1,117 @@
+"""Synthetic data generators used by the benchmarks."""
+
+from __future__ import annotations
+
+import io
+import os
+import random
+import string
+import tempfile
+from pathlib import Path
+from typing import Iterator, List
+
+TITLES = ["Dr.", "Prof.", "Mr.", "Ms.", "Mx."]
+DOMAINS = ["nyu.edu", "example.com", "gmail.com", "mail.example.org", "uni.edu"]
+FERNET_KEY = "MDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDA="
+
+
+def configure_environment(workdir: Path) -> None:
+    """Provide the settings the services need, pointing storage at ``workdir``."""
+
+    os.environ.setdefault("BATCH_APP_SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("BATCH_APP_FERNET_KEY", FERNET_KEY)
+    os.environ["BATCH_APP_TOKEN_STORAGE_PATH"] = str(workdir / "token_store.json")
+
+
+def scratch_dir() -> Path:
+    return Path(tempfile.mkdtemp(prefix="bulkmailer-bench-"))
+
+
+def _name(rng: random.Random) -> str:
+    length = rng.randint(3, 10)
+    return rng.choice(string.ascii_uppercase) + "".join(rng.choices(string.ascii_lowercase, k=length))
+
+
+def recipient_rows(count: int, seed: int = 1) -> Iterator[tuple[str, str, str, str]]:
+    rng = random.Random(seed)
+    for index in range(count):
+        first = _name(rng)
+        last = _name(rng)
+        email = f"{first.lower()}.{last.lower()}{index}@{rng.choice(DOMAINS)}"
+        yield rng.choice(TITLES), first, last, email
+
+
+def recipients_csv(count: int, seed: int = 1) -> bytes:
+    buffer = io.StringIO()
+    buffer.write("title,first_name,last_name,email\n")
+    for row in recipient_rows(count, seed):
+        buffer.write(",".join(row))
+        buffer.write("\n")
+    return buffer.getvalue().encode("utf-8")
+
+
+def recipients(count: int, seed: int = 1) -> List["Recipient"]:  # noqa: F821
+    from app.models.domain import Recipient
+
+    return [
+        Recipient(title=title, first_name=first, last_name=last, email=email)
+        for title, first, last, email in recipient_rows(count, seed)
+    ]
+
+
+def template_body(paragraphs: int = 8, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    lines = ["Dear {{ title }} {{ last_name }},", ""]
+    for _ in range(paragraphs):
+        words = [_name(rng).lower() for _ in range(rng.randint(30, 60))]
+        lines.append(" ".join(words) + ".")
+        lines.append("")
+    lines.append("Best regards,")
+    lines.append("Student Services")
+    return "\n".join(lines)
+
+
+def large_docx(paragraphs: int = 5000, image_bytes: int = 2 * 1024 * 1024, seed: int = 1) -> bytes:
+    """Build a DOCX with many paragraphs and an embedded (incompressible) image."""
+
+    import struct
+    import zlib
+
+    from docx import Document
+
+    rng = random.Random(seed)
+    document = Document()
+    for index in range(paragraphs):
+        words = [_name(rng).lower() for _ in range(rng.randint(10, 40))]
+        document.add_paragraph(f"{index}. " + " ".join(words))
+
+    # A noise-filled PNG keeps the archive multi-megabyte like real templates
+    # with embedded pictures.
+    width = 512
+    height = max(image_bytes // (width * 3), 1)
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+    document.add_picture(io.BytesIO(png))
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+__all__ = [
+    "configure_environment",
+    "large_docx",
+    "recipient_rows",
+    "recipients",
+    "recipients_csv",
+    "scratch_dir",
+    "template_body",
+]
@@ -0,0 +1,4 @@
+"""Load-testing tools: a local Gmail API stand-in and a traffic generator.
+
+See ``loadtest/README.md``.
+"""
@@ -0,0 +1,162 @@
+"""Command line entry point: ``python -m loadtest``."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import httpx
+
+from loadtest.harness import format_report, run_load
+
+FERNET_KEY = "MDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDAwMDA="
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+@contextlib.contextmanager
+def spawn_stack(args: argparse.Namespace, workdir: Path) -> Iterator[tuple[str, str]]:
+    """Start the fake Gmail server and the app wired to it; yield their URLs."""
+
+    fake_port = _free_port()
+    app_port = _free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    fake_cmd = [
+        sys.executable,
+        "-m",
+        "loadtest.fake_gmail",
+        "--port",
+        str(fake_port),
+        "--latency-ms",
+        str(args.latency_ms),
+        "--jitter-ms",
+        str(args.jitter_ms),
+        "--error-rate",
+        str(args.error_rate),
+        "--throttle-rate",
+        str(args.throttle_rate),
+        "--per-second-quota",
+        str(args.per_second_quota),
+    ]
+    app_env = {
+        **os.environ,
+        "BATCH_APP_SECRET_KEY": "loadtest-secret",
+        "BATCH_APP_FERNET_KEY": FERNET_KEY,
+        "BATCH_APP_TOKEN_STORAGE_PATH": str(workdir / "token_store.json"),
+        "BATCH_APP_GOOGLE_AUTH_URI": f"{fake_url}/o/oauth2/auth",
+        "BATCH_APP_GOOGLE_TOKEN_URI": f"{fake_url}/token",
+        "BATCH_APP_GMAIL_API_BASE_URL": f"{fake_url}/",
+        "BATCH_APP_GOOGLE_REDIRECT_URI": f"{app_url}/auth/google/callback",
+    }
+    if args.send_workers:
+        app_env["BATCH_APP_SEND_MODE"] = "worker"
+        app_env["BATCH_APP_SEND_QUEUE_PATH"] = str(workdir / "send_queue.sqlite3")
+    app_cmd = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "app.main:app",
+        "--port",
+        str(app_port),
+        "--workers",
+        str(args.workers),
+        "--log-level",
+        "warning",
+    ]
+    processes = [
+        subprocess.Popen(fake_cmd),
+        subprocess.Popen(app_cmd, env=app_env),
+    ]
+    processes.extend(
+        subprocess.Popen([sys.executable, "-m", "app.worker"], env=app_env) for _ in range(args.send_workers)
+    )
+    try:
+        _wait_until_up(f"{fake_url}/_stats")
+        _wait_until_up(f"{app_url}/health")
+        yield app_url, fake_url
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the full upload -> template -> preview -> send flow.")
+    parser.add_argument("--app-url", help="Running app to target (requires --fake-url wiring on the app side)")
+    parser.add_argument("--fake-url", help="Fake Gmail server used by the app, for send statistics")
+    parser.add_argument("--spawn", action="store_true", help="Start the fake Gmail server and the app locally")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers when using --spawn")
+    parser.add_argument(
+        "--send-workers",
+        type=int,
+        default=0,
+        help="With --spawn, queue sends and start this many `python -m app.worker` processes",
+    )
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--recipients", type=int, default=50, help="Recipients per session")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--per-second-quota", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Also write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if not args.spawn and not args.app_url:
+        parser.error("pass --app-url or --spawn")
+
+    async def execute(app_url: str, fake_url: Optional[str]) -> dict:
+        return await run_load(
+            app_url,
+            fake_url,
+            args.sessions,
+            args.concurrency,
+            args.recipients,
+            wait_for_delivery=bool(args.send_workers),
+        )
+
+    if args.spawn:
+        import tempfile
+
+        with tempfile.TemporaryDirectory(prefix="bulkmailer-load-") as workdir:
+            with spawn_stack(args, Path(workdir)) as (app_url, fake_url):
+                report = asyncio.run(execute(app_url, fake_url))
+    else:
+        report = asyncio.run(execute(args.app_url, args.fake_url))
+
+    print(format_report(report))
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    return 1 if report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""Local stand-in for the Google OAuth and Gmail send endpoints.
+
+Implements just enough of the real APIs for the app to run its full flow
+against it:
+
+* ``GET /o/oauth2/auth`` immediately redirects back with a fake code.
+* ``POST /token`` handles ``authorization_code`` and ``refresh_token`` grants.
+* ``POST /gmail/v1/users/{userId}/messages/send`` (and the ``/upload`` variant).
+* ``POST /batch`` and ``/batch/gmail/v1`` multipart batch requests.
+* ``GET /_stats`` and ``POST /_reset`` for the load generator.
+
+Latency, random server errors, random 429s and a per-token per-second quota
+are configurable so throttling and retry behaviour can be exercised without
+touching real inboxes. Run with ``python -m loadtest.fake_gmail --port 8025``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import email
+import json
+import random
+import secrets
+import time
+from collections import defaultdict, deque
+from typing import Optional
+from urllib.parse import urlencode, urlsplit
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response
+from pydantic import BaseModel
+
+
+class FakeGmailConfig(BaseModel):
+    """Behaviour knobs for the fake server."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    per_second_quota: int = 0
+    token_lifetime_seconds: int = 3600
+    seed: Optional[int] = None
+
+
+class FakeGmailStats(BaseModel):
+    """Counters reported by ``GET /_stats``."""
+
+    sent: int = 0
+    errors: int = 0
+    throttled: int = 0
+    unauthorized: int = 0
+    batches: int = 0
+    codes_exchanged: int = 0
+    tokens_refreshed: int = 0
+
+
+def _google_error(status: int, message: str, reason: str) -> dict:
+    return {
+        "error": {
+            "code": status,
+            "message": message,
+            "errors": [{"message": message, "domain": "global", "reason": reason}],
+            "status": {429: "RESOURCE_EXHAUSTED", 401: "UNAUTHENTICATED"}.get(status, "INTERNAL"),
+        }
+    }
+
+
+class FakeGmailBackend:
+    """Shared state and send simulation used by the HTTP handlers."""
+
+    def __init__(self, config: FakeGmailConfig) -> None:
+        self.config = config
+        self.stats = FakeGmailStats()
+        self._random = random.Random(config.seed)
+        self._tokens: dict[str, float] = {}
+        self._refresh_tokens: set[str] = set()
+        self._windows: dict[str, deque[float]] = defaultdict(deque)
+
+    def issue_token(self) -> dict:
+        access_token = "fake-access-" + secrets.token_urlsafe(16)
+        self._tokens[access_token] = time.time() + self.config.token_lifetime_seconds
+        return {
+            "access_token": access_token,
+            "expires_in": self.config.token_lifetime_seconds,
+            "token_type": "Bearer",
+            "scope": "https://www.googleapis.com/auth/gmail.send",
+        }
+
+    def exchange_code(self) -> dict:
+        refresh_token = "fake-refresh-" + secrets.token_urlsafe(16)
+        self._refresh_tokens.add(refresh_token)
+        self.stats.codes_exchanged += 1
+        return {**self.issue_token(), "refresh_token": refresh_token}
+
+    def refresh(self, refresh_token: str) -> Optional[dict]:
+        if refresh_token not in self._refresh_tokens:
+            return None
+        self.stats.tokens_refreshed += 1
+        return self.issue_token()
+
+    def _authorized(self, authorization: Optional[str]) -> Optional[str]:
+        if not authorization or not authorization.lower().startswith("bearer "):
+            return None
+        token = authorization.split(" ", 1)[1].strip()
+        expires_at = self._tokens.get(token)
+        if expires_at is None or expires_at < time.time():
+            return None
+        return token
+
+    def _over_quota(self, token: str) -> bool:
+        quota = self.config.per_second_quota
+        if quota <= 0:
+            return False
+        now = time.monotonic()
+        window = self._windows[token]
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        if len(window) >= quota:
+            return True
+        window.append(now)
+        return False
+
+    async def send(self, authorization: Optional[str], payload: dict) -> tuple[int, dict, dict[str, str]]:
+        """Simulate ``messages.send``; returns status, JSON body and extra headers."""
+
+        delay = self.config.latency_ms + self._random.uniform(0, self.config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        token = self._authorized(authorization)
+        if token is None:
+            self.stats.unauthorized += 1
+            return 401, _google_error(401, "Invalid Credentials", "authError"), {}
+        if self._over_quota(token) or self._random.random() < self.config.throttle_rate:
+            self.stats.throttled += 1
+            error = _google_error(429, "User-rate limit exceeded.", "rateLimitExceeded")
+            return 429, error, {"Retry-After": "1"}
+        if self._random.random() < self.config.error_rate:
+            self.stats.errors += 1
+            return 500, _google_error(500, "Backend Error", "backendError"), {}
+        if not payload.get("raw"):
+            return 400, _google_error(400, "Invalid raw message", "invalidArgument"), {}
+
+        self.stats.sent += 1
+        message_id = secrets.token_hex(8)
+        return 200, {"id": message_id, "threadId": message_id, "labelIds": ["SENT"]}, {}
+
+
+def _parse_batch(content_type: str, body: bytes) -> list[tuple[str, str, dict[str, str], bytes]]:
+    """Split a multipart/mixed batch into (content_id, path, headers, body) parts."""
+
+    envelope = email.message_from_bytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    parts = []
+    for index, part in enumerate(envelope.get_payload() or []):
+        content_id = (part.get("Content-ID") or f"<item{index}>").strip("<>")
+        raw = part.get_payload(decode=False)
+        raw_bytes = raw.encode("utf-8") if isinstance(raw, str) else bytes(raw)
+        head, _, inner_body = raw_bytes.replace(b"\r\n", b"\n").partition(b"\n\n")
+        lines = head.decode("utf-8").split("\n")
+        _, target, *_ = lines[0].split(" ")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        parts.append((content_id, urlsplit(target).path, headers, inner_body.strip()))
+    return parts
+
+
+def create_fake_gmail_app(config: Optional[FakeGmailConfig] = None) -> FastAPI:
+    """Build the fake Google API application."""
+
+    backend = FakeGmailBackend(config or FakeGmailConfig())
+    app = FastAPI(title="Fake Gmail API")
+    app.state.backend = backend
+
+    @app.get("/o/oauth2/auth")
+    async def authorize(redirect_uri: str, state: str = "") -> RedirectResponse:
+        query = urlencode({"code": "fake-code-" + secrets.token_urlsafe(8), "state": state})
+        separator = "&" if "?" in redirect_uri else "?"
+        return RedirectResponse(f"{redirect_uri}{separator}{query}", status_code=302)
+
+    @app.post("/token")
+    async def token(request: Request) -> JSONResponse:
+        form = await request.form()
+        grant_type = form.get("grant_type")
+        if grant_type == "authorization_code" and form.get("code"):
+            return JSONResponse(backend.exchange_code())
+        if grant_type == "refresh_token":
+            refreshed = backend.refresh(str(form.get("refresh_token", "")))
+            if refreshed is not None:
+                return JSONResponse(refreshed)
+        return JSONResponse({"error": "invalid_grant"}, status_code=400)
+
+    async def send(request: Request) -> JSONResponse:
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = {}
+        status, body, headers = await backend.send(request.headers.get("authorization"), payload)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    app.add_api_route("/gmail/v1/users/{user_id}/messages/send", send, methods=["POST"])
+    app.add_api_route("/upload/gmail/v1/users/{user_id}/messages/send", send, methods=["POST"])
+
+    async def batch(request: Request) -> Response:
+        backend.stats.batches += 1
+        content_type = request.headers.get("content-type", "")
+        parts = _parse_batch(content_type, await request.body())
+        authorization = request.headers.get("authorization")
+
+        async def run(part: tuple[str, str, dict[str, str], bytes]) -> bytes:
+            content_id, path, headers, body = part
+            if path.endswith("/messages/send"):
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    payload = {}
+                status, result, _ = await backend.send(headers.get("authorization", authorization), payload)
+            else:
+                status, result = 404, _google_error(404, "Not Found", "notFound")
+            return (
+                f"Content-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(result)}\r\n"
+            ).encode("utf-8")
+
+        boundary = "batch_" + secrets.token_hex(8)
+        responses = await asyncio.gather(*(run(part) for part in parts))
+        body = b"".join(f"--{boundary}\r\n".encode() + item for item in responses) + f"--{boundary}--\r\n".encode()
+        return Response(body, media_type=f"multipart/mixed; boundary={boundary}")
+
+    app.add_api_route("/batch", batch, methods=["POST"])
+    app.add_api_route("/batch/gmail/v1", batch, methods=["POST"])
+
+    @app.get("/_stats")
+    async def stats() -> dict:
+        return backend.stats.model_dump()
+
+    @app.post("/_reset")
+    async def reset() -> dict:
+        backend.stats = FakeGmailStats()
+        return backend.stats.model_dump()
+
+    return app
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run a local fake Gmail API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of a random 429")
+    parser.add_argument("--per-second-quota", type=int, default=0, help="Sends per second per token; 0 = unlimited")
+    parser.add_argument("--token-lifetime", type=int, default=3600)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    config = FakeGmailConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        per_second_quota=args.per_second_quota,
+        token_lifetime_seconds=args.token_lifetime,
+        seed=args.seed,
+    )
+    uvicorn.run(create_fake_gmail_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+__all__ = ["FakeGmailConfig", "FakeGmailStats", "create_fake_gmail_app"]
+
+
+if __name__ == "__main__":
+    main()
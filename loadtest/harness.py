@@ -0,0 +1,187 @@
+"""Drive the full web flow with many concurrent sessions.
+
+Each simulated user connects Gmail (against the fake OAuth server), uploads a
+CSV, submits a template, loads the preview and sends. Per-step latencies are
+collected and summarised as percentiles together with overall throughput.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+
+CLIENT_ID = "123456789012-loadtest.apps.googleusercontent.com"
+CLIENT_SECRET = "GOCSPX-loadtest"
+SUBJECT = "Reminder for {{ first_name }}"
+BODY = "Dear {{ title }} {{ last_name }},\n\nThis is a load test message.\n\nBest,\nStudent Services"
+STEPS = ("connect", "upload", "template", "preview", "send")
+
+
+def recipients_csv(session: int, count: int) -> str:
+    rows = ["title,first_name,last_name,email"]
+    for index in range(count):
+        rows.append(f"Dr.,User{index},Session{session},user{index}.s{session}@loadtest.example.com")
+    return "\n".join(rows) + "\n"
+
+
+class SessionFailed(Exception):
+    """Raised when a simulated session gets an unexpected response."""
+
+
+def _expect(response: httpx.Response, *statuses: int) -> httpx.Response:
+    if response.status_code not in statuses:
+        raise SessionFailed(f"{response.request.method} {response.request.url.path} -> {response.status_code}")
+    return response
+
+
+async def run_session(
+    app_url: str,
+    session: int,
+    recipients: int,
+    timings: dict[str, list[float]],
+    timeout: float,
+) -> None:
+    async with httpx.AsyncClient(base_url=app_url, timeout=timeout) as app, httpx.AsyncClient(
+        timeout=timeout
+    ) as google:
+        started = time.perf_counter()
+        _expect(
+            await app.post("/credentials", data={"client_id": CLIENT_ID, "client_secret": CLIENT_SECRET}),
+            303,
+        )
+        consent = _expect(await app.get("/auth/google/start"), 302, 303, 307)
+        callback = _expect(await google.get(consent.headers["location"]), 302, 303, 307)
+        _expect(await app.get(callback.headers["location"]), 302, 303, 307)
+        timings["connect"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        _expect(
+            await app.post(
+                "/recipients",
+                files={"csv_file": ("recipients.csv", recipients_csv(session, recipients), "text/csv")},
+            ),
+            303,
+        )
+        timings["upload"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        _expect(await app.post("/template", data={"subject_text": SUBJECT, "body_text": BODY}), 303)
+        timings["template"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        _expect(await app.get("/preview"), 200)
+        timings["preview"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        _expect(await app.post("/send"), 303)
+        timings["send"].append(time.perf_counter() - started)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(timings: dict[str, list[float]]) -> dict[str, dict[str, float]]:
+    summary = {}
+    for step in STEPS:
+        values = timings.get(step, [])
+        summary[step] = {
+            "count": len(values),
+            "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p90_ms": percentile(values, 0.90) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": max(values) * 1000 if values else 0.0,
+        }
+    return summary
+
+
+async def run_load(
+    app_url: str,
+    fake_url: Optional[str],
+    sessions: int,
+    concurrency: int,
+    recipients: int,
+    timeout: float = 300.0,
+    wait_for_delivery: bool = False,
+) -> dict:
+    """Run ``sessions`` simulated users, at most ``concurrency`` at a time.
+
+    With ``wait_for_delivery`` (queued sends handled by workers) the run only
+    ends once the fake server has accepted every message, so throughput
+    covers delivery rather than just queueing.
+    """
+
+    timings: dict[str, list[float]] = defaultdict(list)
+    failures: list[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    if fake_url:
+        async with httpx.AsyncClient() as client:
+            await client.post(f"{fake_url}/_reset")
+
+    async def guarded(session: int) -> None:
+        async with semaphore:
+            try:
+                await run_session(app_url, session, recipients, timings, timeout)
+            except (SessionFailed, httpx.HTTPError) as exc:
+                failures.append(f"session {session}: {exc}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(guarded(session) for session in range(sessions)))
+
+    fake_stats: dict = {}
+    if fake_url:
+        expected = (sessions - len(failures)) * recipients
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while True:
+                fake_stats = (await client.get(f"{fake_url}/_stats")).json()
+                if not wait_for_delivery or fake_stats["sent"] >= expected or time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    completed = sessions - len(failures)
+    return {
+        "sessions": sessions,
+        "completed": completed,
+        "failures": failures,
+        "elapsed_s": elapsed,
+        "sessions_per_s": completed / elapsed if elapsed else 0.0,
+        "messages_per_s": fake_stats.get("sent", 0) / elapsed if elapsed else 0.0,
+        "steps": summarize(timings),
+        "fake_gmail": fake_stats,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"sessions: {report['completed']}/{report['sessions']} completed in {report['elapsed_s']:.2f}s",
+        f"throughput: {report['sessions_per_s']:.2f} sessions/s, {report['messages_per_s']:.1f} messages/s",
+        "",
+        f"{'step':<10} {'count':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10}",
+    ]
+    for step, row in report["steps"].items():
+        lines.append(
+            f"{step:<10} {row['count']:>6} {row['p50_ms']:>10.1f} {row['p90_ms']:>10.1f} "
+            f"{row['p99_ms']:>10.1f} {row['max_ms']:>10.1f}"
+        )
+    if report["fake_gmail"]:
+        lines.append("")
+        lines.append("fake gmail: " + ", ".join(f"{key}={value}" for key, value in report["fake_gmail"].items()))
+    for failure in report["failures"][:10]:
+        lines.append(f"FAILED {failure}")
+    return "\n".join(lines)
+
+
+__all__ = ["run_load", "run_session", "summarize", "format_report", "percentile"]
@@ -15,6 +15,8 @@ def _configure_env() -> None:
     os.environ.setdefault("BATCH_APP_GOOGLE_CLIENT_ID", "test-client-id")
     os.environ.setdefault("BATCH_APP_GOOGLE_CLIENT_SECRET", "test-client-secret")
     os.environ.setdefault("BATCH_APP_GOOGLE_REDIRECT_URI", "http://testserver/auth/google/callback")
+    # Let caplog see app records once create_app has configured logging.
+    os.environ.setdefault("BATCH_APP_LOG_PROPAGATE", "true")
 
 
 @pytest.fixture()
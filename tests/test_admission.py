@@ -0,0 +1,155 @@
+import asyncio
+import json
+import threading
+from typing import Generator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import get_settings
+from app.services.admission import Overloaded, WorkLimiter, get_work_limiter
+from app.services.csv_loader import RecipientBuilder, parse_recipient_records, parse_recipients
+from app.services.gmail import get_gmail_client
+from app.services.send_queue import get_send_queue
+from app.services.token_store import get_token_store
+
+_GETTERS = (get_settings, get_token_store, get_send_queue, get_work_limiter, get_gmail_client)
+
+
+@pytest.fixture()
+def api(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[TestClient, None, None]:
+    monkeypatch.setenv("BATCH_APP_TOKEN_STORAGE_PATH", str(tmp_path / "tokens.json"))
+    monkeypatch.setenv("BATCH_APP_SEND_QUEUE_PATH", str(tmp_path / "queue.sqlite3"))
+    monkeypatch.setenv("BATCH_APP_MAX_REQUEST_BYTES", "4096")
+    monkeypatch.setenv("BATCH_APP_MAX_BATCH_ROWS", "3")
+    for getter in _GETTERS:
+        getter.cache_clear()
+    from app.main import create_app
+
+    with TestClient(create_app()) as client:
+        token = client.post("/api/v1/token").json()["token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+    for getter in _GETTERS:
+        getter.cache_clear()
+
+
+def _record(index: int) -> dict[str, str]:
+    return {"title": "Dr.", "first_name": f"A{index}", "last_name": "B", "email": f"a{index}@example.com"}
+
+
+def test_limiter_refuses_when_saturated() -> None:
+    async def scenario() -> tuple[int, int]:
+        limiter = WorkLimiter(limit=1, wait_seconds=0.01, retry_after=7)
+        async with limiter.admit():
+            with pytest.raises(Overloaded) as refused:
+                async with limiter.admit():
+                    pass
+        async with limiter.admit():
+            pass
+        return refused.value.retry_after, limiter.in_use
+
+    assert asyncio.run(scenario()) == (7, 0)
+
+
+def test_limiter_hands_slot_to_next_waiter() -> None:
+    async def scenario() -> list[str]:
+        limiter = WorkLimiter(limit=1, wait_seconds=1.0, retry_after=1)
+        order: list[str] = []
+
+        async def work(name: str) -> None:
+            async with limiter.admit():
+                order.append(name)
+                await asyncio.sleep(0.001)
+
+        await asyncio.gather(work("a"), work("b"), work("c"))
+        assert (limiter.in_use, limiter.waiting) == (0, 0)
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b", "c"]
+
+
+def test_builder_stops_at_row_limit() -> None:
+    builder = RecipientBuilder(max_rows=2)
+    builder.add_record(_record(1), 1)
+    builder.add_record({"email": "broken"}, 2)
+    with pytest.raises(Overloaded) as refused:
+        builder.add_record(_record(3), 3)
+    assert refused.value.status_code == 413
+
+
+def test_oversized_body_is_refused(api: TestClient) -> None:
+    body = json.dumps([_record(1)] * 200)
+    response = api.put("/api/v1/recipients", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 413
+
+
+def test_oversized_chunked_body_is_refused(api: TestClient) -> None:
+    def chunks():
+        for index in range(100):
+            yield (json.dumps(_record(index)) + "\n").encode()
+
+    response = api.put("/api/v1/recipients", content=chunks(), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 413
+
+
+def test_too_many_rows_is_refused(api: TestClient) -> None:
+    response = api.put("/api/v1/recipients", json=[_record(index) for index in range(4)])
+    assert response.status_code == 413
+    assert parse_recipient_records([_record(index) for index in range(3)]).errors == []
+
+
+def test_ready_reports_load(api: TestClient) -> None:
+    response = api.get("/ready")
+    assert response.status_code == 200
+    report = response.json()
+    assert report["status"] == "ready"
+    assert report["work"]["limit"] == get_settings().max_concurrent_work
+
+
+def test_full_send_backlog_is_refused_with_retry_after(api: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("app.services.admission._queue_backlog", lambda: get_settings().max_queued_sends)
+    response = api.get("/ready")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(get_settings().overload_retry_after_seconds)
+
+    api.put("/api/v1/recipients", json=[_record(1)])
+    api.put("/api/v1/template", json={"subject": "Hi", "body": "Body"})
+    from app.services.sender_pool import SenderPool
+
+    async def connected(cls, client, session_id):
+        return object()
+
+    monkeypatch.setattr(SenderPool, "connect", classmethod(connected))
+    response = api.post("/api/v1/send")
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+
+
+def test_web_upload_is_parsed_off_the_event_loop(api: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    from app.api import routes
+
+    threads = []
+
+    def parse(file):
+        threads.append(threading.current_thread().name)
+        return parse_recipients(file)
+
+    monkeypatch.setattr(routes, "parse_recipients", parse)
+    csv_payload = "title,first_name,last_name,email\nDr.,Ada,Lovelace,ada@example.com\n"
+    response = api.post("/recipients", files={"csv_file": ("r.csv", csv_payload, "text/csv")}, follow_redirects=False)
+    assert response.status_code == 303
+    assert threads and threads[0].startswith("asyncio_")
+
+
+def test_ndjson_body_is_read_without_holding_a_work_slot(api: TestClient) -> None:
+    slots_in_use = []
+
+    def chunks():
+        for index in range(3):
+            slots_in_use.append(get_work_limiter().in_use)
+            yield (json.dumps(_record(index)) + "\n").encode()
+
+    response = api.put("/api/v1/recipients", content=chunks(), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert slots_in_use == [0, 0, 0]
@@ -0,0 +1,19 @@
+from benchmarks.__main__ import compare
+
+
+def test_compare_flags_regressions_beyond_threshold() -> None:
+    baseline = {
+        "parse_recipients[1000]": {"median_s": 0.10},
+        "render_batch[1000]": {"median_s": 0.20},
+    }
+    results = {
+        "parse_recipients[1000]": {"median_s": 0.11},
+        "render_batch[1000]": {"median_s": 0.30},
+        "render_email": {"median_s": 0.05},
+    }
+
+    rows = {row["benchmark"]: row for row in compare(results, baseline, threshold=0.25)}
+
+    assert set(rows) == {"parse_recipients[1000]", "render_batch[1000]"}
+    assert rows["parse_recipients[1000]"]["regression"] is False
+    assert rows["render_batch[1000]"]["regression"] is True
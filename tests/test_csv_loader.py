@@ -29,3 +29,48 @@ def test_parse_recipients_missing_column() -> None:
         assert "Missing required columns" in str(exc)
     else:
         raise AssertionError("Expected CSVParsingError")
+
+
+def test_extra_columns_are_kept_column_wise() -> None:
+    csv_content = (
+        "Title,First Name,Last Name,Email,Company Name\n"
+        "Dr.,Ada,Lovelace,ada@example.com,Analytical Engines\n"
+        "Dr.,Charles,Babbage,charles@example.com,Analytical Engines\n"
+    )
+    result = parse_recipients(make_upload(csv_content))
+    table = result.recipients
+    assert table.columns == ("title", "first_name", "last_name", "email", "company_name")
+    assert table.row(1)["company_name"] == "Analytical Engines"
+    # Repeated values share one string object.
+    assert table.column("company_name")[0] is table.column("company_name")[1]
+    assert [recipient.first_name for recipient in table] == ["Ada", "Charles"]
+
+
+def test_duplicate_columns_are_rejected() -> None:
+    csv_content = "title,first_name,last_name,email,Team,team\nDr.,Ada,Lovelace,ada@example.com,a,b\n"
+    try:
+        parse_recipients(make_upload(csv_content))
+    except CSVParsingError as exc:
+        assert "Duplicate columns: team" in str(exc)
+    else:
+        raise AssertionError("Expected CSVParsingError")
+
+
+def test_repeated_values_are_shared_only_within_mostly_repeating_columns() -> None:
+    from app.models.domain import RecipientTable
+
+    table = RecipientTable()
+    for index in range(3000):
+        table.append(
+            {
+                "title": "".join(["D", "r."]),
+                "first_name": "Ada",
+                "last_name": "Lovelace",
+                "email": f"user{index}@example.com",
+            }
+        )
+    titles = table.column("title")
+    assert titles[0] is titles[-1]
+    assert table._pools["title"] is not None
+    # Unique emails stop being pooled once the sample shows they do not repeat.
+    assert table._pools["email"] is None
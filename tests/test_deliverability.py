@@ -0,0 +1,153 @@
+import asyncio
+import socket
+import threading
+import time
+from collections import Counter
+from typing import Generator, Optional
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import get_settings
+from app.services.deliverability import (
+    DomainCheckCache,
+    DomainPrechecker,
+    MXResolver,
+    get_domain_prechecker,
+    suggest_domain,
+)
+from app.services.send_queue import SendQueue, get_send_queue
+from app.services.store import get_store
+
+# name -> {rdtype: [rdata, ...]}; unknown names get NXDOMAIN, DROP never answers.
+Zone = dict[str, Optional[dict[str, list[str]]]]
+DROP = None
+
+ZONE: Zone = {
+    "example.com": {"MX": ["10 mx.example.com."]},
+    "nomail.org": {"MX": ["0 ."]},
+    "a-only.net": {"A": ["192.0.2.1"]},
+    "hotmial.com": {"MX": ["10 mx.hotmial.com."]},
+    "slow.example": DROP,
+}
+
+
+class StubDNS:
+    """A UDP DNS server answering from a fixed zone, counting queries."""
+
+    def __init__(self, zone: Zone) -> None:
+        self.zone = zone
+        self.queries: Counter[tuple[str, str]] = Counter()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.port = self.socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                data, address = self.socket.recvfrom(4096)
+            except OSError:
+                return
+            query = dns.message.from_wire(data)
+            question = query.question[0]
+            name = question.name.to_text(omit_final_dot=True)
+            rdtype = dns.rdatatype.to_text(question.rdtype)
+            self.queries[(name, rdtype)] += 1
+            if name in self.zone and self.zone[name] is DROP:
+                continue
+            response = dns.message.make_response(query)
+            records = self.zone.get(name)
+            if records is None:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            elif rdtype in records:
+                response.answer.append(dns.rrset.from_text_list(question.name, 300, "IN", rdtype, records[rdtype]))
+            self.socket.sendto(response.to_wire(), address)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+@pytest.fixture()
+def stub_dns() -> Generator[StubDNS, None, None]:
+    server = StubDNS(dict(ZONE))
+    yield server
+    server.close()
+
+
+def _prechecker(server: StubDNS, queue: SendQueue) -> DomainPrechecker:
+    resolver = MXResolver(["127.0.0.1"], port=server.port, timeout=0.5)
+    return DomainPrechecker(resolver, DomainCheckCache(queue), concurrency=64)
+
+
+def test_domains_are_classified_and_typos_suggested(stub_dns: StubDNS, tmp_path) -> None:
+    prechecker = _prechecker(stub_dns, SendQueue(tmp_path / "queue.sqlite3"))
+    domains = ["example.com", "gmial.com", "nomail.org", "a-only.net", "hotmial.com", "slow.example"]
+    checks = asyncio.run(prechecker.check(domains))
+
+    assert {domain: check.status for domain, check in checks.items()} == {
+        "example.com": "deliverable",
+        "gmial.com": "no_domain",
+        "nomail.org": "no_mail",
+        "a-only.net": "deliverable",
+        "hotmial.com": "deliverable",
+        "slow.example": "unknown",
+    }
+    assert checks["gmial.com"].problem == "domain does not exist; did you mean gmail.com?"
+    assert checks["hotmial.com"].problem == "possible typo, did you mean hotmail.com?"
+    assert checks["example.com"].problem is None and checks["slow.example"].problem is None
+    assert suggest_domain("gmail.com") is None and suggest_domain("gmail.con") == "gmail.com"
+    assert suggest_domain("yhaoo.com") == "yahoo.com" and suggest_domain("ms.com") is None
+
+
+def test_each_unique_domain_is_resolved_once_then_cached(stub_dns: StubDNS, tmp_path) -> None:
+    for index in range(500):
+        stub_dns.zone[f"d{index}.example"] = {"MX": [f"10 mx.d{index}.example."]}
+    recipients = [f"d{index % 500}.example" for index in range(20_000)] + ["slow.example"]
+    queue = SendQueue(tmp_path / "queue.sqlite3")
+
+    started = time.perf_counter()
+    checks = asyncio.run(_prechecker(stub_dns, queue).check(recipients))
+    assert time.perf_counter() - started < 5
+    assert len(checks) == 501
+    assert all(count == 1 for count in stub_dns.queries.values())
+
+    # A new prechecker (another process, a later upload) reuses the cache;
+    # only the lookup that timed out is asked again.
+    stub_dns.queries.clear()
+    asyncio.run(_prechecker(stub_dns, queue).check(recipients))
+    assert set(stub_dns.queries) == {("slow.example", "MX")}
+
+
+def test_upload_flags_domains_and_suspends_their_messages(
+    client: TestClient, stub_dns: StubDNS, monkeypatch: pytest.MonkeyPatch, tmp_path
+) -> None:
+    monkeypatch.setenv("BATCH_APP_DOMAIN_PRECHECK_ENABLED", "true")
+    monkeypatch.setenv("BATCH_APP_DOMAIN_PRECHECK_NAMESERVERS", '["127.0.0.1"]')
+    monkeypatch.setenv("BATCH_APP_DOMAIN_PRECHECK_PORT", str(stub_dns.port))
+    monkeypatch.setenv("BATCH_APP_SEND_QUEUE_PATH", str(tmp_path / "queue.sqlite3"))
+    getters = (get_settings, get_send_queue, get_domain_prechecker, get_store)
+    for getter in getters:
+        getter.cache_clear()
+    try:
+        csv_payload = (
+            "title,first_name,last_name,email\n"
+            "Dr.,Ada,Lovelace,ada@example.com\n"
+            "Dr.,Alan,Turing,alan@gmial.com\n"
+        )
+        client.post("/recipients", files={"csv_file": ("recipients.csv", csv_payload, "text/csv")})
+        page = client.get("/recipients")
+        assert "gmial.com: domain does not exist; did you mean gmail.com?" in page.text
+
+        client.post("/template", data={"subject_text": "Hi", "body_text": "Hello"})
+        ((_, state),) = get_store()._data.values()
+        assert [message.approved for message in state.messages] == [True, False]
+        assert state.messages[1].error_message == "gmial.com: domain does not exist; did you mean gmail.com?"
+    finally:
+        for getter in getters:
+            getter.cache_clear()
@@ -0,0 +1,78 @@
+import io
+import zipfile
+
+import pytest
+
+from app.services.docx_loader import DocxProcessingError, extract_plain_text, get_docx_cache, read_docx_text
+
+
+def _python_docx_text(data: bytes) -> str:
+    from docx import Document
+
+    document = Document(io.BytesIO(data))
+    return "\n".join(filter(None, [paragraph.text.strip() for paragraph in document.paragraphs])).strip()
+
+
+def _sample_docx() -> bytes:
+    from docx import Document
+    from docx.enum.text import WD_BREAK
+
+    document = Document()
+    document.add_paragraph("  Dear {{ first_name }},  ")
+    paragraph = document.add_paragraph("Tabs\tand")
+    paragraph.add_run().add_break()
+    paragraph.add_run("line breaks")
+    paragraph.add_run().add_break(WD_BREAK.PAGE)
+    paragraph.add_run(" & <entities>")
+    document.add_paragraph("")
+    table = document.add_table(rows=1, cols=1)
+    table.cell(0, 0).text = "Inside a table"
+    document.add_paragraph("Closing ünïcode line")
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return _with_extra_markup(buffer.getvalue())
+
+
+def _with_extra_markup(data: bytes) -> bytes:
+    """Add a hyperlink, a tracked insertion and a no-break hyphen to the first paragraph."""
+
+    source = zipfile.ZipFile(io.BytesIO(data))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            payload = source.read(item.filename)
+            if item.filename == "word/document.xml":
+                payload = payload.replace(
+                    b"</w:t></w:r></w:p>",
+                    b"</w:t></w:r><w:hyperlink><w:r><w:t>link</w:t></w:r></w:hyperlink>"
+                    b"<w:ins><w:r><w:t>inserted</w:t></w:r></w:ins>"
+                    b"<w:r><w:noBreakHyphen/><w:cr/><w:t>end</w:t></w:r></w:p>",
+                    1,
+                )
+            target.writestr(item, payload)
+    return output.getvalue()
+
+
+def test_output_matches_python_docx() -> None:
+    data = _sample_docx()
+    expected = _python_docx_text(data)
+    assert "link" in expected and "Inside a table" not in expected
+    assert read_docx_text(data) == expected
+
+
+def test_results_are_cached_by_content_hash() -> None:
+    data = _sample_docx()
+    cache = get_docx_cache()
+    cache.clear()
+    first = extract_plain_text(data)
+    assert extract_plain_text(bytes(data)) is first
+
+
+def test_invalid_archives_are_rejected() -> None:
+    with pytest.raises(DocxProcessingError):
+        extract_plain_text(b"not a zip file")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/other.xml", "<x/>")
+    with pytest.raises(DocxProcessingError):
+        read_docx_text(buffer.getvalue())
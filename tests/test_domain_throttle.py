@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app.models.domain import BatchState, Recipient, RenderedEmail, email_domain
+from app.services import batch_sending
+from app.services.csv_loader import parse_recipient_records
+from app.services.domain_throttle import DomainThrottle, interleave_by_domain
+
+
+def test_domains_are_normalised_once_at_parse_time() -> None:
+    assert email_domain("Ada@Mail.Example.EDU.") == "mail.example.edu"
+    assert email_domain("user@bücher.de") == "xn--bcher-kva.de"
+
+    result = parse_recipient_records(
+        [{"title": "Dr.", "first_name": "A", "last_name": "B", "email": f"a{index}@Uni.Example.edu"} for index in range(3)]
+    )
+    table = result.recipients
+    assert [table.domain(index) for index in range(3)] == ["uni.example.edu"] * 3
+    # One shared string for every row of the same domain.
+    assert len({id(table.domain(index)) for index in range(3)}) == 1
+    assert table[0].domain == "uni.example.edu"
+
+
+def test_interleave_alternates_domains() -> None:
+    emails = ["a1@a", "a2@a", "a3@a", "b1@b", "c1@c", "c2@c"]
+    ordered = interleave_by_domain(emails, email_domain)
+    assert ordered == ["a1@a", "b1@b", "c1@c", "a2@a", "c2@c", "a3@a"]
+
+
+def test_concurrency_is_capped_per_domain_only() -> None:
+    async def scenario() -> dict[str, int]:
+        throttle = DomainThrottle(concurrency=2, rate=0, burst=1)
+        peaks: dict[str, int] = {}
+
+        async def send(domain: str) -> None:
+            async with throttle.slot(domain):
+                peaks[domain] = max(peaks.get(domain, 0), throttle.in_flight(domain))
+                await asyncio.sleep(0.001)
+
+        await asyncio.gather(*(send("uni.edu") for _ in range(10)), *(send("other.org") for _ in range(3)))
+        assert throttle.in_flight("uni.edu") == 0
+        return peaks
+
+    assert asyncio.run(scenario()) == {"uni.edu": 2, "other.org": 2}
+
+
+def test_rate_overrides_cover_subdomains() -> None:
+    throttle = DomainThrottle(concurrency=1, rate=10, burst=1, rates={"Example.EDU": 1})
+    assert throttle.rate_for("mail.example.edu") == 1
+    assert throttle.rate_for("example.com") == 10
+
+
+def test_inline_send_interleaves_domains(monkeypatch: pytest.MonkeyPatch) -> None:
+    order: list[str] = []
+
+    class Senders:
+        async def send_raw(self, raw_message: str) -> dict:
+            return {"id": "abc"}
+
+    async def record(senders, to_email, subject, body, raw=None, domain=None):
+        order.append(domain)
+        return ("sent", None, None)
+
+    emails = ["a@uni.edu", "b@uni.edu", "c@uni.edu", "d@other.org"]
+    state = BatchState(
+        messages=[
+            RenderedEmail(
+                recipient=Recipient(title="Dr.", first_name="A", last_name="B", email=email), subject="Hi", body="Body"
+            )
+            for email in emails
+        ]
+    )
+    monkeypatch.setattr(batch_sending, "deliver", record)
+    asyncio.run(batch_sending.send_inline("session", Senders(), state))  # type: ignore[arg-type]
+    assert order[:2] == ["uni.edu", "other.org"]
+    assert [message.status for message in state.messages] == ["sent"] * 4
@@ -0,0 +1,85 @@
+import base64
+import io
+import mailbox
+import zipfile
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+from app.models.domain import Recipient, RenderedEmail
+from app.services import exporter
+from app.services.exporter import select_messages, stream_eml_zip, stream_mbox
+from app.services.mime_builder import get_builder
+
+
+def _messages(count: int) -> list[RenderedEmail]:
+    return [
+        RenderedEmail(
+            recipient=Recipient(title="Dr.", first_name="Ada", last_name="Lee", email=f"user{index}@example.com"),
+            subject=f"Hello {index} ünïcode",
+            body=f"Body {index}\nFrom here on",
+            approved=index % 2 == 0,
+            status="sent" if index % 3 == 0 else "pending",
+            sent_at=datetime(2030, 1, 2, 3, 4, 5) if index % 3 == 0 else None,
+        )
+        for index in range(count)
+    ]
+
+
+def test_zip_export_contains_the_sent_bytes() -> None:
+    messages = _messages(5)
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_eml_zip(select_messages(messages)))))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    assert names[0] == "000001-user0@example.com.eml"
+    raw = get_builder().build(messages[4].recipient.email, messages[4].subject, messages[4].body)
+    assert archive.read(names[4]) == base64.urlsafe_b64decode(raw)
+    assert archive.getinfo(names[0]).date_time == (2030, 1, 2, 3, 4, 4)
+
+
+def test_filters_and_mbox(tmp_path) -> None:
+    messages = _messages(6)
+    selected = list(select_messages(messages, statuses={"sent"}, approved=True))
+    assert [index for index, _ in selected] == [0]
+
+    path = tmp_path / "batch.mbox"
+    path.write_bytes(b"".join(stream_mbox(select_messages(messages, approved=False))))
+    parsed = list(mailbox.mbox(str(path)))
+    assert [message["to"] for message in parsed] == ["user1@example.com", "user3@example.com", "user5@example.com"]
+    assert parsed[1].get_payload(decode=True) == b"Body 3\nFrom here on"
+
+
+def test_zip64_records_are_readable(monkeypatch) -> None:
+    monkeypatch.setattr(exporter, "_ZIP16_LIMIT", 2)
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_eml_zip(select_messages(_messages(3))))))
+    assert len(archive.namelist()) == 3
+    assert archive.testzip() is None
+
+
+def test_unencodable_messages_are_left_out(tmp_path) -> None:
+    messages = _messages(3)
+    messages[1].subject = "Hi\nBcc: eve@example.com"
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_eml_zip(select_messages(messages)))))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    assert names == ["000001-user0@example.com.eml", "000003-user2@example.com.eml", exporter.ERRORS_NAME]
+    assert archive.read(exporter.ERRORS_NAME).startswith(b"2\tuser1@example.com\t")
+
+    path = tmp_path / "batch.mbox"
+    path.write_bytes(b"".join(stream_mbox(select_messages(messages))))
+    assert [message["to"] for message in mailbox.mbox(str(path))] == ["user0@example.com", "user2@example.com"]
+
+
+def test_export_route_streams_a_download(client: TestClient) -> None:
+    client.post(
+        "/recipients",
+        files={"csv_file": ("r.csv", "title,first_name,last_name,email\nDr.,Ada,Lee,ada@example.com\n", "text/csv")},
+    )
+    client.post("/template", data={"subject_text": "Hi {{ first_name }}", "body_text": "Body"})
+    response = client.get("/export/eml", params={"status": "", "approved": "true"})
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="batch.zip"'
+    assert zipfile.ZipFile(io.BytesIO(response.content)).namelist() == ["000001-ada@example.com.eml"]
+    assert client.get("/export/mbox", params={"status": "sent"}).content == b""
+    assert client.get("/export/pdf").status_code == 404
@@ -0,0 +1,119 @@
+import asyncio
+
+from app.services.fair_share import DeficitRoundRobin, FairSendGate, allocate_claims
+from app.services.send_queue import SendQueue
+
+
+def _drain(queue: DeficitRoundRobin[str], **kwargs) -> list[str]:
+    served = []
+    while (popped := queue.pop(**kwargs)) is not None:
+        served.append(popped[1])
+    return served
+
+
+def test_late_tenant_is_interleaved_not_queued_behind() -> None:
+    queue: DeficitRoundRobin[str] = DeficitRoundRobin()
+    for index in range(50):
+        queue.push("big", f"big{index}")
+    for index in range(3):
+        queue.push("small", f"small{index}")
+
+    served = _drain(queue)
+    assert served[:6] == ["big0", "small0", "big1", "small1", "big2", "small2"]
+    assert len(served) == 53 and len(queue) == 0
+
+
+def test_shares_follow_cost_not_item_count() -> None:
+    queue: DeficitRoundRobin[str] = DeficitRoundRobin(quantum=4)
+    for index in range(6):
+        queue.push("large-messages", f"L{index}", cost=4)
+        queue.push("small-messages", f"s{index}", cost=1)
+        queue.push("small-messages", f"s{index}b", cost=1)
+
+    served = _drain(queue)[:6]
+    assert served == ["L0", "s0", "s0b", "s1", "s1b", "L1"]
+
+
+def test_ineligible_tenants_are_skipped_without_losing_their_place() -> None:
+    queue: DeficitRoundRobin[str] = DeficitRoundRobin()
+    queue.push("a", "a0")
+    queue.push("b", "b0")
+    assert queue.pop(eligible=lambda tenant: tenant != "a") == ("b", "b0")
+    assert queue.pop(eligible=lambda tenant: tenant != "a") is None
+    assert queue.pop() == ("a", "a0")
+
+
+def test_gate_caps_tenants_and_serves_small_batches_first() -> None:
+    started: list[str] = []
+
+    async def scenario() -> int:
+        gate = FairSendGate(concurrency=2, tenant_concurrency=1)
+        peak = 0
+
+        async def send(tenant: str, priority: bool) -> None:
+            nonlocal peak
+            async with gate.slot(tenant, priority=priority):
+                started.append(tenant)
+                peak = max(peak, gate.running)
+                await asyncio.sleep(0.001)
+
+        big = [asyncio.create_task(send("big", False)) for _ in range(5)]
+        await asyncio.sleep(0)
+        small = [asyncio.create_task(send("small", True)) for _ in range(2)]
+        await asyncio.gather(*big, *small)
+        return peak
+
+    peak = asyncio.run(scenario())
+    # "big" never holds more than its one slot, so "small" starts as soon
+    # as it arrives and finishes before most of the big batch.
+    assert peak == 2
+    assert started.index("small") == 1
+    assert started[:4].count("small") == 2
+
+
+def test_cancelled_waiter_does_not_leak_a_slot() -> None:
+    async def scenario() -> FairSendGate:
+        gate = FairSendGate(concurrency=1, tenant_concurrency=1)
+        release = asyncio.Event()
+
+        async def hold() -> None:
+            async with gate.slot("a"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await holder
+        await asyncio.gather(waiter, return_exceptions=True)
+        async with gate.slot("b"):
+            pass
+        return gate
+
+    gate = asyncio.run(scenario())
+    assert (gate.running, gate.waiting) == (0, 0)
+
+
+def test_allocation_respects_in_flight_caps() -> None:
+    backlog = [("s1", "b1", 100, False), ("s2", "b2", 100, False)]
+    allocation = allocate_claims(backlog, slots=8, in_flight={"s1": 3}, tenant_cap=4)
+    assert sorted(allocation) == [("s1", "b1", 1), ("s2", "b2", 4)]
+
+
+def test_queue_claims_share_between_sessions(tmp_path) -> None:
+    queue = SendQueue(tmp_path / "queue.sqlite3", session_concurrency=3, small_batch_max=5)
+    queue.enqueue("bulk", "big", [(index, f"u{index}@example.com", "S", "B") for index in range(100)])
+    queue.enqueue("colleague", "short", [(index, f"c{index}@example.com", "S", "B") for index in range(4)])
+
+    first = queue.claim("worker-a", limit=4, lease_seconds=30)
+    assert [job.session_id for job in first] == ["colleague"] * 3 + ["bulk"]
+
+    # Both sessions are now capped at three leased jobs.
+    second = queue.claim("worker-b", limit=4, lease_seconds=30)
+    assert [job.session_id for job in second] == ["bulk", "bulk"]
+
+    queue.complete(first[0].id, "worker-a", "sent")
+    third = queue.claim("worker-b", limit=4, lease_seconds=30)
+    assert [job.session_id for job in third] == ["colleague"]
@@ -0,0 +1,60 @@
+from fastapi.testclient import TestClient
+
+from loadtest.fake_gmail import FakeGmailConfig, create_fake_gmail_app
+
+
+def _access_token(client: TestClient) -> str:
+    response = client.post("/token", data={"grant_type": "authorization_code", "code": "abc"})
+    assert response.status_code == 200
+    return response.json()["access_token"]
+
+
+def test_send_requires_token_and_accepts_raw_message() -> None:
+    client = TestClient(create_fake_gmail_app())
+    url = "/gmail/v1/users/me/messages/send"
+
+    assert client.post(url, json={"raw": "eA"}).status_code == 401
+
+    token = _access_token(client)
+    response = client.post(url, json={"raw": "eA"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json()["labelIds"] == ["SENT"]
+    assert client.get("/_stats").json()["sent"] == 1
+
+
+def test_quota_exhaustion_returns_429_with_retry_after() -> None:
+    client = TestClient(create_fake_gmail_app(FakeGmailConfig(per_second_quota=1)))
+    headers = {"Authorization": f"Bearer {_access_token(client)}"}
+    url = "/gmail/v1/users/me/messages/send"
+
+    assert client.post(url, json={"raw": "eA"}, headers=headers).status_code == 200
+    throttled = client.post(url, json={"raw": "eA"}, headers=headers)
+    assert throttled.status_code == 429
+    assert throttled.headers["retry-after"] == "1"
+    assert throttled.json()["error"]["errors"][0]["reason"] == "rateLimitExceeded"
+
+
+def test_batch_endpoint_answers_each_part() -> None:
+    client = TestClient(create_fake_gmail_app())
+    token = _access_token(client)
+    parts = []
+    for index in range(2):
+        parts.append(
+            "--BOUNDARY\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <item{index}>\r\n\r\n"
+            "POST /gmail/v1/users/me/messages/send?alt=json HTTP/1.1\r\n"
+            "Content-Type: application/json\r\n"
+            f"Authorization: Bearer {token}\r\n\r\n"
+            '{"raw": "eA"}\r\n'
+        )
+    body = "".join(parts) + "--BOUNDARY--\r\n"
+
+    response = client.post(
+        "/batch/gmail/v1",
+        content=body,
+        headers={"Content-Type": "multipart/mixed; boundary=BOUNDARY"},
+    )
+
+    assert response.status_code == 200
+    assert response.text.count("HTTP/1.1 200 OK") == 2
+    assert "<response-item1>" in response.text
@@ -0,0 +1,147 @@
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+from email import message_from_bytes
+from typing import Generator
+
+import httpx
+import pytest
+from google.oauth2.credentials import Credentials
+
+from app.config import get_settings
+from app.services.gmail import GmailClient, GmailSendError
+from app.services.token_store import get_token_store
+
+
+@pytest.fixture()
+def isolated_token_store(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[None, None, None]:
+    monkeypatch.setenv("BATCH_APP_TOKEN_STORAGE_PATH", str(tmp_path / "tokens.json"))
+    monkeypatch.setenv("BATCH_APP_GMAIL_MAX_RETRIES", "1")
+    get_settings.cache_clear()
+    get_token_store.cache_clear()
+    yield
+    get_settings.cache_clear()
+    get_token_store.cache_clear()
+
+
+def test_send_message_posts_raw_mime(isolated_token_store: None) -> None:
+    captured: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        captured.append(request)
+        return httpx.Response(200, json={"id": "abc"})
+
+    async def scenario() -> dict:
+        client = GmailClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.send_message(Credentials(token="t0k"), "ada@example.com", "Hi", "Body")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) == {"id": "abc"}
+    request = captured[0]
+    assert request.url.path == "/gmail/v1/users/me/messages/send"
+    assert request.headers["authorization"] == "Bearer t0k"
+    raw = json.loads(request.content)["raw"]
+    message = message_from_bytes(base64.urlsafe_b64decode(raw))
+    assert message["to"] == "ada@example.com"
+    assert message.get_payload(decode=True) == b"Body"
+
+
+def test_concurrent_get_credentials_refreshes_once(isolated_token_store: None) -> None:
+    refreshes = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal refreshes
+        refreshes += 1
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"access_token": "fresh", "expires_in": 3600})
+
+    get_token_store().save_credentials(
+        "session-1",
+        Credentials(
+            token="stale",
+            refresh_token="refresh",
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id="cid",
+            client_secret="secret",
+            expiry=datetime.utcnow() - timedelta(minutes=5),
+        ),
+    )
+
+    async def scenario() -> list[Credentials]:
+        client = GmailClient(transport=httpx.MockTransport(handler))
+        try:
+            results = await asyncio.gather(*(client.get_credentials("session-1") for _ in range(5)))
+            # Refresh locks are dropped once no caller needs them.
+            assert client._refresh_locks == {}
+            return results
+        finally:
+            await client.aclose()
+
+    results = asyncio.run(scenario())
+    assert refreshes == 1
+    assert {credentials.token for credentials in results} == {"fresh"}
+    assert get_token_store().load_credentials("session-1").refresh_token == "refresh"
+
+
+def test_send_retries_throttled_requests_then_raises(isolated_token_store: None) -> None:
+    calls = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal calls
+        calls += 1
+        return httpx.Response(
+            429,
+            json={"error": {"message": "User-rate limit exceeded."}},
+            headers={"Retry-After": "0"},
+        )
+
+    async def scenario() -> None:
+        client = GmailClient(transport=httpx.MockTransport(handler))
+        try:
+            await client.send_message(Credentials(token="t"), "ada@example.com", "Hi", "Body")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(GmailSendError) as excinfo:
+        asyncio.run(scenario())
+    assert excinfo.value.throttled
+    assert calls == 2
+
+
+def test_send_does_not_retry_server_errors_and_caps_retry_after(
+    isolated_token_store: None, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("BATCH_APP_GMAIL_MAX_RETRY_AFTER_SECONDS", "0.01")
+    monkeypatch.setenv("BATCH_APP_GMAIL_MAX_RETRIES", "5")
+    get_settings.cache_clear()
+    responses = [
+        httpx.ConnectError("refused"),
+        httpx.Response(429, json={"error": {"message": "Slow down."}}, headers={"Retry-After": "3600"}),
+        httpx.Response(503, json={"error": {"message": "Backend error."}}),
+    ]
+    calls = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal calls
+        calls += 1
+        response = responses[calls - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def scenario() -> None:
+        client = GmailClient(transport=httpx.MockTransport(handler))
+        try:
+            await asyncio.wait_for(client.send_message(Credentials(token="t"), "ada@example.com", "Hi", "Body"), 5)
+        finally:
+            await client.aclose()
+
+    # The refused connection and the 429 are retried, the 503 is not: Gmail
+    # may already have sent the message.
+    with pytest.raises(GmailSendError) as excinfo:
+        asyncio.run(scenario())
+    assert excinfo.value.status_code == 503
+    assert calls == 3
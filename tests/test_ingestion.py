@@ -0,0 +1,151 @@
+import gzip
+import io
+import json
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+
+from app.services.csv_loader import CSVParsingError, RecipientStreamParser, parse_recipients
+
+_CSV = "title,first_name,last_name,email,Company\nDr.,Ada,Lovelace,ada@example.com,Analytical\nMs.,Bad,Row,nope,X\n"
+
+_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+
+def _xlsx() -> bytes:
+    """A minimal workbook with shared, rich, inline, numeric and boolean cells."""
+
+    shared = ["title", "first_name", "last_name", "email", "Dr.", "Ada"]
+    items = "".join(f"<si><t>{text}</t></si>" for text in shared)
+    items += "<si><r><t>Love</t></r><r><t>lace</t></r><rPh><t>x</t></rPh></si>"
+    sheet = (
+        f'<worksheet xmlns="{_MAIN}"><sheetData>'
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c>'
+        '<c r="D1" t="s"><v>3</v></c><c r="E1" t="inlineStr"><is><t>Seats</t></is></c>'
+        '<c r="F1" t="inlineStr"><is><t>VIP</t></is></c></row>'
+        '<row r="3"><c r="A3" t="s"><v>4</v></c><c r="B3" t="s"><v>5</v></c><c r="C3" t="s"><v>6</v></c>'
+        '<c r="D3" t="inlineStr"><is><t>ada@example.com</t></is></c><c r="E3"><v>42.0</v></c>'
+        '<c r="F3" t="b"><v>1</v></c></row>'
+        '<row r="4"><c r="B4" t="inlineStr"><is><t>No</t></is></c><c r="D4" t="str"><v>broken</v></c></row>'
+        "</sheetData></worksheet>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr(
+            "_rels/.rels",
+            f'<Relationships xmlns="{_PKG}"><Relationship Id="rId1" Type="{_REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+        )
+        archive.writestr(
+            "xl/workbook.xml",
+            f'<workbook xmlns="{_MAIN}" xmlns:r="{_REL}"><sheets><sheet name="People" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        )
+        archive.writestr(
+            "xl/_rels/workbook.xml.rels",
+            f'<Relationships xmlns="{_PKG}">'
+            f'<Relationship Id="rId1" Type="{_REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{_REL}/sharedStrings" Target="/xl/sharedStrings.xml"/>'
+            "</Relationships>",
+        )
+        archive.writestr("xl/sharedStrings.xml", f'<sst xmlns="{_MAIN}">{items}</sst>')
+        archive.writestr("xl/worksheets/sheet1.xml", sheet)
+    return buffer.getvalue()
+
+
+def _parse(data: bytes, chunk: int = 5) -> RecipientStreamParser:
+    parser = RecipientStreamParser()
+    for start in range(0, len(data), chunk):
+        parser.feed(data[start : start + chunk])
+    return parser
+
+
+def test_gzip_csv_is_streamed_through_the_csv_parser() -> None:
+    # Two gzip members, as produced by appending compressed files.
+    data = gzip.compress(_CSV[:60].encode()) + gzip.compress(_CSV[60:].encode())
+    parser = _parse(data, chunk=3)
+    result = parser.close()
+    assert parser.format == "csv+gzip"
+    assert [row["company"] for row in result.recipients.rows()] == ["Analytical"]
+    assert result.errors[0].startswith("Row 3:")
+
+    with pytest.raises(CSVParsingError, match="truncated"):
+        _parse(data[:-4]).close()
+
+
+def test_xlsx_rows_are_read_from_the_first_worksheet() -> None:
+    parser = _parse(_xlsx(), chunk=64)
+    result = parser.close()
+    assert parser.format == "xlsx"
+    assert result.recipients.columns[-2:] == ("seats", "vip")
+    assert result.recipients.row(0) == {
+        "title": "Dr.",
+        "first_name": "Ada",
+        "last_name": "Lovelace",
+        "email": "ada@example.com",
+        "seats": "42",
+        "vip": "TRUE",
+    }
+    assert len(result.errors) == 1 and result.errors[0].startswith("Row 4:")
+
+    broken = io.BytesIO()
+    with zipfile.ZipFile(broken, "w") as archive:
+        archive.writestr("readme.txt", "not a workbook")
+    with pytest.raises(CSVParsingError, match="not an XLSX workbook"):
+        _parse(broken.getvalue()).close()
+
+
+def test_ndjson_records_become_recipients() -> None:
+    lines = [
+        {"title": "Dr.", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com", "Team": "R&D"},
+        {"title": "Mr.", "first_name": "No", "last_name": "Mail", "email": "missing"},
+    ]
+    data = b"\xef\xbb\xbf\n" + b"\n".join(json.dumps(line).encode() for line in lines) + b"\n"
+    parser = _parse(data, chunk=7)
+    result = parser.close()
+    assert parser.format == "ndjson"
+    assert result.recipients.row(0)["team"] == "R&D"
+    assert result.errors[0].startswith("Record 3:")
+
+    with pytest.raises(CSVParsingError, match=r"Line 3: invalid JSON"):
+        _parse(data.replace(b'"Mr."', b"Mr.")).close()
+
+
+def test_format_comes_from_content_not_filename() -> None:
+    upload = UploadFile(filename="recipients.csv", file=io.BytesIO(gzip.compress(_xlsx())))
+    result = parse_recipients(upload)
+    assert result.recipients.row(0)["email"] == "ada@example.com"
+    assert upload.file.tell() == 0
+
+    with pytest.raises(CSVParsingError, match="Missing required columns"):
+        parse_recipients(UploadFile(filename="people.xlsx", file=io.BytesIO(b"name,email\n")))
+
+
+def test_xlsx_bombs_are_refused(monkeypatch: pytest.MonkeyPatch) -> None:
+    from app.config import get_settings
+
+    workbook = _xlsx()
+    monkeypatch.setenv("BATCH_APP_MAX_UPLOAD_BYTES", "1024")
+    get_settings.cache_clear()
+    try:
+        with pytest.raises(CSVParsingError, match="expands to more than 1024 bytes"):
+            _parse(workbook, chunk=64).close()
+    finally:
+        get_settings.cache_clear()
+
+    monkeypatch.delenv("BATCH_APP_MAX_UPLOAD_BYTES")
+    monkeypatch.setenv("BATCH_APP_XLSX_MAX_SHARED_CHARS", "1024")
+    get_settings.cache_clear()
+    padded = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(workbook)) as source, zipfile.ZipFile(padded, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item)
+            if item.filename == "xl/sharedStrings.xml":
+                data = data.replace(b"</sst>", b"<si><t></t></si>" * 100 + b"</sst>")
+            target.writestr(item, data)
+    try:
+        with pytest.raises(CSVParsingError, match="shared strings exceed 1024"):
+            _parse(padded.getvalue(), chunk=64).close()
+    finally:
+        get_settings.cache_clear()
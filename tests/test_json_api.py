@@ -0,0 +1,111 @@
+import json
+from datetime import datetime, timedelta
+from typing import Generator
+
+import pytest
+from fastapi.testclient import TestClient
+from google.oauth2.credentials import Credentials
+
+from app.config import get_settings
+from app.services.api_tokens import api_token_session
+from app.services.send_queue import get_send_queue
+from app.services.token_store import get_token_store
+
+
+@pytest.fixture()
+def api(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[TestClient, None, None]:
+    monkeypatch.setenv("BATCH_APP_TOKEN_STORAGE_PATH", str(tmp_path / "tokens.json"))
+    monkeypatch.setenv("BATCH_APP_SEND_QUEUE_PATH", str(tmp_path / "queue.sqlite3"))
+    monkeypatch.setenv("BATCH_APP_SEND_MODE", "worker")
+    for getter in (get_settings, get_token_store, get_send_queue):
+        getter.cache_clear()
+    from app.main import create_app
+
+    with TestClient(create_app()) as client:
+        token = client.post("/api/v1/token").json()["token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+    for getter in (get_settings, get_token_store, get_send_queue):
+        getter.cache_clear()
+
+
+def _connect_gmail(client: TestClient) -> None:
+    session_id = api_token_session(client.headers["Authorization"].split()[1])
+    credentials = Credentials(
+        token="t",
+        refresh_token="r",
+        client_id="i",
+        client_secret="c",
+        expiry=datetime.utcnow() + timedelta(hours=1),
+    )
+    get_token_store().save_credentials(session_id, credentials)
+
+
+def test_requests_need_a_valid_token(api: TestClient) -> None:
+    response = api.get("/api/v1/batch", headers={"Authorization": "Bearer forged"})
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Bearer"
+
+
+def test_ndjson_upload_template_and_send(api: TestClient) -> None:
+    lines = [
+        {"title": "Dr.", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com", "Company": "AE"},
+        {"title": "Mr.", "first_name": "Charles", "last_name": "Babbage", "email": "cb@example.com", "Company": None},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\n"
+    response = api.put("/api/v1/recipients", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.json() == {
+        "count": 2,
+        "columns": ["title", "first_name", "last_name", "email", "company"],
+        "domain_warnings": {},
+    }
+
+    response = api.put("/api/v1/template", json={"subject": "Hi {{ first_name }}", "body": "From {{ company }}"})
+    assert response.status_code == 200
+    assert response.json()["counts"] == {"pending": 2}
+
+    assert api.post("/api/v1/send").status_code == 409
+    _connect_gmail(api)
+    response = api.post("/api/v1/send")
+    assert response.status_code == 202
+    assert response.json() == {"mode": "worker", "counts": {"queued": 2}}
+
+    page = api.get("/api/v1/messages", params={"limit": 1, "offset": 1, "include_body": True}).json()
+    assert page["total"] == 2
+    assert page["items"][0]["subject"] == "Hi Charles"
+    assert page["items"][0]["body"] == "From"
+
+
+def test_one_shot_batch_reports_validation_errors(api: TestClient) -> None:
+    response = api.post(
+        "/api/v1/batches",
+        json={
+            "recipients": [{"title": "Dr.", "first_name": "Ada", "last_name": "Lovelace", "email": "not-an-email"}],
+            "subject": "Hi",
+            "body": "Body",
+        },
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0].startswith("Record 1:")
+
+    response = api.post(
+        "/api/v1/batches",
+        json={
+            "recipients": [{"title": "Dr.", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com"}],
+            "subject": "Hi {{ nickname }}",
+            "body": "Body",
+        },
+    )
+    assert response.status_code == 422
+    assert "Unknown placeholder(s): nickname" in response.json()["detail"][0]
+
+
+def test_malformed_ndjson_lines_are_rejected(api: TestClient) -> None:
+    headers = {"Content-Type": "application/x-ndjson"}
+    response = api.put("/api/v1/recipients", content=b'{"first_name": "\xff"}\n', headers=headers)
+    assert response.status_code == 422
+    assert response.json()["detail"] == ["Line 1: not valid UTF-8"]
+
+    response = api.put("/api/v1/recipients", content=b"\n{broken\n", headers=headers)
+    assert response.status_code == 422
+    assert response.json()["detail"][0].startswith("Line 2: invalid JSON")
@@ -0,0 +1,47 @@
+import threading
+
+from fastapi.testclient import TestClient
+
+from app.services.metrics import MetricsRegistry
+
+
+def test_counters_and_histograms_sum_across_threads() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("demo_total", "Demo counter.", labelnames=("outcome",))
+    histogram = registry.histogram("demo_seconds", "Demo histogram.", buckets=(0.1, 1.0))
+
+    def work() -> None:
+        for _ in range(1000):
+            counter.labels("sent").inc()
+            histogram.observe(0.5)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    text = registry.render()
+    assert 'demo_total{outcome="sent"} 4000' in text
+    assert 'demo_seconds_bucket{le="0.1"} 0' in text
+    assert 'demo_seconds_bucket{le="1"} 4000' in text
+    assert 'demo_seconds_bucket{le="+Inf"} 4000' in text
+    assert "demo_seconds_sum 2000" in text
+
+
+def test_metrics_endpoint_reports_routes_and_parsing(client: TestClient) -> None:
+    csv_payload = "title,first_name,last_name,email\nDr.,Ada,Lovelace,ada@example.com\n"
+    client.post(
+        "/recipients",
+        files={"csv_file": ("recipients.csv", csv_payload, "text/csv")},
+        follow_redirects=False,
+    )
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert "bulkmailer_csv_rows_parsed_total" in body
+    assert "bulkmailer_batch_store_sessions" in body
+    assert 'bulkmailer_http_request_duration_seconds_count{method="POST",route="/recipients",status="303"}' in body
+    assert 'bulkmailer_http_requests_in_progress{method="GET",route="/metrics"} 1' in body
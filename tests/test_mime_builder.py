@@ -0,0 +1,77 @@
+import asyncio
+import base64
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from email.mime.text import MIMEText
+
+import pytest
+
+from app.services.mime_builder import MessageEncodingError, PreEncodedBatch, RawMessageBuilder
+
+CASES = [
+    ("ada@example.com", "Hi", "Body"),
+    ("ada@example.com", "", ""),
+    ("Ada Lovelace <ada@example.com>", "Héllo ünïcode ✉", "Bödy\nline two\r\n"),
+    ("ada@example.com", "x" * 69, "y" * 57),
+    ("ada@example.com", "x" * 70, "y" * 58),
+    ("ada@example.com", "word " * 40, "z" * 1000),
+    ("ada@example.com", "Line\nbreak", "tab\tbody"),
+]
+
+
+def _stdlib(to_email: str, subject: str, body: str) -> str:
+    message = MIMEText(body, "plain", "utf-8")
+    message["to"] = to_email
+    message["subject"] = subject
+    return base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
+
+
+@pytest.mark.parametrize("to_email,subject,body", CASES)
+def test_builder_matches_stdlib_bytes(to_email: str, subject: str, body: str) -> None:
+    builder = RawMessageBuilder()
+    # Build twice to make sure the reused buffer carries nothing over.
+    builder.build("other@example.com", "Other", "Other body")
+    assert builder.build(to_email, subject, body) == _stdlib(to_email, subject, body)
+
+
+def test_pre_encoded_batch_uses_process_pool() -> None:
+    messages = [(f"user{index}@example.com", f"Subject {index}", "Body") for index in range(10)]
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+    async def scenario() -> list[str]:
+        batch = PreEncodedBatch(messages, executor=pool, chunk_size=4)
+        return [await batch.raw(index) for index in reversed(range(len(messages)))]
+
+    try:
+        encoded = asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+    assert encoded == [_stdlib(*message) for message in reversed(messages)]
+
+
+def test_unencodable_message_fails_alone() -> None:
+    messages = [
+        ("ada@example.com", "Hi", "Body"),
+        ("ada@example.com", "Hi\nBcc: eve@example.com", "Body"),
+        ("ada@example.com", "Hi", "Body"),
+    ]
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+    async def scenario(executor) -> list[object]:
+        batch = PreEncodedBatch(messages, executor=executor, chunk_size=4)
+        results: list[object] = []
+        for index in range(len(messages)):
+            try:
+                results.append(await batch.raw(index))
+            except MessageEncodingError as exc:
+                results.append(exc)
+        return results
+
+    try:
+        for executor in (pool, None):
+            first, second, third = asyncio.run(scenario(executor))
+            assert first == third == _stdlib(*messages[0])
+            assert isinstance(second, MessageEncodingError)
+            assert "embedded header" in str(second)
+    finally:
+        pool.shutdown()
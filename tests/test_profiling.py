@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+from typing import Generator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import get_settings
+from app.services.profiler import SamplingProfiler, get_profile_store
+
+
+@pytest.fixture()
+def profiling_client(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[TestClient, None, None]:
+    monkeypatch.setenv("BATCH_APP_PROFILING_SECRET", "profile-secret")
+    monkeypatch.setenv("BATCH_APP_PROFILE_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setenv("BATCH_APP_PROFILING_INTERVAL_MS", "1")
+    get_settings.cache_clear()
+    get_profile_store.cache_clear()
+    from app.main import create_app
+
+    with TestClient(create_app()) as test_client:
+        yield test_client
+    get_settings.cache_clear()
+    get_profile_store.cache_clear()
+
+
+def test_profile_captured_only_with_valid_token(profiling_client: TestClient) -> None:
+    csv_payload = "title,first_name,last_name,email\n" + "Dr.,Ada,Lovelace,ada@example.com\n" * 2000
+
+    response = profiling_client.post(
+        "/recipients",
+        files={"csv_file": ("recipients.csv", csv_payload, "text/csv")},
+        follow_redirects=False,
+    )
+    assert "x-profile-id" not in response.headers
+
+    response = profiling_client.post(
+        "/recipients",
+        files={"csv_file": ("recipients.csv", csv_payload, "text/csv")},
+        headers={"X-Profile-Token": "profile-secret"},
+        follow_redirects=False,
+    )
+    profile_id = response.headers["x-profile-id"]
+
+    speedscope = profiling_client.get(
+        f"/profiles/{profile_id}", headers={"X-Profile-Token": "profile-secret"}
+    )
+    assert speedscope.status_code == 200
+    document = speedscope.json()
+    assert document["profiles"][0]["type"] == "sampled"
+    frame_names = {frame["name"] for frame in document["shared"]["frames"]}
+    assert "parse_recipients" in frame_names
+
+    collapsed = profiling_client.get(
+        f"/profiles/{profile_id}?format=collapsed&profile=profile-secret"
+    )
+    assert collapsed.status_code == 200
+    assert "parse_recipients" in collapsed.text
+
+    denied = profiling_client.get(f"/profiles/{profile_id}?profile=wrong")
+    assert denied.status_code == 404
+
+
+def test_sampling_requires_profiling_secret(monkeypatch: pytest.MonkeyPatch) -> None:
+    from pydantic import ValidationError
+
+    from app.config import Settings
+
+    monkeypatch.delenv("BATCH_APP_PROFILING_SECRET", raising=False)
+    monkeypatch.setenv("BATCH_APP_PROFILING_SAMPLE_RATE", "0.1")
+    with pytest.raises(ValidationError, match="PROFILING_SECRET"):
+        Settings()
+
+    monkeypatch.setenv("BATCH_APP_PROFILING_SECRET", "profile-secret")
+    assert Settings().profiling_sample_rate == 0.1
+
+
+def test_sampler_sees_work_moved_off_the_event_loop() -> None:
+    def blocking_parse() -> None:
+        deadline = time.perf_counter() + 0.2
+        while time.perf_counter() < deadline:
+            pass
+
+    async def handler() -> SamplingProfiler:
+        profiler = SamplingProfiler(threading.get_ident(), 0.001)
+        profiler.start()
+        await asyncio.to_thread(blocking_parse)
+        return profiler
+
+    profile = asyncio.run(handler()).stop("GET /")
+    assert any(frame[0].endswith("blocking_parse") for stack in profile.stacks for frame in stack)
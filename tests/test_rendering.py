@@ -0,0 +1,44 @@
+import anyio
+from fastapi import FastAPI, Request
+
+from app.api.rendering import stream_template
+
+
+def test_stream_template_flushes_in_chunks() -> None:
+    app = FastAPI()
+
+    @app.get("/")
+    async def page(request: Request):
+        context = {"error": "x" * 200, "message": None}
+        return stream_template(request, "landing.html", context, chunk_size=64)
+
+    sent: list[dict] = []
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    anyio.run(app, scope, receive, send)
+
+    assert sent[0]["status"] == 200
+    chunks = [m["body"] for m in sent if m["type"] == "http.response.body" and m.get("body")]
+    html = b"".join(chunks).decode("utf-8")
+    assert len(chunks) > 1
+    assert "x" * 200 in html
+    assert html.rstrip().endswith("</html>")
@@ -38,3 +38,20 @@ def test_full_preview_flow(client: TestClient) -> None:
     assert "Subject template:" in response.text
     assert "Subject preview: <strong>Hello Ada" in response.text
     assert "Send approved emails" in response.text
+
+
+def test_new_upload_forgets_the_previous_send_batch(client: TestClient) -> None:
+    from app.services.store import get_store
+
+    get_store.cache_clear()
+    csv_payload = "title,first_name,last_name,email\nDr.,Ada,Lovelace,ada@example.com\n"
+    client.post("/recipients", files={"csv_file": ("recipients.csv", csv_payload, "text/csv")})
+    client.post("/template", data={"subject_text": "Hi", "body_text": "Hello"})
+    ((_, state),) = get_store()._data.values()
+    state.send_batch_id = "previous"
+
+    client.post("/template", data={"subject_text": "Hi again", "body_text": "Hello"})
+    assert state.send_batch_id is None
+    state.send_batch_id = "previous"
+    client.post("/recipients", files={"csv_file": ("recipients.csv", csv_payload, "text/csv")})
+    assert state.send_batch_id is None
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from app.services.scheduler import ScheduleStore, Scheduler, SendPlan, release_times
+from app.services.send_queue import SendQueue
+
+NOW = datetime(2030, 6, 1, 8, 0, tzinfo=ZoneInfo("UTC")).timestamp()
+
+
+def _messages(count: int) -> list[tuple[int, str, str, str]]:
+    return [(index, f"user{index}@example.com", f"Subject {index}", "Body") for index in range(count)]
+
+
+def test_messages_are_spread_over_the_window() -> None:
+    plan = SendPlan(start_at=datetime(2030, 6, 1, 10, 0), timezone="Europe/Berlin", window_minutes=60)
+    releases = release_times(plan, [None] * 4, now=NOW)
+    # 10:00 in Berlin is 08:00 UTC.
+    assert [release - NOW for release in releases] == [0, 900, 1800, 2700]
+
+
+def test_hourly_cap_pushes_releases_apart() -> None:
+    plan = SendPlan(start_at=datetime(2030, 6, 1, 9, 0), max_per_hour=2)
+    releases = release_times(plan, [None] * 3, now=NOW)
+    start = NOW + 3600
+    assert releases == [start, start + 1800, start + 3600]
+
+
+def test_recipient_local_time_rolls_a_passed_start_forward() -> None:
+    plan = SendPlan(start_at=datetime(2030, 6, 1, 9, 0), recipient_local_time=True)
+    # 09:00 already passed in Tokyo (16:00 there) but is an hour away in London.
+    tokyo, london, fallback = release_times(plan, ["Asia/Tokyo", "Europe/London", None], now=NOW)
+    assert tokyo == datetime(2030, 6, 2, 9, 0, tzinfo=ZoneInfo("Asia/Tokyo")).timestamp()
+    assert london == NOW
+    assert fallback == NOW + 3600
+
+
+def test_unknown_plan_timezone_is_rejected() -> None:
+    with pytest.raises(ValueError):
+        SendPlan(start_at=datetime(2030, 1, 1), timezone="Mars/Olympus")
+    with pytest.raises(ValueError):
+        SendPlan(start_at=datetime(2030, 1, 1), window_minutes=-1)
+
+
+def test_scheduler_releases_due_messages_and_survives_restart(tmp_path) -> None:
+    queue = SendQueue(tmp_path / "queue.sqlite3")
+    store = ScheduleStore(queue)
+    plan = SendPlan(start_at=datetime(2030, 6, 1, 8, 0))
+    store.create("s1", "b1", plan, _messages(3), [NOW, NOW + 60, NOW + 120])
+
+    scheduler = Scheduler(store, poll_interval=0.01)
+    scheduler._discover()
+    assert scheduler.release_due(NOW + 61) == 2
+    assert scheduler.next_deadline() == NOW + 120
+    assert [result.message_index for result in queue.results("s1", "b1")] == [0, 1]
+
+    # A fresh scheduler (e.g. after a restart) picks up the remaining message.
+    restarted = Scheduler(ScheduleStore(queue), poll_interval=0.01)
+    restarted._discover()
+    assert restarted.release_due(NOW + 61) == 0
+    assert restarted.release_due(NOW + 121) == 1
+    assert scheduler.release_due(NOW + 121) == 0
+    assert queue.pending_count() == 3
+    [summary] = store.summaries("s1")
+    assert (summary.status, summary.released, summary.next_release_at) == ("released", 3, None)
+
+
+def test_cancel_returns_unreleased_messages(tmp_path) -> None:
+    store = ScheduleStore(SendQueue(tmp_path / "queue.sqlite3"))
+    plan_id = store.create("s1", "b1", SendPlan(start_at=datetime(2030, 6, 1)), _messages(3), [NOW, NOW + 1e6, NOW + 2e6])
+    store.release_due(plan_id, NOW)
+    assert store.cancel("other", plan_id) == (None, [])
+    assert store.cancel("s1", plan_id) == ("b1", [1, 2])
+    assert store.summaries("s1")[0].status == "cancelled"
+    assert store.scheduled_plan_ids() == set()
+
+
+def test_plan_created_after_a_purge_is_released(tmp_path) -> None:
+    queue = SendQueue(tmp_path / "queue.sqlite3")
+    store = ScheduleStore(queue)
+    plan = SendPlan(start_at=datetime(2030, 6, 1, 8, 0))
+    store.create("s1", "b1", plan, _messages(1), [NOW + 1e6])
+    scheduler = Scheduler(store, poll_interval=0.01)
+    scheduler._discover()
+
+    # Purging frees the plan's rowid; a new plan may reuse it.
+    store.purge_session("s1")
+    store.create("s2", "b2", plan, _messages(2), [NOW, NOW])
+    scheduler._discover()
+    assert scheduler.release_due(NOW) == 2
+    assert len(queue.results("s2", "b2")) == 2
+
+
+def test_run_stops_when_asked(tmp_path) -> None:
+    store = ScheduleStore(SendQueue(tmp_path / "queue.sqlite3"))
+    store.create("s1", "b1", SendPlan(start_at=datetime(2000, 1, 1)), _messages(1), [0.0])
+
+    async def scenario() -> None:
+        stop = asyncio.Event()
+        task = asyncio.create_task(Scheduler(store, poll_interval=0.01).run(stop))
+        await asyncio.sleep(0.05)
+        stop.set()
+        await task
+
+    asyncio.run(scenario())
+    assert store.summaries("s1")[0].released == 1
@@ -0,0 +1,204 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Generator
+
+import httpx
+import pytest
+from google.oauth2.credentials import Credentials
+
+from app.config import get_settings
+from app.services.gmail import GmailClient
+from app.services.send_queue import SendQueue, get_send_queue
+from app.services.token_store import get_token_store
+from app.worker import SendWorker
+
+
+@pytest.fixture()
+def worker_env(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[None, None, None]:
+    monkeypatch.setenv("BATCH_APP_TOKEN_STORAGE_PATH", str(tmp_path / "tokens.json"))
+    monkeypatch.setenv("BATCH_APP_SEND_QUEUE_PATH", str(tmp_path / "queue.sqlite3"))
+    monkeypatch.setenv("BATCH_APP_GMAIL_MAX_RETRIES", "0")
+    get_settings.cache_clear()
+    get_token_store.cache_clear()
+    get_send_queue.cache_clear()
+    yield
+    get_settings.cache_clear()
+    get_token_store.cache_clear()
+    get_send_queue.cache_clear()
+
+
+def _messages(count: int) -> list[tuple[int, str, str, str]]:
+    return [(index, f"user{index}@example.com", f"Subject {index}", "Body") for index in range(count)]
+
+
+def test_claims_are_exclusive_and_expired_leases_are_reclaimed(tmp_path) -> None:
+    queue = SendQueue(tmp_path / "queue.sqlite3", max_attempts=2)
+    queue.enqueue("session", "batch", _messages(3))
+
+    first = queue.claim("worker-a", limit=2, lease_seconds=0.05)
+    second = queue.claim("worker-b", limit=5, lease_seconds=30)
+    assert [job.message_index for job in first] == [0, 1]
+    assert [job.message_index for job in second] == [2]
+
+    time.sleep(0.1)
+    reclaimed = queue.claim("worker-b", limit=5, lease_seconds=0.05)
+    assert [job.message_index for job in reclaimed] == [0, 1]
+    assert all(job.attempts == 2 for job in reclaimed)
+    # worker-a lost its lease, so its late result is discarded.
+    assert not queue.complete(first[0].id, "worker-a", "sent")
+    assert queue.complete(second[0].id, "worker-b", "sent", sent_at=datetime(2024, 1, 1))
+
+    time.sleep(0.1)
+    assert queue.claim("worker-c", limit=5, lease_seconds=30) == []
+    results = {result.message_index: result for result in queue.results("session", "batch")}
+    assert results[0].status == "failed"
+    assert results[2].status == "sent"
+    assert results[2].sent_at == datetime(2024, 1, 1)
+    assert queue.pending_count() == 0
+
+
+def test_heartbeat_keeps_lease(tmp_path) -> None:
+    queue = SendQueue(tmp_path / "queue.sqlite3")
+    queue.enqueue("session", "batch", _messages(1))
+    (job,) = queue.claim("worker-a", limit=1, lease_seconds=0.05)
+    assert queue.heartbeat("worker-a", [job.id], lease_seconds=30) == 1
+    time.sleep(0.1)
+    assert queue.claim("worker-b", limit=1, lease_seconds=30) == []
+
+
+def test_finished_jobs_are_trimmed_and_purged_after_the_session_expires(tmp_path) -> None:
+    queue = SendQueue(tmp_path / "queue.sqlite3")
+    queue.enqueue("session", "batch", _messages(2))
+    (job,) = queue.claim("worker-a", limit=1, lease_seconds=30)
+    assert queue.complete(job.id, "worker-a", "sent", sent_at=datetime(2024, 1, 1))
+    rows = {row["message_index"]: row for row in queue.query("SELECT message_index, subject, body FROM send_jobs")}
+    assert (rows[0]["subject"], rows[0]["body"]) == ("", "")
+    assert rows[1]["body"] == "Body"
+
+    assert queue.purge_finished(older_than_seconds=3600) == 0
+    time.sleep(0.01)
+    assert queue.purge_finished(older_than_seconds=0) == 1
+    assert [result.message_index for result in queue.results("session", "batch")] == [1]
+    assert queue.pending_count() == 1
+
+
+def test_worker_sends_queued_jobs(worker_env: None) -> None:
+    sent: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request)
+        if len(sent) == 2:
+            return httpx.Response(400, json={"error": {"message": "Invalid To header"}})
+        return httpx.Response(200, json={"id": "abc"})
+
+    get_token_store().save_credentials(
+        "session",
+        Credentials(
+            token="t0k",
+            refresh_token="r",
+            client_id="id",
+            client_secret="secret",
+            expiry=datetime.utcnow() + timedelta(hours=1),
+        ),
+    )
+    queue = get_send_queue()
+    queue.enqueue("session", "batch", _messages(3))
+    queue.enqueue("other-session", "batch", _messages(1))
+
+    worker = SendWorker(
+        queue=queue,
+        gmail=GmailClient(transport=httpx.MockTransport(handler)),
+        worker_id="test-worker",
+        concurrency=1,
+    )
+    asyncio.run(worker.run(asyncio.Event(), drain=True))
+
+    statuses = [result.status for result in queue.results("session", "batch")]
+    assert statuses == ["sent", "failed", "sent"]
+    (orphan,) = queue.results("other-session", "batch")
+    assert orphan.status == "failed"
+    assert "not connected" in orphan.error_message
+    assert len(sent) == 3
+
+
+def test_worker_survives_sender_connect_errors(worker_env: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    from app.services.sender_pool import SenderPool
+
+    async def broken_connect(cls, gmail, session_id):
+        raise httpx.ConnectError("token endpoint unreachable")
+
+    monkeypatch.setattr(SenderPool, "connect", classmethod(broken_connect))
+    queue = get_send_queue()
+    queue.enqueue("session", "batch", _messages(2))
+
+    worker = SendWorker(queue=queue, gmail=GmailClient(), worker_id="test-worker")
+    asyncio.run(worker.run(asyncio.Event(), drain=True))
+
+    results = queue.results("session", "batch")
+    assert [result.status for result in results] == ["failed", "failed"]
+    assert "Could not load" in results[0].error_message
+    assert queue.pending_count() == 0
+
+
+def test_results_only_apply_to_the_recipients_they_were_queued_for(worker_env: None) -> None:
+    from app.models.domain import BatchState, Recipient, RenderedEmail
+    from app.services.batch_sending import sync_queue_results
+
+    queue = get_send_queue()
+    queue.enqueue("session", "old-batch", _messages(1))
+    (job,) = queue.claim("worker-a", limit=1, lease_seconds=30)
+    queue.complete(job.id, "worker-a", "sent", sent_at=datetime(2024, 1, 1))
+
+    recipient = Recipient(title="Dr.", first_name="Ada", last_name="Lovelace", email="ada@example.com")
+    state = BatchState(
+        messages=[RenderedEmail(recipient=recipient, subject="Hi", body="Body")],
+        send_batch_id="old-batch",
+    )
+    sync_queue_results("session", state)
+    assert state.messages[0].status == "pending"
+    assert state.messages[0].sent_at is None
+
+
+def test_unencodable_message_is_failed_not_retried(worker_env: None) -> None:
+    get_token_store().save_credentials(
+        "session",
+        Credentials(
+            token="t0k",
+            refresh_token="r",
+            client_id="id",
+            client_secret="secret",
+            expiry=datetime.utcnow() + timedelta(hours=1),
+        ),
+    )
+    queue = get_send_queue()
+    messages = _messages(3)
+    messages[1] = (1, "user1@example.com", "Hi\nBcc: eve@example.com", "Body")
+    queue.enqueue("session", "batch", messages)
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"id": "abc"}))
+    worker = SendWorker(queue=queue, gmail=GmailClient(transport=transport), worker_id="test-worker")
+    asyncio.run(worker.run(asyncio.Event(), drain=True))
+
+    results = queue.results("session", "batch")
+    assert [result.status for result in results] == ["sent", "failed", "sent"]
+    assert "embedded header" in results[1].error_message
+
+
+def test_inline_send_fails_only_the_unencodable_message() -> None:
+    from app.models.domain import BatchState, Recipient, RenderedEmail
+    from app.services.batch_sending import send_inline
+
+    class Senders:
+        async def send_raw(self, raw_message: str) -> dict:
+            return {"id": "abc"}
+
+    recipient = Recipient(title="Dr.", first_name="Ada", last_name="Lovelace", email="ada@example.com")
+    subjects = ["Hi", "Hi\nBcc: eve@example.com", "Hi"]
+    state = BatchState(
+        messages=[RenderedEmail(recipient=recipient, subject=subject, body="Body") for subject in subjects]
+    )
+    asyncio.run(send_inline("session", Senders(), state))  # type: ignore[arg-type]
+
+    assert [message.status for message in state.messages] == ["sent", "failed", "sent"]
+    assert "embedded header" in state.messages[1].error_message
@@ -0,0 +1,137 @@
+import asyncio
+from collections import Counter
+from typing import Generator
+
+import httpx
+import pytest
+from google.oauth2.credentials import Credentials
+
+from app.config import get_settings
+from app.services.gmail import GmailClient, GmailSendError
+from app.services.sender_pool import SenderLedger, SenderPool, TokenBucket, account_key, account_keys
+from app.services.token_store import get_token_store
+
+
+@pytest.fixture()
+def sender_env(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[None, None, None]:
+    monkeypatch.setenv("BATCH_APP_TOKEN_STORAGE_PATH", str(tmp_path / "tokens.json"))
+    monkeypatch.setenv("BATCH_APP_SENDER_DAILY_QUOTA", "100")
+    monkeypatch.setenv("BATCH_APP_GMAIL_MAX_RETRIES", "0")
+    get_settings.cache_clear()
+    get_token_store.cache_clear()
+    yield
+    get_settings.cache_clear()
+    get_token_store.cache_clear()
+
+
+def _send(handler, accounts: list[str], count: int, ledger: SenderLedger) -> tuple[Counter, list[str]]:
+    used: Counter = Counter()
+    errors: list[str] = []
+
+    def record(request: httpx.Request) -> httpx.Response:
+        token = request.headers["authorization"].split()[1]
+        used[token] += 1
+        return handler(token)
+
+    async def scenario() -> None:
+        gmail = GmailClient(transport=httpx.MockTransport(record))
+        pool = SenderPool(gmail, {name: Credentials(token=name) for name in accounts}, ledger=ledger)
+        for _ in range(count):
+            try:
+                await pool.send_raw("cmF3")
+            except GmailSendError as exc:
+                errors.append(str(exc))
+        await gmail.aclose()
+
+    asyncio.run(scenario())
+    return used, errors
+
+
+def test_weights_follow_remaining_quota(sender_env: None) -> None:
+    ledger = SenderLedger()
+    for _ in range(60):
+        ledger.account("b").record_success()
+    used, errors = _send(lambda token: httpx.Response(200, json={"id": "x"}), ["a", "b"], 30, ledger)
+    assert not errors
+    # 100 vs 40 messages left: "a" takes about 70% of the traffic.
+    assert 19 <= used["a"] <= 23
+    assert used["a"] + used["b"] == 30
+
+
+def test_errors_lower_an_accounts_share(sender_env: None) -> None:
+    ledger = SenderLedger()
+    used, errors = _send(
+        lambda token: httpx.Response(500 if token == "b" else 200, json={"id": "x"}), ["a", "b"], 20, ledger
+    )
+    assert used["a"] > 2 * used["b"]
+    assert ledger.account("b").error_rate > 0.5
+
+
+def test_throttled_account_fails_over(sender_env: None) -> None:
+    def handler(token: str) -> httpx.Response:
+        if token == "a":
+            return httpx.Response(429, json={"error": {"message": "slow down"}}, headers={"Retry-After": "60"})
+        return httpx.Response(200, json={"id": "x"})
+
+    ledger = SenderLedger()
+    used, errors = _send(handler, ["a", "b"], 10, ledger)
+    assert not errors
+    assert used["a"] == 1
+    assert used["b"] == 10
+    assert ledger.account("a").throttled()
+
+
+def test_daily_quota_is_spread_and_enforced(monkeypatch: pytest.MonkeyPatch, sender_env: None) -> None:
+    monkeypatch.setenv("BATCH_APP_SENDER_DAILY_QUOTA", "2")
+    get_settings.cache_clear()
+    used, errors = _send(lambda token: httpx.Response(200, json={"id": "x"}), ["a", "b"], 5, SenderLedger())
+    assert used == Counter({"a": 2, "b": 2})
+    assert errors == ["Daily sending quota reached for every connected account."]
+
+
+def test_token_bucket_reserves_in_order() -> None:
+    bucket = TokenBucket(rate=10, burst=2)
+    delays = [bucket.reserve() for _ in range(4)]
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2] == pytest.approx(0.1, abs=0.01)
+    assert delays[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_account_keys_lists_session_accounts(sender_env: None) -> None:
+    store = get_token_store()
+    for key in (account_key("s1", 1), account_key("s1", 10), account_key("s1", 2), account_key("s10", 1)):
+        store.save_credentials(key, Credentials(token="t", refresh_token="r", client_id="i", client_secret="c"))
+    assert account_keys("s1") == ["s1", "s1/sender/2", "s1/sender/10"]
+
+
+def test_connect_skips_accounts_that_cannot_refresh(sender_env: None) -> None:
+    from datetime import datetime, timedelta
+
+    store = get_token_store()
+    store.save_credentials(
+        account_key("s1", 1),
+        Credentials(token="t", refresh_token="r", client_id="i", client_secret="c", expiry=datetime(2000, 1, 1)),
+    )
+    store.save_credentials(
+        account_key("s1", 2),
+        Credentials(
+            token="t2",
+            refresh_token="r",
+            client_id="i",
+            client_secret="c",
+            expiry=datetime.utcnow() + timedelta(hours=1),
+        ),
+    )
+
+    def unreachable(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("token endpoint unreachable", request=request)
+
+    async def scenario() -> SenderPool:
+        gmail = GmailClient(transport=httpx.MockTransport(unreachable))
+        try:
+            return await SenderPool.connect(gmail, "s1")
+        finally:
+            await gmail.aclose()
+
+    pool = asyncio.run(scenario())
+    assert len(pool) == 1
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Cumulative import time budget for ``app.main`` in milliseconds. The best of a
+# few runs is compared so a single noisy sample does not fail the suite.
+IMPORT_BUDGET_MS = float(os.environ.get("BATCH_APP_IMPORT_BUDGET_MS", "1500"))
+
+HEAVY_MODULES = (
+    "googleapiclient",
+    "google_auth_oauthlib",
+    "docx",
+    "cryptography",
+)
+
+
+def _clean_env() -> dict[str, str]:
+    return {key: value for key, value in os.environ.items() if not key.startswith("BATCH_APP_")}
+
+
+def _import_profile() -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT,
+        env=_clean_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, module = (part.strip() for part in line[len("import time:") :].split("|"))
+        if cumulative_us.isdigit():
+            cumulative[module] = int(cumulative_us)
+    return cumulative
+
+
+def test_import_does_not_load_heavy_dependencies() -> None:
+    modules = _import_profile()
+    assert "app.main" in modules
+    loaded = [name for name in modules if name.split(".")[0] in HEAVY_MODULES]
+    assert loaded == []
+
+
+def test_import_time_within_budget() -> None:
+    best_ms = min(_import_profile()["app.main"] for _ in range(3)) / 1000
+    assert best_ms <= IMPORT_BUDGET_MS, f"import app.main took {best_ms:.0f}ms"
@@ -0,0 +1,80 @@
+import asyncio
+import io
+import json
+import logging
+from typing import Generator
+
+import pytest
+
+from app.services.sending import deliver
+from app.services.structured_logging import JsonFormatter, LogWriter, QueueLogHandler
+
+
+@pytest.fixture()
+def captured() -> Generator[tuple[io.StringIO, LogWriter], None, None]:
+    stream = io.StringIO()
+    writer = LogWriter(stream, JsonFormatter(), capacity=3, flush_interval=0.01)
+    handler = QueueLogHandler(writer)
+    logger = logging.getLogger("app.send")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    yield stream, writer
+    logger.removeHandler(handler)
+    writer.stop()
+
+
+def _lines(stream: io.StringIO) -> list[dict]:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_full_buffer_drops_and_reports(captured: tuple[io.StringIO, LogWriter]) -> None:
+    stream, writer = captured
+    logger = logging.getLogger("app.send")
+    for index in range(5):
+        logger.info("event %s", index, extra={"index": index})
+    # Nothing is written on the logging thread.
+    assert stream.getvalue() == ""
+    assert writer.dropped == 2
+
+    writer.start()
+    assert writer.flush()
+    lines = _lines(stream)
+    assert [line["index"] for line in lines[:3]] == [0, 1, 2]
+    assert lines[0]["message"] == "event 0" and lines[0]["logger"] == "app.send"
+    assert lines[3]["message"] == "log_records_dropped" and lines[3]["dropped"] == 2
+
+
+def test_send_outcomes_are_logged_per_message(captured: tuple[io.StringIO, LogWriter]) -> None:
+    stream, writer = captured
+    writer.start()
+
+    class Senders:
+        calls = 0
+
+        async def send_raw(self, raw_message: str) -> dict:
+            self.calls += 1
+            if self.calls == 2:
+                raise RuntimeError("rejected")
+            return {"id": "abc"}
+
+    async def scenario() -> None:
+        senders = Senders()
+        await deliver(senders, "ada@Example.com", "Hi", "Body")  # type: ignore[arg-type]
+        await deliver(senders, "bob@example.org", "Hi", "Body")  # type: ignore[arg-type]
+
+    asyncio.run(scenario())
+    assert writer.flush()
+    sent, failed = _lines(stream)
+    assert (sent["status"], sent["recipient_domain"], sent["level"]) == ("sent", "example.com", "INFO")
+    assert sent["bytes"] > 0 and sent["error"] is None
+    assert (failed["status"], failed["error"], failed["level"]) == ("failed", "rejected", "WARNING")
+
+
+def test_app_logs_reach_caplog_after_create_app(caplog: pytest.LogCaptureFixture) -> None:
+    from app.main import create_app
+
+    create_app()
+    with caplog.at_level(logging.INFO, logger="app"):
+        logging.getLogger("app.send").info("visible to caplog")
+    assert "visible to caplog" in caplog.messages
+    assert logging.getLogger("app").propagate
@@ -1,5 +1,7 @@
-from app.models.domain import Recipient, TemplateContent
-from app.services.template_renderer import TemplateRenderingError, render_email
+import pytest
+
+from app.models.domain import Recipient, RecipientTable, TemplateContent
+from app.services.template_renderer import TemplateRenderingError, render_batch, render_email
 
 
 def test_render_email_renders_placeholders() -> None:
@@ -25,3 +27,108 @@ def test_render_email_raises_for_unknown_variable() -> None:
         pass
     else:
         raise AssertionError("Expected TemplateRenderingError")
+
+
+def test_render_batch_uses_extra_columns_and_checks_placeholders_up_front() -> None:
+    table = RecipientTable(["title", "first_name", "last_name", "email", "company"])
+    table.append({"title": "Dr.", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com", "company": "AE"})
+    template = TemplateContent(subject_template="Hi {{ first_name }}", body_template="Greetings to {{ company }}")
+    [message] = render_batch(template, table)
+    assert message.body == "Greetings to AE"
+    assert message.recipient.email == "ada@example.com"
+
+    bad = TemplateContent(subject_template="Hi {{ first_name }}", body_template="{{ team }} and {{ region }}")
+    try:
+        render_batch(bad, table)
+    except TemplateRenderingError as exc:
+        assert str(exc).startswith("Unknown placeholder(s): region, team.")
+    else:
+        raise AssertionError("Expected TemplateRenderingError")
+
+
+def test_folded_templates_match_jinja() -> None:
+    from app.services.template_renderer import _env, compile_template
+
+    context = {"first_name": "O'Brien <Ann>", "title": "Dr. & Co", "last_name": "Lee"}
+    sources = [
+        "Dear {{ title }} {{ last_name }},\n\n  Static text {{ '<b>' }}\n",
+        "{{first_name}}{{ first_name }}",
+        "No placeholders at all\n",
+        "{% if title %}Hi {{ first_name|upper }}{% endif %}\n",
+    ]
+    for source in sources:
+        compiled = compile_template(source)
+        assert compiled.render(context) == _env.from_string(source).render(context).strip()
+    assert compile_template(sources[0]).segments is not None
+    assert compile_template(sources[3]).segments is None
+
+
+def test_render_batch_shares_identical_renders() -> None:
+    recipients = [
+        Recipient(title="Dr.", first_name=name, last_name="Lee", email=f"{name.lower()}@example.com")
+        for name in ("Ada", "Ada", "Bo")
+    ]
+    template = TemplateContent(subject_template="Monthly update", body_template="Hi {{ first_name }}")
+    messages = render_batch(template, recipients)
+    assert messages[0].subject is messages[2].subject
+    assert messages[0].body is messages[1].body
+    assert [message.body for message in messages] == ["Hi Ada", "Hi Ada", "Hi Bo"]
+
+
+def test_templates_run_sandboxed_within_a_budget() -> None:
+    from app.services.template_renderer import RenderLimits, compile_template
+
+    limits = RenderLimits(max_operations=1000, max_output_chars=500)
+    context = {"first_name": "Ada"}
+    assert compile_template("{% for i in range(3) %}{{ first_name }}{% endfor %}").render(context, limits) == "AdaAdaAda"
+    runaway = {
+        "{% for i in range(10**9) %}{% endfor %}": "operations",
+        "{% for i in range(500) %}{% for j in range(500) %}{% endfor %}{% endfor %}": "operations",
+        "{{ 'x' * 10**9 }}": "longer than 500",
+        "{% for i in range(100) %}{{ first_name * 2 }}{% endfor %}": "longer than 500",
+        "{{ ('a' * 100)|replace('a', 'aaaaaaaaaa')|length }}": "longer than 500",
+        "{{ ([first_name] * 50)|join(first_name * 5)|length }}": "longer than 500",
+        "{{ first_name.center(1000)|length }}": "longer than 500",
+        "{{ '{:>1000}'.format(first_name)|length }}": "longer than 500",
+        "{{ (10 ** 60) ** 60 }}": "Exponent",
+        "{{ first_name.__class__.__mro__ }}": "unsafe",
+    }
+    for source, reason in runaway.items():
+        with pytest.raises(TemplateRenderingError, match=reason):
+            compile_template(source).render(context, limits)
+
+
+def test_isolated_batch_render_is_stopped_by_timeout(monkeypatch) -> None:
+    from app.config import get_settings
+    from app.services.template_renderer import get_render_pool, shutdown_render_pool
+
+    monkeypatch.setenv("BATCH_APP_RENDER_TIMEOUT_SECONDS", "1")
+    get_settings.cache_clear()
+    shutdown_render_pool()
+    table = RecipientTable(["title", "first_name", "last_name", "email"])
+    table.append({"title": "Dr.", "first_name": "Ada", "last_name": "Lovelace", "email": "ada@example.com"})
+    try:
+        # Start the pool so the workers the timeout must kill can be watched.
+        render_batch(TemplateContent(subject_template="{{ 1 + 1 }}", body_template="Body"), table, isolated=True)
+        workers = list(get_render_pool()._executor._processes.values())
+        assert workers
+
+        # Iterating a string costs no operations, so only the timeout stops this.
+        slow = TemplateContent(
+            subject_template="Hi",
+            body_template='{% set s = "x" * 20000 %}{% for a in s %}{% for b in s %}{% endfor %}{% endfor %}',
+        )
+        with pytest.raises(TemplateRenderingError, match="longer than 1 seconds"):
+            render_batch(slow, table, isolated=True)
+        for worker in workers:
+            worker.join(5)
+            assert not worker.is_alive()
+
+        # The next render gets a fresh pool.
+        upper = TemplateContent(subject_template="Hi {{ first_name|upper }}", body_template="Body")
+        [message] = render_batch(upper, table, isolated=True)
+        assert message.subject == "Hi ADA" and message.recipient.email == "ada@example.com"
+        assert get_render_pool().timeout == 1
+    finally:
+        shutdown_render_pool()
+        get_settings.cache_clear()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Generator
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from google.oauth2.credentials import Credentials
+
+from app.config import get_settings
+from app.services.gmail import GmailClient
+from app.services.send_queue import get_send_queue
+from app.services.token_store import get_token_store
+from app.services.tracing import get_tracer, parse_traceparent
+from app.worker import SendWorker
+
+_GETTERS = (get_settings, get_token_store, get_send_queue, get_tracer)
+
+
+@pytest.fixture()
+def trace_file(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[Path, None, None]:
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setenv("BATCH_APP_TRACING_ENABLED", "true")
+    monkeypatch.setenv("BATCH_APP_TRACE_EXPORT_PATH", str(path))
+    monkeypatch.setenv("BATCH_APP_TOKEN_STORAGE_PATH", str(tmp_path / "tokens.json"))
+    monkeypatch.setenv("BATCH_APP_SEND_QUEUE_PATH", str(tmp_path / "queue.sqlite3"))
+    for getter in _GETTERS:
+        getter.cache_clear()
+    yield path
+    get_tracer().shutdown()
+    for getter in _GETTERS:
+        getter.cache_clear()
+
+
+def _spans(path: Path) -> list[dict]:
+    assert get_tracer().processor is not None
+    assert get_tracer().processor.force_flush()
+    spans = []
+    for line in path.read_text().splitlines():
+        for resource in json.loads(line)["resourceSpans"]:
+            for scope in resource["scopeSpans"]:
+                spans.extend(scope["spans"])
+    return spans
+
+
+def _attributes(span: dict) -> dict:
+    return {item["key"]: next(iter(item["value"].values())) for item in span["attributes"]}
+
+
+def test_spans_nest_across_threads_and_record_errors(trace_file: Path) -> None:
+    tracer = get_tracer()
+
+    def in_thread() -> None:
+        with tracer.span("in-thread"):
+            pass
+
+    async def scenario() -> None:
+        with tracer.span("outer"):
+            await asyncio.to_thread(in_thread)
+            with pytest.raises(ValueError):
+                with tracer.span("failing"):
+                    raise ValueError("boom")
+
+    asyncio.run(scenario())
+    spans = {span["name"]: span for span in _spans(trace_file)}
+    assert spans["in-thread"]["parentSpanId"] == spans["outer"]["spanId"]
+    assert spans["failing"]["parentSpanId"] == spans["outer"]["spanId"]
+    assert spans["failing"]["status"] == {"code": 2, "message": "boom"}
+    assert "parentSpanId" not in spans["outer"]
+
+
+def test_request_span_continues_caller_trace(trace_file: Path) -> None:
+    from app.main import create_app
+
+    caller = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    csv_payload = "title,first_name,last_name,email\nDr.,Ada,Lovelace,ada@example.com\n"
+    with TestClient(create_app()) as client:
+        response = client.post(
+            "/recipients",
+            files={"csv_file": ("recipients.csv", csv_payload, "text/csv")},
+            headers={"traceparent": caller},
+            follow_redirects=False,
+        )
+    trace_id, span_id = parse_traceparent(response.headers["traceparent"]) or ("", "")
+    assert trace_id == "4bf92f3577b34da6a3ce929d0e0e4736"
+
+    spans = {span["name"]: span for span in _spans(trace_file)}
+    server = spans["POST /recipients"]
+    assert server["spanId"] == span_id and server["parentSpanId"] == "00f067aa0ba902b7"
+    assert _attributes(server)["http.response.status_code"] == "303"
+    parse = spans["csv.parse_recipients"]
+    assert parse["parentSpanId"] == span_id
+    assert _attributes(parse)["recipients.valid"] == "1"
+
+
+def test_worker_send_spans_show_where_time_goes(trace_file: Path) -> None:
+    get_token_store().save_credentials(
+        "session",
+        Credentials(
+            token="t0k",
+            refresh_token="r",
+            client_id="id",
+            client_secret="secret",
+            expiry=datetime.utcnow() + timedelta(hours=1),
+        ),
+    )
+    queue = get_send_queue()
+    queue.enqueue("session", "batch", [(0, "ada@example.com", "Hi", "Body")])
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"id": "abc"}))
+    worker = SendWorker(queue=queue, gmail=GmailClient(transport=transport), worker_id="test-worker")
+    asyncio.run(worker.run(asyncio.Event(), drain=True))
+
+    spans = _spans(trace_file)
+    by_id = {span["spanId"]: span for span in spans}
+    (send,) = [span for span in spans if span["name"] == "gmail.send"]
+    chain = []
+    while send is not None:
+        chain.append(send["name"])
+        send = by_id.get(send.get("parentSpanId", ""))
+    assert chain == ["gmail.send", "sender_pool.send", "send_message", "message", "worker.batch"]
+    assert {"token_store.load", "gmail.get_credentials", "mime.encode_wait"} <= {span["name"] for span in spans}
+    message = next(span for span in spans if span["name"] == "send_message")
+    assert _attributes(message)["message.recipient_domain"] == "example.com"
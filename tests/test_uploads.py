@@ -0,0 +1,111 @@
+from typing import Generator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import get_settings
+from app.services.csv_loader import CSVStreamParser
+from app.services.uploads import UploadError, UploadStore, get_upload_store
+
+_GETTERS = (get_settings, get_upload_store)
+
+
+@pytest.fixture()
+def api(monkeypatch: pytest.MonkeyPatch, tmp_path) -> Generator[TestClient, None, None]:
+    monkeypatch.setenv("BATCH_APP_UPLOAD_DIR", str(tmp_path / "uploads"))
+    for getter in _GETTERS:
+        getter.cache_clear()
+    from app.main import create_app
+
+    with TestClient(create_app()) as client:
+        token = client.post("/api/v1/token").json()["token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+    for getter in _GETTERS:
+        getter.cache_clear()
+
+
+def _csv(rows: int) -> bytes:
+    lines = ["Title,First Name,Last Name,Email,Note"]
+    lines += [f'Dr.,Ada{index},Lovelace,ada{index}@example.com,"line one\nline two"' for index in range(rows)]
+    lines.append("Dr.,Bad,Row,not-an-email,x")
+    return ("\n".join(lines) + "\n").encode("utf-8-sig")
+
+
+def test_stream_parser_validates_rows_as_chunks_arrive() -> None:
+    data = _csv(50)
+    parser = CSVStreamParser()
+    seen = []
+    # Chunk boundaries fall inside quoted fields and multi-byte characters.
+    for start in range(0, len(data), 7):
+        parser.feed(data[start : start + 7])
+        seen.append(parser.rows)
+    assert seen[len(seen) // 2] > 0
+    result = parser.close()
+    assert len(result.recipients) == 50
+    assert result.recipients.row(3)["note"] == "line one\nline two"
+    assert result.errors and result.errors[0].startswith("Row 52:")
+
+
+def test_chunked_upload_resumes_after_a_dropped_chunk(api: TestClient, tmp_path) -> None:
+    data = _csv(200)
+    created = api.post("/api/v1/uploads", json={"length": len(data)})
+    assert created.status_code == 201
+    upload = created.json()
+    url = created.headers["location"]
+    assert url == f"/api/v1/uploads/{upload['id']}" and upload["offset"] == 0
+
+    first = api.patch(url, content=data[:5000], headers={"Upload-Offset": "0"})
+    assert first.status_code == 200 and first.headers["upload-offset"] == "5000"
+    assert first.json()["rows"] > 0
+
+    # A retried chunk that was already received is refused with the offset to resume from.
+    stale = api.patch(url, content=data[:5000], headers={"Upload-Offset": "0"})
+    assert stale.status_code == 409 and stale.headers["upload-offset"] == "5000"
+    assert api.get(url).json()["offset"] == 5000
+
+    incomplete = api.post(f"{url}/complete")
+    assert incomplete.status_code == 409
+
+    rest = api.patch(url, content=data[5000:], headers={"Upload-Offset": "5000"})
+    assert rest.json()["offset"] == len(data)
+    assert (tmp_path / "uploads" / f"{upload['id']}.part").read_bytes() == data
+
+    done = api.post(f"{url}/complete")
+    assert done.status_code == 422
+    detail = done.json()["detail"]
+    assert len(detail) == 1 and detail[0].startswith("Row 202:")
+    assert api.get(url).status_code == 404
+    assert not (tmp_path / "uploads" / f"{upload['id']}.part").exists()
+
+
+def test_completed_upload_becomes_the_batch(api: TestClient) -> None:
+    data = _csv(3).replace(b"Dr.,Bad,Row,not-an-email,x\n", b"")
+    url = api.post("/api/v1/uploads").headers["location"]
+    api.patch(url, content=data, headers={"Upload-Offset": "0"})
+    done = api.post(f"{url}/complete")
+    assert done.status_code == 200
+    assert done.json()["count"] == 3 and done.json()["columns"][-1] == "note"
+    assert api.get("/api/v1/batch").json()["recipients"] == 3
+
+    bad = api.post("/api/v1/uploads").headers["location"]
+    response = api.patch(bad, content=b"name,email\nAda,ada@example.com\n", headers={"Upload-Offset": "0"})
+    assert response.status_code == 422 and "Missing required columns" in response.json()["detail"]
+
+
+def test_idle_uploads_are_purged_and_sessions_are_capped(tmp_path) -> None:
+    store = UploadStore(tmp_path, max_bytes=1 << 20, expiry_seconds=60, max_per_session=2)
+    first = store.create("session")
+    store.create("session")
+    with pytest.raises(UploadError) as refused:
+        store.create("session")
+    assert refused.value.status_code == 429
+    other = store.create("other-session")
+
+    # Going idle past the expiry removes the upload the next time the store is used.
+    first.touched -= 120
+    store.get("other-session", other.id)
+    assert not first.path.exists()
+    with pytest.raises(UploadError):
+        store.get("session", first.id)
+    store.create("session")